@@ -0,0 +1,211 @@
+import argparse
+import contextlib
+import gc
+import io
+import re
+import sys
+import time
+import tracemalloc
+from collections.abc import Mapping
+
+import numpy as np
+import pandas as pd
+
+# Compact in-memory agency records for process_agencies.merge_agencies.
+#
+# An agency used to be a dict of its fields, with an hours dict of day lists
+# of {"start", "end"} dicts; at millions of HOO rows the merged agencies'
+# memory went mostly to that dict overhead. An Agency is now a __slots__ record:
+#
+#   - text fields are plain attributes, and the values repeated across
+#     agencies (region, county, distribution model, food format, cultures...)
+#     are interned, so every agency points at one shared string
+#   - cultures served are a tuple of those strings
+#   - time slots of all agencies merged together live in one AgencySlots table
+#     of packed arrays: day codes, and start and end times as seconds after
+#     midnight (times that aren't HH:MM:SS are kept as text, by code), with
+#     each agency's slots a range of rows found through its ordinal
+#
+# An Agency is a read-only Mapping with the keys and values of the old dict,
+# so agency['hours'] and dict(agency) work unchanged and build the JSON shape
+# on demand; json_output.RecordEncoder writes it as that same JSON object.
+# agency['hours'] builds a new dict on every access, so code that only reads
+# the slots goes through agency.iter_slots() (hours.agency_slots takes either
+# model) and leaves the dict to the JSON writer.
+#
+#   python agency_model.py --rows 10000 100000   # memory of the records against the dicts they replace
+
+# Keys of an agency's agencies.json record
+AGENCY_FIELDS = [
+    'name', 'address', 'phone', 'hours', 'appointment_needed',
+    'requirements', 'distribution_model', 'notes', 'cultures_served', 'food_format',
+]
+
+# Also readable as agency[key], but only the shard files write them (see shards.py)
+EXTRA_FIELDS = ['region', 'county']
+
+# Fields with few distinct values, stored as interned strings
+CATEGORICAL_FIELDS = ['region', 'county', 'appointment_needed', 'requirements', 'distribution_model', 'food_format']
+
+SECONDS_PATTERN = re.compile(r'^([01]\d|2[0-3]):([0-5]\d):([0-5]\d)$')
+
+# Time slots of a batch of agencies, grouped by agency ordinal in packed arrays
+class AgencySlots:
+    __slots__ = ('offsets', 'days', 'starts', 'ends', 'day_names', 'texts', 'formatted')
+
+    def __init__(self, ordinals, days, starts, ends, count):
+        order = np.argsort(ordinals, kind='stable')
+        self.offsets = np.concatenate([[0], np.cumsum(np.bincount(ordinals, minlength=count))]).astype(np.int64)
+        day_codes, self.day_names = pd.factorize(pd.Series(days, dtype=object))
+        self.day_names = [sys.intern(day) for day in self.day_names]
+        self.days = day_codes.astype(np.int16)[order]
+        self.texts = []
+        self.formatted = {}
+        text_codes = {}
+        self.starts = self.encode_times(starts, text_codes)[order]
+        self.ends = self.encode_times(ends, text_codes)[order]
+
+    # Seconds after midnight, or -1 - the code of a time kept as text
+    def encode_times(self, values, text_codes):
+        codes, uniques = pd.factorize(pd.Series(values, dtype=object))
+        encoded = []
+        for value in uniques:
+            match = SECONDS_PATTERN.match(value)
+            if match:
+                hours, minutes, seconds = map(int, match.groups())
+                encoded.append(hours * 3600 + minutes * 60 + seconds)
+            else:
+                if value not in text_codes:
+                    text_codes[value] = len(self.texts)
+                    self.texts.append(value)
+                encoded.append(-1 - text_codes[value])
+        return np.array(encoded, dtype=np.int32)[codes] if len(codes) else np.zeros(0, dtype=np.int32)
+
+    # Decoded times are shared, like the cleaned strings they came from
+    def time_text(self, value):
+        if value < 0:
+            return self.texts[-1 - value]
+        text = self.formatted.get(value)
+        if text is None:
+            text = self.formatted[value] = f"{value // 3600:02d}:{value // 60 % 60:02d}:{value % 60:02d}"
+        return text
+
+    # (day, start, end) of an agency's slots as text, in order
+    def iter_slots(self, ordinal):
+        first, last = self.offsets[ordinal], self.offsets[ordinal + 1]
+        for day, start, end in zip(self.days[first:last].tolist(), self.starts[first:last].tolist(), self.ends[first:last].tolist()):
+            yield self.day_names[day], self.time_text(start), self.time_text(end)
+
+    # Day name to list of {"start", "end"} slots, days in order of first appearance
+    def hours(self, ordinal):
+        hours = {}
+        for day, start, end in self.iter_slots(ordinal):
+            hours.setdefault(day, []).append({"start": start, "end": end})
+        return hours
+
+class Agency(Mapping):
+    __slots__ = ('name', 'address', 'region', 'county', 'phone', 'appointment_needed', 'requirements',
+                 'distribution_model', 'notes', 'food_format', 'cultures_served', 'slots', 'ordinal')
+
+    def __getitem__(self, key):
+        if key == 'hours':
+            return self.slots.hours(self.ordinal)
+        if key == 'cultures_served':
+            return list(self.cultures_served)
+        if key in AGENCY_FIELDS or key in EXTRA_FIELDS:
+            return getattr(self, key)
+        raise KeyError(key)
+
+    def __iter__(self):
+        return iter(AGENCY_FIELDS)
+
+    def __len__(self):
+        return len(AGENCY_FIELDS)
+
+    def __repr__(self):
+        return f"Agency({self.name!r})"
+
+    def iter_slots(self):
+        return self.slots.iter_slots(self.ordinal)
+
+    def add_cultures(self, cultures):
+        self.cultures_served += tuple(sys.intern(culture) for culture in cultures)
+
+# Agency records by name from the merged per-agency fields (indexed by name, in
+# order of first appearance) and the agencies' distinct time slots, in order
+def agency_records(merged, slots):
+    ordinals = merged.index.get_indexer(slots['name'])
+    table = AgencySlots(ordinals, slots['day'].to_numpy(), slots['start'].to_numpy(), slots['end'].to_numpy(), len(merged))
+
+    columns = {}
+    for field in ['address', 'phone', 'notes', *CATEGORICAL_FIELDS]:
+        values = merged[field].to_numpy()
+        if field in CATEGORICAL_FIELDS:
+            codes, uniques = pd.factorize(values)
+            values = np.array([sys.intern(value) for value in uniques], dtype=object)[codes] if len(codes) else values
+        columns[field] = values.tolist()
+
+    agencies_by_name = {}
+    for ordinal, name in enumerate(merged.index):
+        agency = Agency()
+        agency.name = name
+        for field, values in columns.items():
+            setattr(agency, field, values[ordinal])
+        agency.cultures_served = ()
+        agency.slots = table
+        agency.ordinal = ordinal
+        agencies_by_name[name] = agency
+    return agencies_by_name
+
+# Bytes still allocated after building something, and the thing
+def retained_bytes(build):
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    value = build()
+    gc.collect()
+    retained = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return retained, value
+
+# Compare the memory of the agency records with the plain dicts they replace
+# on synthetic workbooks. Only the records and the dicts are measured; the
+# pandas frames of the HOO and cultures rows they are built from, which the
+# pipeline holds at the same time, are listed for scale but are the same for
+# both models
+def main():
+    import benchmark_processing
+    import process_agencies
+
+    parser = argparse.ArgumentParser(description="Memory of the compact agency model against plain dicts on synthetic workbooks")
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000], help="Shopping Partners HOO rows of each synthetic data set")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    print("Memory retained by the agency records and by the equivalent dicts; the row frames (frames MB) are in neither")
+    print(f"{'HOO rows':>9} {'agencies':>9} {'slots':>8} {'frames MB':>10} {'records MB':>11} {'dicts MB':>9} {'records s':>10} {'dicts s':>8}")
+    for rows in args.rows:
+        workbooks = benchmark_processing.generate_workbooks(rows, args.seed)
+        with contextlib.redirect_stdout(io.StringIO()):
+            hoo_rows = pd.concat([process_agencies.process_hoo_data(workbooks[name]) for name in ['markets_hoo', 'shopping_hoo']],
+                                 ignore_index=True)
+            cultures = pd.concat([process_agencies.process_cultures_data(workbooks[name], column)
+                                  for name, column in [('markets_cultures', 'Agency Name'), ('shopping_cultures', 'Company Name')]],
+                                 ignore_index=True)
+
+        start = time.perf_counter()
+        records_bytes, agencies_by_name = retained_bytes(lambda: process_agencies.build_agencies_from_rows(hoo_rows, cultures))
+        records_time = time.perf_counter() - start
+        start = time.perf_counter()
+        dicts_bytes, dicts = retained_bytes(lambda: {name: dict(agency) for name, agency in agencies_by_name.items()})
+        dicts_time = time.perf_counter() - start
+
+        # Both models have to describe the same agencies
+        assert all(dict(agency) == dicts[name] for name, agency in agencies_by_name.items())
+        slot_count = sum(len(slots) for agency in dicts.values() for slots in agency['hours'].values())
+        frames_bytes = sum(frame.memory_usage(deep=True).sum() for frame in [hoo_rows, cultures])
+        print(f"{len(hoo_rows):>9} {len(agencies_by_name):>9} {slot_count:>8} {frames_bytes / 2 ** 20:>10.1f} "
+              f"{records_bytes / 2 ** 20:>11.1f} {dicts_bytes / 2 ** 20:>9.1f} {records_time:>10.2f} {dicts_time:>8.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,483 @@
+import argparse
+import contextlib
+import glob
+import hashlib
+import io
+import json
+import logging
+import os
+import signal
+import threading
+import time
+import urllib.parse
+from concurrent.futures import ProcessPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import etl
+import geocode
+import process_agencies
+import process_services
+from facets import FACETS, FLAGS, build_facets, query_facets
+from search_index import build_search_index, prepare_search, search
+from hours import DAYS, build_hours, minute_of_week, open_at
+from instrumentation import LOG_LEVELS, configure_logging, stage_records
+from validation import quarantine_frames
+from entity_resolution import match_records
+from distance_engine import (
+    ROUTERS, add_distance_arguments, build_engine, resolve_origin, nearest_by_road, load_route_cache, save_route_cache
+)
+from workbook_loader import add_cache_arguments, configure_cache
+
+# Long-running agency data service.
+#
+#   python agency_service.py --port 3002
+#   curl 'localhost:3002/api/agencies?service=housing&day=Saturday&q=church&page_size=20'
+#
+# The agency model is built from the workbooks once, the same way etl.py builds
+# agencies.json and services.json, and held in memory together with the facet,
+# search, hours and location indexes. Clients query it instead of downloading
+# and scanning the whole JSON files:
+#
+#   GET /api/agencies   filtered, paginated agencies. Filters are AND-ed, the
+#                       values of a repeated filter OR-ed:
+#                         service=<id>            listed under a wraparound service
+#                         day, time_block, culture, distribution_model,
+#                         food_format=<option>    the find-nearby page's facets
+#                         prepared_meals=1, home_delivery=1
+#                         open_day=<day>&open_time=<HH:MM>  open at that time
+#                         q=<text>                the page's search box
+#                         lat=&lng= or zip=       sort by distance, with
+#                         radius_miles=           an optional cutoff
+#                         page=1&page_size=50
+#   GET /api/distances  every geocoded agency by distance from origin=<ZIP
+#                       code, address or lat,lng>, by road for the k=10 nearest
+#                       (see distance_engine.py)
+#   GET /api/services   services with the number of agencies services.json
+#                       lists under them, and how many of those are in
+#                       agencies.json (the ones service=<id> can return)
+#   GET /api/health     version and size of the loaded model, last reload error
+#
+# Data/*.xlsx is polled for changes. A changed set of workbooks is rebuilt in
+# a separate process (so it doesn't hold the GIL away from the request threads)
+# while the old snapshot keeps serving; the new snapshot replaces it with a
+# single reference swap once it's complete, so no request ever sees a
+# half-built index. A failed rebuild is logged and the old
+# snapshot stays in place.
+#
+# Coordinates come from the geocode cache and ZIP centroids that
+# `etl.py locations` uses; the service itself never calls a geocoder. If
+# neither places any agency, a warning is logged at startup and the lat/lng,
+# zip and /api/distances queries answer 503 until a reload finds coordinates.
+#
+# load_test_service.py reports the latency percentiles of a running service.
+
+DEFAULT_PORT = 3002
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+ROUTE_SAVE_SECONDS = 30
+
+logger = logging.getLogger(__name__)
+
+# Add the service switches to a script's argument parser
+def add_service_arguments(parser):
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT, help=f"(default: {DEFAULT_PORT})")
+    parser.add_argument('--data-dir', default=etl.DATA_DIR, help="Directory of the CAFB workbooks (default: Data/)")
+    parser.add_argument('--poll', type=float, default=2.0, help="Seconds between checks for changed workbooks, 0 to disable (default: 2)")
+    parser.add_argument('--cors-origin', default=os.environ.get('FRONTEND_URL', '*'), help="Access-Control-Allow-Origin of the responses (default: $FRONTEND_URL or *)")
+    parser.add_argument('--zip-centroids', default=geocode.ZIP_CENTROIDS_PATH, help="ZCTA gazetteer for ZIP code locations (default: Data/zip_centroids.txt)")
+    parser.add_argument('--log-level', choices=LOG_LEVELS, default='INFO', help="DEBUG also logs every request and the build output (default: INFO)")
+
+# Modification time and size of every workbook in the data directory
+def data_signature(data_dir):
+    return tuple(sorted(
+        (os.path.basename(path), os.path.getmtime(path), os.path.getsize(path))
+        for path in glob.glob(os.path.join(data_dir, '*.xlsx'))
+    ))
+
+# Build an immutable snapshot of the agency model and its indexes
+def build_snapshot(data_dir, zip_centroids_path):
+    start = time.perf_counter()
+    # The pipeline's run records would otherwise grow with every build of the long-running process
+    del stage_records[:]
+    quarantine_frames.clear()
+    match_records.clear()
+    signature = data_signature(data_dir)
+    outputs = ['agencies', 'services']
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        model = etl.build_model(etl.load_sources(outputs, data_dir=data_dir), outputs)
+        agency_list = process_agencies.build_agency_list(
+            process_agencies.build_agencies_from_rows(model['agency_rows'], model['cultures'])
+        )
+        services_data = process_services.bucket_services(model['service_rows'], model['agency_info_by_id'], model['agency_info_by_name'])
+        locations = geocode.geocode_agencies(
+            agency_list, geocode.offline_geocoder(), geocode.load_geocode_cache(), geocode.load_zip_centroids(zip_centroids_path)
+        )
+    logger.debug(log.getvalue())
+    for ordinal, location in enumerate(locations):
+        location['ordinal'] = ordinal
+
+    # Services list agencies by the names in the services sheets; match them to agencies.json by name
+    ordinal_by_name = {agency['name'].lower(): ordinal for ordinal, agency in enumerate(agency_list)}
+    service_ordinals = {
+        service_id: {ordinal_by_name[entry['name'].lower()] for entry in entries if entry['name'].lower() in ordinal_by_name}
+        for service_id, entries in services_data.items()
+    }
+    unmatched = {entry['name'] for entries in services_data.values() for entry in entries
+                if entry['name'].lower() not in ordinal_by_name}
+    if unmatched:
+        logger.warning(f"{len(unmatched)} agencies listed under services aren't in agencies.json, "
+                       f"so service=<id> can't return them: {', '.join(sorted(unmatched)[:5])}{', ...' if len(unmatched) > 5 else ''}")
+
+    zip_centroids = dict(geocode.derive_zip_centroids(locations), **geocode.load_zip_centroids(zip_centroids_path))
+    located = sum(location['lat'] is not None for location in locations)
+    if not located:
+        logger.warning(f"No agency could be placed: neither the geocode cache '{geocode.GEOCODE_CACHE_PATH}' "
+                       f"nor the ZIP centroids '{zip_centroids_path}' has their coordinates. Location queries "
+                       f"(lat/lng, zip, /api/distances) are disabled; run `python etl.py locations` or pass --zip-centroids")
+    snapshot = {
+        'version': hashlib.sha256(json.dumps(signature).encode('utf-8')).hexdigest()[:12],
+        'built_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+        'signature': signature,
+        'agencies': agency_list,
+        'services': process_services.build_services_list(services_data),
+        'service_ordinals': service_ordinals,
+        'service_counts': {service_id: len(entries) for service_id, entries in services_data.items()},
+        'facets': build_facets(agency_list),
+        'search': prepare_search(build_search_index(agency_list), agency_list),
+        'hours': build_hours(agency_list)['index'],
+        'locations': geocode.prepare_locations({'agencies': locations, 'index': geocode.build_grid_index(locations)}),
+        'located': located,
+        'zip_centroids': zip_centroids,
+        'distances': build_engine(locations, zip_centroids),
+    }
+    logger.info(f"Loaded {len(agency_list)} agencies and {len(service_ordinals)} services "
+                f"in {time.perf_counter() - start:.2f}s (version {snapshot['version']})")
+    return snapshot
+
+class BadRequest(Exception):
+    pass
+
+# A query the loaded snapshot can't answer, e.g. by location when no agency has coordinates
+class Unavailable(Exception):
+    pass
+
+def require_locations(snapshot):
+    if not snapshot['located']:
+        raise Unavailable("Location queries are disabled: no agency has coordinates (see the service log)")
+
+def int_param(params, name, default, low, high):
+    try:
+        value = int(params.get(name, [default])[-1])
+    except ValueError:
+        raise BadRequest(f"{name} must be a whole number")
+    if not low <= value <= high:
+        raise BadRequest(f"{name} must be between {low} and {high}")
+    return value
+
+def float_param(params, name):
+    if name not in params:
+        return None
+    try:
+        return float(params[name][-1])
+    except ValueError:
+        raise BadRequest(f"{name} must be a number")
+
+# The point to sort by distance from, from lat/lng or a ZIP code, or None
+def query_point(snapshot, params):
+    lat, lng = float_param(params, 'lat'), float_param(params, 'lng')
+    if (lat is None) != (lng is None):
+        raise BadRequest("lat and lng go together")
+    if lat is not None:
+        if not geocode.is_coordinate(lat, lng):
+            raise BadRequest("lat must be within -90..90 and lng within -180..180")
+        require_locations(snapshot)
+        return lat, lng
+    if 'zip' in params:
+        require_locations(snapshot)
+        zip_code = params['zip'][-1].strip()[:5]
+        if zip_code not in snapshot['zip_centroids']:
+            raise BadRequest(f"Unknown ZIP code '{zip_code}'")
+        return snapshot['zip_centroids'][zip_code]
+    return None
+
+# Ordinals of the agencies passing every filter, or None if there is no filter
+def filter_ordinals(snapshot, params):
+    candidates = None
+
+    def narrow(matched):
+        nonlocal candidates
+        candidates = set(matched) if candidates is None else candidates & set(matched)
+
+    if 'service' in params:
+        unknown = [service for service in params['service'] if service not in snapshot['service_ordinals']]
+        if unknown:
+            raise BadRequest(f"Unknown service '{unknown[0]}'")
+        narrow(set().union(*(snapshot['service_ordinals'][service] for service in params['service'])))
+
+    selection = {facet: params[facet] for facet in FACETS if facet in params}
+    for facet, options in selection.items():
+        unknown = [option for option in options if option not in FACETS[facet][0]]
+        if unknown:
+            raise BadRequest(f"Unknown {facet} '{unknown[0]}', expected one of {', '.join(FACETS[facet][0])}")
+    flags = [flag for flag in FLAGS if params.get(flag, ['0'])[-1] in ('1', 'true', 'yes')]
+    if selection or flags:
+        narrow(query_facets(snapshot['facets'], selection, flags))
+
+    if 'open_day' in params or 'open_time' in params:
+        minute = minute_of_week(params.get('open_day', [''])[-1], params.get('open_time', [''])[-1])
+        if minute is None:
+            raise BadRequest(f"open_day must be one of {', '.join(DAYS)} and open_time a time like 17:30")
+        narrow(open_at(snapshot['hours'], minute))
+
+    term = params.get('q', [''])[-1]
+    if term:
+        narrow(search(snapshot['search'], term))
+
+    return candidates
+
+def query_agencies(snapshot, params):
+    page = int_param(params, 'page', 1, 1, 10 ** 6)
+    page_size = int_param(params, 'page_size', DEFAULT_PAGE_SIZE, 1, MAX_PAGE_SIZE)
+    candidates = filter_ordinals(snapshot, params)
+    point = query_point(snapshot, params)
+    radius = float_param(params, 'radius_miles')
+    agencies = snapshot['agencies']
+    first, last = (page - 1) * page_size, page * page_size
+
+    distances = {}
+    if point is None:
+        ordinals = sorted(candidates) if candidates is not None else range(len(agencies))
+        total = len(ordinals)
+        page_ordinals = ordinals[first:last]
+    else:
+        locations = snapshot['locations']['agencies']
+        if candidates is None and radius is None:
+            # The grid index only has to find the agencies up to the end of this page
+            nearest = geocode.nearest_locations(snapshot['locations'], *point, k=last)
+            ranked = [(miles, location['ordinal']) for miles, location in nearest]
+            total = sum(location['lat'] is not None for location in locations)
+        else:
+            ranked = sorted(
+                (geocode.haversine_miles(*point, locations[ordinal]['lat'], locations[ordinal]['lng']), ordinal)
+                for ordinal in (candidates if candidates is not None else range(len(agencies)))
+                if locations[ordinal]['lat'] is not None
+            )
+            if radius is not None:
+                ranked = [(miles, ordinal) for miles, ordinal in ranked if miles <= radius]
+            total = len(ranked)
+        distances = {ordinal: round(miles, 2) for miles, ordinal in ranked[first:last]}
+        page_ordinals = [ordinal for _, ordinal in ranked[first:last]]
+
+    results = []
+    for ordinal in page_ordinals:
+        agency = dict(agencies[ordinal], ordinal=ordinal)
+        if ordinal in distances:
+            agency['distance_miles'] = distances[ordinal]
+        results.append(agency)
+    return {
+        'version': snapshot['version'],
+        'total': total,
+        'page': page,
+        'page_size': page_size,
+        'agencies': results,
+    }
+
+def query_services(snapshot):
+    return {
+        'version': snapshot['version'],
+        'services': [
+            dict(service, agency_count=snapshot['service_counts'].get(service['id'], 0),
+                 matched_count=len(snapshot['service_ordinals'].get(service['id'], ())))
+            for service in snapshot['services']
+        ],
+    }
+
+# The current snapshot, the road distance cache and the reload bookkeeping shared by the handler threads
+class AgencyService:
+    def __init__(self, data_dir, zip_centroids_path, router, route_settings):
+        self.data_dir = data_dir
+        self.zip_centroids_path = zip_centroids_path
+        self.snapshot = build_snapshot(data_dir, zip_centroids_path)
+        self.reloads = 0
+        self.last_error = None
+        self.reload_lock = threading.Lock()
+        self.router = router
+        self.route_settings = route_settings
+        self.route_cache = load_route_cache(route_settings['path'], route_settings['ttl_days'])
+        self.route_cache_lock = threading.Lock()
+        self.routes_saved = True
+
+    # Road distances for a search; the cache outlives snapshots, it's keyed by address
+    def distances(self, snapshot, params):
+        if 'origin' not in params:
+            raise BadRequest("origin is required")
+        k = int_param(params, 'k', 10, 1, 100)
+        require_locations(snapshot)
+        engine = snapshot['distances']
+        origin = resolve_origin(engine, params['origin'][-1])
+        if origin is None:
+            raise BadRequest(f"Can't place '{params['origin'][-1]}', give a ZIP code or lat,lng")
+        distances, stats = nearest_by_road(
+            engine, origin, k, self.router, self.route_cache, self.route_cache_lock,
+            self.route_settings['ttl_days'], self.route_settings['max_entries']
+        )
+        if stats['routed']:
+            self.routes_saved = False
+        limit = int_param(params, 'limit', len(distances) or 1, 1, max(len(distances), 1))
+        agencies = snapshot['agencies']
+        return {
+            'version': snapshot['version'],
+            'origin': {'lat': origin['lat'], 'lng': origin['lng']},
+            'router': self.router.source,
+            'stats': stats,
+            'distances': [
+                {'ordinal': ordinal, 'name': agencies[ordinal]['name'], 'address': agencies[ordinal]['address'],
+                 'miles': round(miles, 2), 'by_road': by_road}
+                for ordinal, miles, by_road in distances[:limit]
+            ],
+        }
+
+    def save_routes(self):
+        if self.routes_saved:
+            return
+        with self.route_cache_lock:
+            self.routes_saved = True
+            save_route_cache(self.route_cache, self.route_settings['path'])
+
+    # Write new road distances to disk every interval seconds
+    def persist_routes(self, interval):
+        while True:
+            time.sleep(interval)
+            self.save_routes()
+
+    # Rebuild from the workbooks and swap the new snapshot in; the old one serves until then
+    def reload(self):
+        if not self.reload_lock.acquire(blocking=False):
+            return False
+        try:
+            with ProcessPoolExecutor(max_workers=1) as pool:
+                snapshot = pool.submit(build_snapshot, self.data_dir, self.zip_centroids_path).result()
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            logger.warning(f"Reload failed, still serving version {self.snapshot['version']}: {self.last_error}")
+            return False
+        else:
+            self.snapshot = snapshot
+            self.reloads += 1
+            self.last_error = None
+            return True
+        finally:
+            self.reload_lock.release()
+
+    # Reload whenever the workbooks change, once they have stopped changing for a poll interval
+    def watch(self, interval):
+        seen = self.snapshot['signature']
+        while True:
+            time.sleep(interval)
+            try:
+                current = data_signature(self.data_dir)
+            except OSError:
+                continue
+            if current == seen:
+                continue
+            time.sleep(interval)
+            if data_signature(self.data_dir) != current:
+                continue
+            logger.info("Workbooks changed, rebuilding the agency model...")
+            seen = current
+            self.reload()
+
+    def health(self):
+        snapshot = self.snapshot
+        return {
+            'version': snapshot['version'],
+            'built_at': snapshot['built_at'],
+            'agencies': len(snapshot['agencies']),
+            'services': len(snapshot['services']),
+            'located': snapshot['located'],
+            'workbooks': [name for name, _, _ in snapshot['signature']],
+            'reloads': self.reloads,
+            'last_error': self.last_error,
+            'cached_routes': len(self.route_cache),
+        }
+
+class AgencyHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # The default backlog of 5 drops connections under load, which then wait a second for a SYN retry
+    request_queue_size = 128
+
+def make_handler(service, cors_origin):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def send_json(self, status, body):
+            payload = json.dumps(body, separators=(',', ':')).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(payload)))
+            self.send_header('Access-Control-Allow-Origin', cors_origin)
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            url = urllib.parse.urlsplit(self.path)
+            params = urllib.parse.parse_qs(url.query)
+            # One snapshot for the whole request, even if a reload swaps it meanwhile
+            snapshot = service.snapshot
+            try:
+                if url.path == '/api/agencies':
+                    self.send_json(200, query_agencies(snapshot, params))
+                elif url.path == '/api/distances':
+                    self.send_json(200, service.distances(snapshot, params))
+                elif url.path == '/api/services':
+                    self.send_json(200, query_services(snapshot))
+                elif url.path == '/api/health':
+                    self.send_json(200, service.health())
+                else:
+                    self.send_json(404, {'error': f"No such endpoint '{url.path}'"})
+            except BadRequest as e:
+                self.send_json(400, {'error': str(e)})
+            except Unavailable as e:
+                self.send_json(503, {'error': str(e)})
+            except Exception as e:
+                logger.exception(f"Error serving {self.path}")
+                self.send_json(500, {'error': 'Failed to query agencies', 'details': str(e)})
+
+        def log_message(self, format, *args):
+            logger.debug(f"{self.address_string()} {format % args}")
+
+    return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve filtered, paginated agency queries from an in-memory index of the CAFB workbooks")
+    add_service_arguments(parser)
+    add_cache_arguments(parser)
+    add_distance_arguments(parser)
+    args = parser.parse_args()
+    configure_cache(args)
+    configure_logging(args.log_level)
+
+    route_settings = {'path': args.route_cache, 'ttl_days': args.route_ttl_days, 'max_entries': args.route_cache_size}
+    service = AgencyService(args.data_dir, args.zip_centroids, ROUTERS[args.router](), route_settings)
+    if args.poll > 0:
+        threading.Thread(target=service.watch, args=(args.poll,), daemon=True).start()
+    threading.Thread(target=service.persist_routes, args=(ROUTE_SAVE_SECONDS,), daemon=True).start()
+
+    server = AgencyHTTPServer((args.host, args.port), make_handler(service, args.cors_origin))
+    logger.info(f"Agency service listening on http://{args.host}:{args.port}/api/agencies")
+    # Stop on SIGTERM the same way as on Ctrl+C, saving the road distance cache
+    def stop(signum, frame):
+        raise KeyboardInterrupt
+    signal.signal(signal.SIGTERM, stop)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.save_routes()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,492 @@
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import math
+import os
+import platform
+import random
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import etl
+import process_agencies
+import process_services
+from facets import build_facets
+from search_index import build_search_index
+from hours import build_hours
+from json_output import write_json, RecordEncoder
+from instrumentation import stage, stage_records, summarize, peak_memory_mb
+from workbook_loader import cache_settings
+
+# Benchmark the agency/services pipeline on synthetic CAFB-shaped workbooks.
+#
+#   python benchmark_processing.py --sizes 1000 10000 100000 1000000
+#   python benchmark_processing.py --sizes 1000 10000 --repeat 3 --save-baseline
+#   python benchmark_processing.py --sizes 100000 --workers 1 2 4 8 16
+#
+# A size is the row count of the Shopping Partners HOO workbook; the other five
+# workbooks are scaled to their share of the real Data/ files. The generated
+# sheets have the same columns as the real ones, with the mess the real ones
+# have: padded and re-cased names, times as text, Excel times and AM/PM
+# strings, blank cells, abbreviated days, services outside the service map,
+# IDs the HOO sheets don't know and exact duplicate rows. Workbooks are
+# generated once per size into --workdir and reused on later runs.
+#
+# Every size runs in a fresh process (so peak memory is its own) through the
+# etl.py loading and merging stages plus the output builds, and reports the
+# wall time, rows and peak RSS of each stage. --save-baseline stores the
+# results in --baseline, by default the tracked benchmark_baseline.json next to
+# this script, so the baseline is committed with the code it was measured on;
+# later runs are compared against it and stages that got slower or bigger by
+# more than --tolerance are flagged, with a non-zero exit. Both sides are the
+# fastest of --repeat runs (at least MIN_BASELINE_REPEAT for a baseline), so a
+# single slow run doesn't count as a regression. Every run also times a fixed
+# reference workload, and when that ran slower than in the baseline the
+# baseline's times are scaled up to match, so a busy or throttled machine isn't
+# reported as slower code. A size with regressions is run --repeat more times
+# and only regressions the fastest of all those runs still has are reported.
+# Timings depend on the environment: a baseline measured on another machine,
+# Python or pandas version is reported and skipped, and has to be re-saved
+# there.
+#
+# With two or more sizes, the stages in SCALING_STAGES must also scale about
+# linearly: between consecutive sizes their time may grow at most as
+# rows ** MAX_SCALING_EXPONENT, so a return to per-row scans (O(n^2)) fails
+# the run even without a baseline.
+#
+# With --workers, the six workbooks are loaded through etl.py with each worker
+# count instead (cache disabled) and the speedup over one worker is reported.
+
+BASELINE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baseline.json')
+
+# Bumped when the generated workbooks change, so old ones are not reused
+GENERATOR_VERSION = 2
+
+# Rows of each workbook per Shopping Partners HOO row, as in Data/
+WORKBOOK_SCALE = {
+    'markets_hoo': 0.09,
+    'shopping_hoo': 1.0,
+    'markets_cultures': 0.045,
+    'shopping_cultures': 0.35,
+    'markets_services': 0.16,
+    'shopping_services': 1.13,
+}
+
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday', 'As Needed']
+DAY_WEIGHTS = [10, 17, 16, 18, 13, 19, 4, 2]
+START_TIMES = ['08:00:00', '09:00:00', '09:30:00', '10:00:00', '11:00:00', '12:00:00', '13:00:00', '16:00:00']
+END_TIMES = ['10:00:00', '11:00:00', '12:00:00', '13:00:00', '14:00:00', '15:00:00', '18:00:00', '19:30:00']
+FREQUENCIES = ['Every week', 'Every week', 'Every week', '1st of the Month', '2nd and 4th of the Month', 'Every Other Week']
+SERVICES = list(process_services.service_map.keys())
+UNMAPPED_SERVICES = ['Nutrition Education Materials and Resources', 'Other']
+CULTURES = ['Central/South Asian', 'East African', 'East Asian', 'Eastern European', 'Latin American',
+            'Middle Eastern/ North African', 'West African']
+COUNTIES = {
+    'DC': ['DC Ward 1', 'DC Ward 2', 'DC Ward 5', 'DC Ward 7', 'DC Ward 8'],
+    'MD': ["MD Prince George's County", 'MD Montgomery County', 'MD Frederick County'],
+    'VA': ['VA Fairfax County', 'VA Prince William County', 'VA Arlington County', 'VA Alexandria City'],
+}
+CITIES = {'DC': ('Washington', '200'), 'MD': ('Hyattsville', '207'), 'VA': ('Alexandria', '223')}
+DISTRIBUTION_MODELS = ['Walk up', 'Walk up', 'Home Delivery,Walk up', 'Drive thru,Walk up', 'Home Delivery', 'Drive thru', 'Other', None]
+FOOD_FORMATS = ['Client choice', 'Pre-bagged or boxed groceries', 'Prepared meals', None, None]
+REQUIREMENTS = [None, None, None, 'Photo ID', 'Proof of address', 'Photo ID,Proof of address']
+
+# Stages faster than this are too noisy to flag
+MIN_REGRESSION_SECONDS = 0.05
+MIN_REGRESSION_MB = 10.0
+
+# Runs per size a baseline keeps the fastest of, and the default for comparing with one
+MIN_BASELINE_REPEAT = 3
+
+# Stages whose time has to grow about linearly with their rows: 10x the rows
+# may take at most 10 ** 1.5 = 32x the time, against 100x for O(n^2). The
+# margin is for the larger heap of the bigger run, which alone takes service
+# bucketing from 10x to about 20x between 10k and 100k rows. Sizes where a
+# stage takes less than MIN_SCALING_SECONDS are too noisy to compare
+SCALING_STAGES = ['service_bucketing']
+MAX_SCALING_EXPONENT = 1.5
+MIN_SCALING_SECONDS = 0.02
+
+# A value with the mess hand-edited spreadsheets have: padding, other casing, blanks
+def dirty(rng, value, blank=0.01):
+    roll = rng.random()
+    if roll < blank:
+        return None
+    if roll < blank + 0.03:
+        return f" {value}  "
+    if roll < blank + 0.04:
+        return str(value).upper()
+    return value
+
+# A time cell as text, as an Excel time or as a 12-hour string
+def dirty_time(rng, value):
+    roll = rng.random()
+    if roll < 0.02:
+        return None
+    if roll < 0.12:
+        return datetime.time.fromisoformat(value)
+    if roll < 0.17:
+        return datetime.time.fromisoformat(value).strftime('%I:%M %p').lstrip('0')
+    return value
+
+def dirty_day(rng):
+    day = rng.choices(DAYS, DAY_WEIGHTS)[0]
+    roll = rng.random()
+    if roll < 0.02:
+        return day[:3]
+    if roll < 0.04:
+        return f"{day.lower()} "
+    return day
+
+# Fixed details of the agencies the rows of a sheet pick from
+def agency_pool(count, first_number, kind, rng):
+    agencies = []
+    for i in range(count):
+        region = rng.choice(list(COUNTIES))
+        city, zip_prefix = CITIES[region]
+        agencies.append({
+            'id': f"{first_number + i}-{kind}-0{1 + i % 3}",
+            # A few agencies share a name with another one, as in the real data
+            'name': f"Synthetic Agency {rng.randrange(count) if rng.random() < 0.02 else i}",
+            'region': region,
+            'county': rng.choice(COUNTIES[region]),
+            'address': f"{100 + i % 9000} Main St {city} {region} {zip_prefix}{i % 100:02d}",
+            'phone': f"({rng.choice(['202', '301', '703'])}) 555-{i % 10000:04d}",
+        })
+    return agencies
+
+# Append exact copies of a share of the rows and shuffle them in
+def with_duplicates(df, rng, share=0.05):
+    duplicates = df.sample(frac=share, random_state=rng.randrange(2 ** 32)) if len(df) > 1 else df.iloc[:0]
+    return pd.concat([df, duplicates], ignore_index=True).sample(frac=1, random_state=rng.randrange(2 ** 32)).reset_index(drop=True)
+
+def hoo_frame(rows, agencies, rng, shopping):
+    picks = [rng.choice(agencies) for _ in range(rows)]
+    columns = {
+        'External ID' if shopping else 'Agency ID': [dirty(rng, a['id'], blank=0.005) for a in picks],
+        'Agency Name': [dirty(rng, a['name']) for a in picks],
+    }
+    if shopping:
+        columns['Status'] = ['Active'] * rows
+        columns['Last SO Create Date'] = [pd.Timestamp('2025-01-01') + pd.Timedelta(days=rng.randrange(60)) for _ in picks]
+        columns['Agency Region'] = [a['region'] for a in picks]
+        columns['County/Ward'] = [a['county'] if rng.random() > 0.01 else None for a in picks]
+    columns['Shipping Address'] = [dirty(rng, a['address'], blank=0.02) for a in picks]
+    if shopping:
+        columns['Phone'] = [a['phone'] if rng.random() > 0.1 else None for a in picks]
+    columns['Day or Week'] = [dirty_day(rng) for _ in picks]
+    columns['Monthly Options' if shopping else 'Frequency'] = [rng.choice(FREQUENCIES) for _ in picks]
+    columns['Starting Time'] = [dirty_time(rng, rng.choice(START_TIMES)) for _ in picks]
+    columns['Ending Time'] = [dirty_time(rng, rng.choice(END_TIMES)) for _ in picks]
+    if shopping:
+        columns['By Appointment Only'] = [rng.choice(['No', 'No', 'No', 'Yes', 'yes', None]) for _ in picks]
+    columns['Food Pantry Requirements'] = [rng.choice(REQUIREMENTS) for _ in picks]
+    if shopping:
+        columns['Date of Last Verification'] = [pd.Timestamp('2024-10-01') + pd.Timedelta(days=rng.randrange(90)) for _ in picks]
+    columns['Distribution Models'] = [rng.choice(DISTRIBUTION_MODELS) for _ in picks]
+    columns['Food Format '] = [rng.choice(FOOD_FORMATS) for _ in picks]
+    if shopping:
+        columns['Additional Note on Hours of Operations'] = [rng.choice([None, None, None, 'walkups', 'Closed on holidays']) for _ in picks]
+    else:
+        columns['Choice Options '] = [rng.choice([None, 'Full Choice', 'Partial Choice']) for _ in picks]
+    return with_duplicates(pd.DataFrame(columns), rng)
+
+def services_frame(rows, agencies, rng):
+    picks = [rng.choice(agencies) for _ in range(rows)]
+    return with_duplicates(pd.DataFrame({
+        # Some rows only match their agency by name, or not at all
+        'Agency ID': [None if rng.random() < 0.03 else f"{a['id']}X" if rng.random() < 0.02 else a['id'] for a in picks],
+        'Agency Name': [dirty(rng, a['name'], blank=0) for a in picks],
+        'Wraparound Service': [dirty(rng, rng.choice(UNMAPPED_SERVICES)) if rng.random() < 0.01 else dirty(rng, rng.choice(SERVICES), blank=0)
+                               for _ in picks],
+    }), rng)
+
+def cultures_frame(rows, agencies, rng, name_column):
+    picks = rng.sample(agencies, min(rows, len(agencies))) + [rng.choice(agencies) for _ in range(max(rows - len(agencies), 0))]
+    return with_duplicates(pd.DataFrame({
+        'Agency ID': [a['id'] for a in picks],
+        name_column: [dirty(rng, a['name'], blank=0) for a in picks],
+        'Cultural Populations Served': [rng.choice([',', ', ']).join(rng.sample(CULTURES, rng.randint(1, 4))) if rng.random() > 0.02 else None
+                                        for _ in picks],
+    }), rng)
+
+# Generate the six CAFB workbooks for a Shopping Partners HOO row count
+def generate_workbooks(rows, seed=0):
+    rng = random.Random(seed)
+    counts = {name: max(int(rows * scale), 1) for name, scale in WORKBOOK_SCALE.items()}
+    pools = {
+        'markets': agency_pool(max(counts['markets_hoo'] * 9 // 10, 1), 15000, 'MOMK', rng),
+        'shopping': agency_pool(max(counts['shopping_hoo'] // 2, 1), 10000, 'PART', rng),
+    }
+
+    frames = {}
+    for prefix, pool in pools.items():
+        frames[f"{prefix}_hoo"] = hoo_frame(counts[f"{prefix}_hoo"], pool, rng, shopping=prefix == 'shopping')
+        frames[f"{prefix}_services"] = services_frame(counts[f"{prefix}_services"], pool, rng)
+        frames[f"{prefix}_cultures"] = cultures_frame(counts[f"{prefix}_cultures"], pool, rng, etl.CULTURES_NAME_COLUMNS[f"{prefix}_cultures"])
+    return frames
+
+# Write the synthetic workbooks for one size, unless they already exist
+def ensure_data_dir(workdir, rows):
+    data_dir = os.path.join(workdir, f"data_v{GENERATOR_VERSION}_{rows}")
+    if not all(os.path.exists(os.path.join(data_dir, name)) for name in etl.WORKBOOKS.values()):
+        print(f"Generating synthetic CAFB workbooks with {rows} Shopping Partners HOO rows...")
+        os.makedirs(data_dir, exist_ok=True)
+        for name, df in generate_workbooks(rows).items():
+            df.to_excel(os.path.join(data_dir, etl.WORKBOOKS[name]), index=False, engine='openpyxl')
+    return data_dir
+
+# Serialize the outputs built from a model, to check runs against each other
+def model_outputs(model):
+    agencies = process_agencies.build_agency_list(
+        process_agencies.build_agencies_from_rows(model['agency_rows'], model['cultures'])
+    )
+    services = process_services.bucket_services(model['service_rows'], model['agency_info_by_id'], model['agency_info_by_name'])
+    return json.dumps({'agencies': agencies, 'services': services}, cls=RecordEncoder)
+
+def run_workers(workdir, rows, worker_counts):
+    data_dir = ensure_data_dir(workdir, rows)
+    outputs = list(etl.OUTPUT_WORKBOOKS)
+    cache_settings['enabled'] = False
+
+    baseline_time = None
+    baseline_outputs = None
+    for workers in worker_counts:
+        model, load_time = timed(lambda: etl.build_model(etl.load_sources(outputs, workers, data_dir), outputs))
+        result, _ = timed(model_outputs, model)
+        if baseline_time is None:
+            baseline_time, baseline_outputs = load_time, result
+        print(f"{rows:>9} rows | {workers:>3} workers ({os.cpu_count()} CPUs) | load {load_time:8.2f}s | "
+              f"speedup {baseline_time / load_time:5.2f}x | "
+              f"{'identical' if result == baseline_outputs else 'DIFFERENT'} output")
+
+def timed(func, *args):
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        result = func(*args)
+    return result, time.perf_counter() - start
+
+# Fastest of a few runs of fixed string, dict and pandas work like the stages', to measure the machine's speed
+def reference_seconds(repeat=3):
+    rng = random.Random(0)
+    names = [f"  Agency {rng.randrange(5000)} {rng.choice(DAYS)}  " for _ in range(10000)]
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        frame = pd.DataFrame({'name': names, 'day': [name.split()[-1] for name in names]})
+        frame['key'] = frame['name'].str.strip().str.lower()
+        grouped = {key: list(days) for key, days in frame.groupby('key')['day']}
+        json.dumps(sorted(grouped.items()))
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+# Run every pipeline stage once on a generated data directory; meant for a fresh process
+def run_stages(data_dir, output_dir, cache):
+    cache_settings['enabled'] = cache
+    reference_s = reference_seconds()
+    outputs = ['agencies', 'services']
+    del stage_records[:]
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        model = etl.build_model(etl.load_sources(outputs, 1, data_dir), outputs)
+
+        with stage('agency_merge', rows_in=len(model['agency_rows'])) as record:
+            agency_list = process_agencies.build_agency_list(
+                process_agencies.build_agencies_from_rows(model['agency_rows'], model['cultures'])
+            )
+            record['rows_out'] = len(agency_list)
+        with stage('agency_indexes', rows_in=len(agency_list)) as record:
+            indexes = {'facets': build_facets(agency_list), 'search': build_search_index(agency_list), 'hours': build_hours(agency_list)}
+            record['rows_out'] = len(agency_list)
+        with stage('service_bucketing', rows_in=len(model['service_rows'])) as record:
+            services_data = process_services.bucket_services(model['service_rows'], model['agency_info_by_id'], model['agency_info_by_name'])
+            record['rows_out'] = sum(map(len, services_data.values()))
+
+        os.makedirs(output_dir, exist_ok=True)
+        write_json(os.path.join(output_dir, 'agencies.json'), {'agencies': agency_list})
+        for name, index in indexes.items():
+            write_json(os.path.join(output_dir, f"agency_{name}.json"), index)
+        write_json(os.path.join(output_dir, 'services.json'),
+                   {'services': process_services.build_services_list(services_data), 'agencyData': services_data})
+
+    return {
+        'total_s': time.perf_counter() - start,
+        'reference_s': reference_s,
+        'peak_rss_mb': peak_memory_mb(),
+        'stages': summarize(stage_records),
+    }
+
+# Best of several runs: fastest wall and CPU time, largest memory
+def best_of(results):
+    best = {
+        'total_s': min(r['total_s'] for r in results),
+        'reference_s': min(r['reference_s'] for r in results),
+        'peak_rss_mb': max(r['peak_rss_mb'] for r in results),
+        'stages': {},
+    }
+    for name in results[0]['stages']:
+        runs = [r['stages'][name] for r in results]
+        best['stages'][name] = dict(
+            runs[0],
+            wall_s=min(run['wall_s'] for run in runs),
+            cpu_s=min(run['cpu_s'] for run in runs),
+            peak_rss_mb=max(run['peak_rss_mb'] for run in runs),
+        )
+    return best
+
+def run(workdir, rows, repeat=1, cache=False):
+    data_dir = ensure_data_dir(workdir, rows)
+    output_dir = os.path.join(workdir, f"output_{rows}")
+    results = []
+    for _ in range(repeat):
+        # A fresh process per run, so the peak RSS is this size's alone
+        with ProcessPoolExecutor(max_workers=1) as pool:
+            results.append(pool.submit(run_stages, data_dir, output_dir, cache).result())
+    return best_of(results)
+
+def print_result(rows, result):
+    print(f"{rows:>9} rows | total {result['total_s']:8.2f}s | peak {result['peak_rss_mb']:8.1f} MB | reference {result['reference_s']:.3f}s")
+    for name, total in result['stages'].items():
+        rate = f"{total['rows_in'] / total['wall_s'] / 1000:9.1f}k rows/s" if total['rows_in'] and total['wall_s'] else ' ' * 16
+        print(f"          {name:<20} {total['wall_s']:8.3f}s  {total['rows_in']:>9} -> {total['rows_out']:<9} "
+              f"{rate}  {total['peak_rss_mb']:8.1f} MB")
+
+# Stages of a result that got slower, bigger or changed their output against the baseline,
+# with the baseline's times scaled up when this run's reference workload was slower
+def compare(rows, result, baseline, tolerance):
+    flagged = []
+    speed = max(1.0, result['reference_s'] / baseline['reference_s'] if baseline.get('reference_s') else 1.0)
+    if speed > 1.05:
+        print(f"{rows} rows: reference workload took {speed:.2f}x the baseline's time, baseline times scaled to match")
+    checks = [('total', result['total_s'], baseline['total_s'] * speed, MIN_REGRESSION_SECONDS, 's'),
+              ('peak memory', result['peak_rss_mb'], baseline['peak_rss_mb'], MIN_REGRESSION_MB, ' MB')]
+    for name, total in result['stages'].items():
+        base = baseline['stages'].get(name)
+        if base is None:
+            continue
+        checks.append((name, total['wall_s'], base['wall_s'] * speed, MIN_REGRESSION_SECONDS, 's'))
+        if total['rows_out'] != base['rows_out']:
+            flagged.append(f"{rows} rows: {name} output {base['rows_out']} -> {total['rows_out']} rows")
+    for name, value, base, floor, unit in checks:
+        if value > base * (1 + tolerance) and value - base > floor:
+            flagged.append(f"{rows} rows: {name} {base:.3f}{unit} -> {value:.3f}{unit} (+{(value / base - 1) * 100:.0f}%)")
+    return flagged
+
+# Stages of SCALING_STAGES whose time grew faster than linearly between consecutive sizes
+def check_scaling(results):
+    flagged = []
+    sizes = sorted(results)
+    for small, large in zip(sizes, sizes[1:]):
+        for name in SCALING_STAGES:
+            before, after = results[small]['stages'].get(name), results[large]['stages'].get(name)
+            if before is None or after is None or not before['rows_in'] or after['rows_in'] <= before['rows_in']:
+                continue
+            if before['wall_s'] < MIN_SCALING_SECONDS:
+                print(f"Scaling of {name} not checked from {small} rows: {before['wall_s']:.3f}s is too short to time")
+                continue
+            rows_ratio = after['rows_in'] / before['rows_in']
+            time_ratio = after['wall_s'] / before['wall_s']
+            exponent = math.log(time_ratio) / math.log(rows_ratio)
+            print(f"Scaling of {name} from {small} to {large} rows: {rows_ratio:.1f}x rows, {time_ratio:.1f}x time "
+                  f"(exponent {exponent:.2f}, limit {MAX_SCALING_EXPONENT})")
+            if exponent > MAX_SCALING_EXPONENT:
+                flagged.append(f"{small} -> {large} rows: {name} took {time_ratio:.1f}x the time for {rows_ratio:.1f}x the rows")
+    return flagged
+
+def load_baseline(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# What the timings depend on besides the code; a baseline is only compared within the same
+def environment():
+    return {
+        'machine': f"{platform.machine()} {platform.processor() or ''} {os.cpu_count()} CPUs".replace('  ', ' '),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'generator_version': GENERATOR_VERSION,
+    }
+
+def save_baseline(path, results, repeat):
+    baseline = load_baseline(path) or {}
+    if any(baseline.get(key) != value for key, value in environment().items()):
+        # Sizes measured elsewhere can't be mixed with these
+        baseline = {}
+    baseline.update(environment(), repeat=repeat)
+    baseline.setdefault('sizes', {}).update({str(rows): result for rows, result in results.items()})
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baseline, f, indent=2)
+    print(f"Baseline saved to '{path}'")
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark agency and services processing on synthetic workbooks")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000, 1000000], help="Shopping Partners HOO rows per run")
+    parser.add_argument('--workdir', default='benchmark_data')
+    parser.add_argument('--repeat', type=int, default=MIN_BASELINE_REPEAT, help=f"Runs per size; the fastest is kept (default: {MIN_BASELINE_REPEAT})")
+    parser.add_argument('--cache', action='store_true', help="Load the workbooks through the workbook cache (Parquet, or pickle for frames Parquet can't store), to time everything after the Excel parse")
+    parser.add_argument('--baseline', help=f"Baseline results to compare with (default: {BASELINE_PATH})")
+    parser.add_argument('--save-baseline', action='store_true', help="Store these results as the baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Slowdown or growth over the baseline flagged as a regression (default: 0.25)")
+    parser.add_argument('--workers', type=int, nargs='+', help="Benchmark parallel loading with these worker counts instead")
+    args = parser.parse_args()
+
+    if args.workers:
+        for rows in args.sizes:
+            run_workers(args.workdir, rows, args.workers)
+        return
+
+    if args.save_baseline and args.repeat < MIN_BASELINE_REPEAT:
+        parser.error(f"a baseline keeps the fastest of at least {MIN_BASELINE_REPEAT} runs, use --repeat {MIN_BASELINE_REPEAT} or more")
+
+    baseline_path = args.baseline or BASELINE_PATH
+    baseline = load_baseline(baseline_path)
+    differences = [f"{key} {baseline.get(key)!r}, not {value!r}" for key, value in environment().items()
+                   if baseline and baseline.get(key) != value]
+    if differences and not args.save_baseline:
+        print(f"Not comparing with baseline '{baseline_path}', it was measured with {'; '.join(differences)}. "
+              f"Re-save it here with --save-baseline to compare later runs")
+    if differences:
+        baseline = None
+    if baseline and args.repeat < baseline.get('repeat', 1):
+        print(f"Warning: comparing the fastest of {args.repeat} run(s) with a baseline of the fastest of {baseline['repeat']}")
+
+    results, flagged = {}, []
+    for rows in args.sizes:
+        results[rows] = run(args.workdir, rows, args.repeat, args.cache)
+        print_result(rows, results[rows])
+        if baseline and str(rows) in baseline['sizes']:
+            size_flagged = compare(rows, results[rows], baseline['sizes'][str(rows)], args.tolerance)
+            if size_flagged:
+                print(f"{rows} rows: {len(size_flagged)} possible regression(s), running {args.repeat} more time(s) to confirm")
+                results[rows] = best_of([results[rows], run(args.workdir, rows, args.repeat, args.cache)])
+                print_result(rows, results[rows])
+                size_flagged = compare(rows, results[rows], baseline['sizes'][str(rows)], args.tolerance)
+            flagged += size_flagged
+
+    scaling_flagged = check_scaling(results)
+    if scaling_flagged:
+        print(f"Stages scaling worse than rows ** {MAX_SCALING_EXPONENT}:")
+        for line in scaling_flagged:
+            print(f"  {line}")
+
+    if args.save_baseline:
+        save_baseline(baseline_path, results, args.repeat)
+    elif baseline:
+        if flagged:
+            print(f"Regressions against '{baseline_path}' (tolerance {args.tolerance:.0%}):")
+            for line in flagged:
+                print(f"  {line}")
+            sys.exit(1)
+        print(f"No regressions against '{baseline_path}' (tolerance {args.tolerance:.0%})")
+    if scaling_flagged:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,209 @@
+import argparse
+import json
+import os
+import statistics
+import time
+from collections.abc import Mapping
+
+import pandas as pd
+
+from hours import agency_slots, slot_interval
+from instrumentation import stage
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Binary exports of the agency and services data for downstream consumers.
+#
+#   python etl.py all --export parquet arrow msgpack
+#   python binary_export.py      # load time of every format in the export directory
+#
+# The analytics jobs and the data service only need the tables behind
+# agencies.json and services.json, and parsing the nested JSON text to get
+# them back is the slow part of their start-up. Next to the JSON, etl.py can
+# write to Data/export/:
+#
+#   parquet  agencies, agency_hours, agency_cultures and agency_services tables
+#            as Parquet files, with repeated text columns dictionary-encoded
+#   arrow    the same tables as Arrow IPC files, which can be memory-mapped and
+#            read without copying (pyarrow.ipc.open_file(pyarrow.memory_map(path)))
+#   msgpack  agencies.msgpack and services.msgpack, the nested frontend
+#            structures of agencies.json and services.json in MessagePack
+#
+# Agencies are numbered by their position in agencies.json (the ordinal the
+# other tables refer to). Service agencies get the ordinal of the agency with
+# the same lowercased name, as in agency_service.py, or null. parquet and
+# arrow need the pyarrow package and msgpack the msgpack package.
+
+EXPORT_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Data', 'export'))
+DATA_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'frontend', 'src', 'data'))
+
+EXPORT_FORMATS = ['parquet', 'arrow', 'msgpack']
+
+TABLES = ['agencies', 'agency_hours', 'agency_cultures', 'agency_services']
+
+AGENCY_TEXT_COLUMNS = ['name', 'address', 'phone', 'notes']
+AGENCY_CATEGORY_COLUMNS = ['appointment_needed', 'requirements', 'distribution_model', 'food_format']
+SERVICE_CATEGORY_COLUMNS = ['service', 'appointment_needed']
+
+# Add the export switches to a script's argument parser
+def add_export_arguments(parser):
+    parser.add_argument('--export', nargs='+', choices=EXPORT_FORMATS, default=[], help="Also write the data in these binary formats")
+    parser.add_argument('--export-dir', default=EXPORT_DIR, help=f"Directory of the binary exports (default: {EXPORT_DIR})")
+
+def agency_table(agency_list):
+    return pd.DataFrame({
+        'ordinal': pd.Series(range(len(agency_list)), dtype='int32'),
+        **{column: pd.Series([agency[column] for agency in agency_list], dtype=object) for column in AGENCY_TEXT_COLUMNS},
+        **{column: pd.Series([agency[column] for agency in agency_list], dtype='category') for column in AGENCY_CATEGORY_COLUMNS},
+    })
+
+# One row per time slot, with its minute-of-week interval when it can be parsed
+def hours_table(agency_list):
+    rows = []
+    for ordinal, agency in enumerate(agency_list):
+        for day, start, end in agency_slots(agency):
+            interval = slot_interval(day, start, end) or (None, None)
+            rows.append((ordinal, day, start, end, *interval))
+    table = pd.DataFrame(rows, columns=['ordinal', 'day', 'start', 'end', 'start_minute', 'end_minute'])
+    return table.astype({'ordinal': 'int32', 'day': 'category', 'start_minute': 'Int32', 'end_minute': 'Int32'})
+
+def cultures_table(agency_list):
+    rows = [(ordinal, culture) for ordinal, agency in enumerate(agency_list) for culture in agency['cultures_served']]
+    return pd.DataFrame(rows, columns=['ordinal', 'culture']).astype({'ordinal': 'int32', 'culture': 'category'})
+
+# One row per agency listed under a service
+def services_table(services_data, agency_list):
+    ordinal_by_name = {agency['name'].lower(): ordinal for ordinal, agency in enumerate(agency_list)}
+    rows = [
+        (service_id, agency['id'], agency['name'], ordinal_by_name.get(agency['name'].lower()), agency['address'],
+         agency['phone'], agency['appointment_needed'])
+        for service_id, agencies in services_data.items() for agency in agencies
+    ]
+    table = pd.DataFrame(rows, columns=['service', 'agency_id', 'name', 'ordinal', 'address', 'phone',
+                                        'appointment_needed'])
+    return table.astype({'ordinal': 'Int32', **{column: 'category' for column in SERVICE_CATEGORY_COLUMNS}})
+
+# The export tables of whichever of the agency list and services data were built
+def build_tables(agency_list=None, services=None):
+    tables = {}
+    if agency_list is not None:
+        tables['agencies'] = agency_table(agency_list)
+        tables['agency_hours'] = hours_table(agency_list)
+        tables['agency_cultures'] = cultures_table(agency_list)
+    if services is not None:
+        tables['agency_services'] = services_table(services['agencyData'], agency_list or [])
+    return tables
+
+def write_table(path, table, export_format):
+    arrow_table = pa.Table.from_pandas(table, preserve_index=False)
+    if export_format == 'parquet':
+        pq.write_table(arrow_table, path, compression='zstd')
+    else:
+        with pa.OSFile(path, 'wb') as sink, pa.ipc.new_file(sink, arrow_table.schema) as writer:
+            writer.write_table(arrow_table)
+
+# Agency records and other read-only mappings as plain maps
+def msgpack_default(value):
+    if isinstance(value, Mapping):
+        return dict(value)
+    raise TypeError(f"Can't pack {type(value).__name__}")
+
+def write_msgpack(path, data):
+    with open(path, 'wb') as f:
+        msgpack.pack(data, f, default=msgpack_default, use_bin_type=True)
+
+# Write the requested binary formats of the agency list (agencies.json order)
+# and the nested services data (services.json) built in this run
+def write_exports(formats, export_dir=EXPORT_DIR, agency_list=None, services=None):
+    os.makedirs(export_dir, exist_ok=True)
+    tables = None
+    for export_format in formats:
+        if export_format in ('parquet', 'arrow') and pa is None:
+            print(f"Warning: pyarrow is not installed, skipping the {export_format} export")
+            continue
+        if export_format == 'msgpack' and msgpack is None:
+            print("Warning: msgpack is not installed, skipping the msgpack export")
+            continue
+
+        with stage('binary_export', export_format) as record:
+            paths = []
+            if export_format == 'msgpack':
+                if agency_list is not None:
+                    paths.append(os.path.join(export_dir, 'agencies.msgpack'))
+                    write_msgpack(paths[-1], {'agencies': agency_list})
+                if services is not None:
+                    paths.append(os.path.join(export_dir, 'services.msgpack'))
+                    write_msgpack(paths[-1], services)
+            else:
+                if tables is None:
+                    tables = build_tables(agency_list, services)
+                for name, table in tables.items():
+                    paths.append(os.path.join(export_dir, f"{name}.{export_format}"))
+                    write_table(paths[-1], table, export_format)
+            record['rows_out'] = len(paths)
+        sizes = ', '.join(f"{os.path.basename(path)} {os.path.getsize(path) / 1024:.1f} KB" for path in paths)
+        print(f"Exported {export_format}: {sizes}")
+
+# Ways to load each export, as (format, files, loader) with loader(path) -> data
+def loaders(data_dir, export_dir):
+    def load_json(path):
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+
+    def load_msgpack(path):
+        with open(path, 'rb') as f:
+            return msgpack.unpack(f, raw=False, strict_map_key=False)
+
+    def load_arrow(path):
+        # Memory-mapped: the columns point into the mapped file instead of being copied
+        with pa.memory_map(path) as source:
+            return pa.ipc.open_file(source).read_all()
+
+    def load_arrow_pandas(path):
+        return load_arrow(path).to_pandas()
+
+    formats = [('json', [os.path.join(data_dir, f"{name}.json") for name in ['agencies', 'services']], load_json)]
+    if msgpack is not None:
+        formats.append(('msgpack', [os.path.join(export_dir, f"{name}.msgpack") for name in ['agencies', 'services']], load_msgpack))
+    if pa is not None:
+        formats += [
+            ('parquet', [os.path.join(export_dir, f"{name}.parquet") for name in TABLES], pq.read_table),
+            ('arrow (mmap)', [os.path.join(export_dir, f"{name}.arrow") for name in TABLES], load_arrow),
+            ('arrow -> pandas', [os.path.join(export_dir, f"{name}.arrow") for name in TABLES], load_arrow_pandas),
+        ]
+    return formats
+
+# Compare how long loading the same data takes in every format written
+def main():
+    parser = argparse.ArgumentParser(description="Compare the load time of the JSON outputs and the binary exports")
+    parser.add_argument('--data-dir', default=DATA_DIR, help=f"Directory of agencies.json and services.json (default: {DATA_DIR})")
+    parser.add_argument('--export-dir', default=EXPORT_DIR, help=f"Directory of the binary exports (default: {EXPORT_DIR})")
+    parser.add_argument('--repeat', type=int, default=20, help="Loads of each format, the median is reported (default: 20)")
+    args = parser.parse_args()
+
+    print(f"{'Format':<16} {'files':>5} {'size KB':>9} {'median ms':>10} {'min ms':>8}")
+    for name, paths, load in loaders(args.data_dir, args.export_dir):
+        missing = [path for path in paths if not os.path.exists(path)]
+        if missing:
+            print(f"{name:<16} missing {', '.join(os.path.basename(path) for path in missing)} (run etl.py with --export)")
+            continue
+        times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            for path in paths:
+                load(path)
+            times.append(time.perf_counter() - start)
+        size = sum(os.path.getsize(path) for path in paths) / 1024
+        print(f"{name:<16} {len(paths):>5} {size:>9.1f} {statistics.median(times) * 1000:>10.2f} {min(times) * 1000:>8.2f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,364 @@
+import argparse
+import json
+import os
+import re
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+import geocode
+from workbook_loader import CACHE_DIR_NAME, write_atomic
+
+# Distances from a user's location to the agencies, with as few routing calls as possible.
+#
+# Straight-line distances from the origin to every geocoded agency are one
+# vectorized haversine over NumPy arrays; for ZIP code origins they come from a
+# matrix of ZIP centroid to agency distances precomputed when the engine is
+# built. Road distances are only fetched for the agencies that can still be
+# among the k nearest by road: the k nearest in a straight line first, then any
+# agency whose straight-line distance (a lower bound of its road distance) is
+# below the k-th road distance found so far. That is O(k) routing lookups per
+# search instead of one per agency, sent as concurrent batches.
+#
+# Road distances are kept in a persistent LRU cache (Data/.cache/
+# route_distances.json) keyed by router, origin and agency address, expiring after
+# --route-ttl-days, so repeated searches from the same place don't route at all.
+#
+#   python distance_engine.py 20020 --k 10 --router straight
+#
+# agency_service.py serves the same thing as GET /api/distances.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+ROUTE_CACHE_PATH = os.path.normpath(os.path.join(BASE_DIR, '..', 'Data', CACHE_DIR_NAME, 'route_distances.json'))
+
+GOOGLE_ROUTE_MATRIX_URL = 'https://routes.googleapis.com/distanceMatrix/v2:computeRouteMatrix'
+PROXY_URL = os.environ.get('VITE_BACKEND_URL', 'http://localhost:3001')
+
+EARTH_RADIUS_MILES = geocode.EARTH_RADIUS_MILES
+METERS_PER_MILE = 1609.344
+
+# Destinations per routing request, as in computeDistanceMatrix
+ROUTE_BATCH_SIZE = 25
+ROUTE_WORKERS = 4
+# Stop widening the routed set past this many agencies per search
+MAX_ROUTED_FACTOR = 4
+# Roads are about this much longer than the straight line, for the straight router
+ROAD_FACTOR = 1.3
+
+# "38.86,-76.98"
+LAT_LNG_PATTERN = re.compile(r'^\s*(-?\d+(?:\.\d+)?)\s*,\s*(-?\d+(?:\.\d+)?)\s*$')
+
+# Add the distance switches to a script's argument parser
+def add_distance_arguments(parser):
+    parser.add_argument('--router', choices=list(ROUTERS), default='google', help="Road distance backend (default: google, straight when GOOGLE_MAPS_API_KEY is not set)")
+    parser.add_argument('--route-cache', default=ROUTE_CACHE_PATH, help="Persistent road distance cache (default: Data/.cache/route_distances.json)")
+    parser.add_argument('--route-ttl-days', type=float, default=30, help="Days before a cached road distance is fetched again (default: 30)")
+    parser.add_argument('--route-cache-size', type=int, default=100000, help="Road distances kept in the cache, least recently used dropped first (default: 100000)")
+
+# Router using the Google Routes API directly; a router maps an origin and
+# destinations ({'address', 'lat', 'lng'} dicts) to road miles or None for each
+def google_router():
+    api_key = os.environ.get('GOOGLE_MAPS_API_KEY')
+    if not api_key:
+        print("Warning: GOOGLE_MAPS_API_KEY is not set, using straight-line road estimates")
+        return straight_router()
+
+    # Geocoded points by coordinates; ZIP code centroids are too coarse, so those go by address
+    def waypoint(place):
+        if place.get('lat') is not None and place.get('source') not in (None, 'zip'):
+            return {'waypoint': {'location': {'latLng': {'latitude': place['lat'], 'longitude': place['lng']}}}}
+        return {'waypoint': {'address': place['address']}}
+
+    def route(origin, destinations):
+        request = urllib.request.Request(
+            GOOGLE_ROUTE_MATRIX_URL,
+            data=json.dumps({
+                'origins': [waypoint(origin)],
+                'destinations': [waypoint(destination) for destination in destinations],
+                'travelMode': 'DRIVE',
+                'routingPreference': 'TRAFFIC_AWARE',
+            }).encode('utf-8'),
+            headers={
+                'Content-Type': 'application/json',
+                'X-Goog-Api-Key': api_key,
+                'X-Goog-FieldMask': 'originIndex,destinationIndex,distanceMeters,condition',
+            },
+        )
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return route_miles(json.load(response), len(destinations))
+
+    route.source = 'google'
+    return route
+
+# Router going through routesApiProxy.js, the same way the frontend does
+def proxy_router():
+    def route(origin, destinations):
+        request = urllib.request.Request(
+            f"{PROXY_URL}/api/routes/matrix",
+            data=json.dumps({
+                'origin': origin['address'],
+                'destinations': [destination['address'] for destination in destinations],
+                'batchSize': len(destinations),
+            }).encode('utf-8'),
+            headers={'Content-Type': 'application/json'},
+        )
+        with urllib.request.urlopen(request, timeout=30) as response:
+            return route_miles(json.load(response), len(destinations))
+
+    route.source = 'proxy'
+    return route
+
+# Router estimating road distances from the straight line, for running without a routing key
+def straight_router():
+    def route(origin, destinations):
+        return [
+            geocode.haversine_miles(origin['lat'], origin['lng'], destination['lat'], destination['lng']) * ROAD_FACTOR
+            for destination in destinations
+        ]
+
+    route.source = 'straight'
+    return route
+
+# Road miles by destination index from a computeRouteMatrix response
+def route_miles(elements, count):
+    miles = [None] * count
+    for element in elements:
+        if element.get('condition', 'ROUTE_EXISTS') == 'ROUTE_EXISTS' and 'distanceMeters' in element:
+            miles[element.get('destinationIndex', 0)] = element['distanceMeters'] / METERS_PER_MILE
+    return miles
+
+# Router factories by --router name
+ROUTERS = {
+    'google': google_router,
+    'proxy': proxy_router,
+    'straight': straight_router,
+}
+
+# Road distance cache: an OrderedDict in least to most recently used order of
+# "origin|address" keys to {'miles', 'fetched_at'}, persisted as JSON
+def load_route_cache(path=ROUTE_CACHE_PATH, ttl_days=30):
+    cache = OrderedDict()
+    try:
+        with open(path, encoding='utf-8') as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        return cache
+    oldest = time.time() - ttl_days * 86400
+    for key, entry in entries:
+        if entry['fetched_at'] >= oldest:
+            cache[key] = entry
+    return cache
+
+def save_route_cache(cache, path=ROUTE_CACHE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def write(tmp_path):
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(list(cache.items()), f)
+
+    write_atomic(path, write)
+
+def cache_get(cache, key, ttl_days):
+    entry = cache.get(key)
+    if entry is None:
+        return None
+    if entry['fetched_at'] < time.time() - ttl_days * 86400:
+        del cache[key]
+        return None
+    cache.move_to_end(key)
+    return entry['miles']
+
+def cache_put(cache, key, miles, max_entries):
+    cache[key] = {'miles': miles, 'fetched_at': time.time()}
+    cache.move_to_end(key)
+    while len(cache) > max_entries:
+        cache.popitem(last=False)
+
+# Coordinates of the geocoded agencies as radian arrays, with their ordinals
+def location_arrays(locations):
+    located = [(ordinal, location) for ordinal, location in enumerate(locations) if location['lat'] is not None]
+    lat = np.radians(np.array([location['lat'] for _, location in located], dtype=np.float64))
+    return {
+        'ordinals': np.array([ordinal for ordinal, _ in located], dtype=np.int64),
+        'lat': lat,
+        'lng': np.radians(np.array([location['lng'] for _, location in located], dtype=np.float64)),
+        'cos_lat': np.cos(lat),
+    }
+
+# Straight-line miles from a point to every geocoded agency, in one pass over the arrays
+def haversine_to_all(arrays, lat, lng):
+    lat, lng = np.radians(lat), np.radians(lng)
+    a = np.sin((arrays['lat'] - lat) / 2) ** 2 + np.cos(lat) * arrays['cos_lat'] * np.sin((arrays['lng'] - lng) / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+# Everything needed to answer distance queries over one set of agency locations
+def build_engine(locations, zip_centroids):
+    arrays = location_arrays(locations)
+    zips = sorted(zip_centroids)
+    matrix = np.empty((len(zips), len(arrays['ordinals'])), dtype=np.float32)
+    for row, zip_code in enumerate(zips):
+        matrix[row] = haversine_to_all(arrays, *zip_centroids[zip_code])
+    return {
+        'locations': locations,
+        'arrays': arrays,
+        'zip_centroids': zip_centroids,
+        'zip_rows': {zip_code: row for row, zip_code in enumerate(zips)},
+        'zip_matrix': matrix,
+    }
+
+# The origin of a search as {'key', 'address', 'lat', 'lng'}: "lat,lng", or
+# the ZIP code centroid of a ZIP code or an address; None if it can't be placed,
+# including a "lat,lng" outside -90..90, -180..180
+def resolve_origin(engine, origin):
+    match = LAT_LNG_PATTERN.match(origin)
+    if match:
+        lat, lng = float(match.group(1)), float(match.group(2))
+        if not geocode.is_coordinate(lat, lng):
+            return None
+        return {'key': f"{lat:.4f},{lng:.4f}", 'address': origin, 'lat': lat, 'lng': lng, 'source': 'coordinates', 'zip': None}
+    zip_code = geocode.extract_zip(origin)
+    if zip_code in engine['zip_centroids']:
+        lat, lng = engine['zip_centroids'][zip_code]
+        return {
+            'key': geocode.normalize_address(origin), 'address': origin, 'lat': lat, 'lng': lng, 'source': 'zip',
+            'zip': zip_code if origin.strip() == zip_code else None,
+        }
+    return None
+
+# Straight-line miles from an origin to every geocoded agency, from the ZIP matrix when the origin is a bare ZIP code
+def straight_line_miles(engine, origin):
+    if origin['zip']:
+        return engine['zip_matrix'][engine['zip_rows'][origin['zip']]].astype(np.float64)
+    return haversine_to_all(engine['arrays'], origin['lat'], origin['lng'])
+
+# Fetch road miles for the agencies at these positions of the location arrays,
+# from the cache or the router; returns them with the number of routing calls
+def fetch_road_miles(engine, origin, positions, router, cache, cache_lock, ttl_days, max_entries):
+    locations, ordinals = engine['locations'], engine['arrays']['ordinals']
+    road, missing = {}, []
+    with cache_lock:
+        for position in positions:
+            location = locations[ordinals[position]]
+            miles = cache_get(cache, f"{router.source}|{origin['key']}|{geocode.normalize_address(location['address'])}", ttl_days)
+            if miles is None:
+                missing.append(position)
+            else:
+                road[position] = miles
+    hits = len(road)
+
+    batches = [missing[start:start + ROUTE_BATCH_SIZE] for start in range(0, len(missing), ROUTE_BATCH_SIZE)]
+
+    def route(batch):
+        try:
+            return router(origin, [locations[ordinals[position]] for position in batch])
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            print(f"Warning: Routing failed for {len(batch)} agencies: {e}")
+            return [None] * len(batch)
+
+    with ThreadPoolExecutor(max_workers=ROUTE_WORKERS) as pool:
+        routed = list(pool.map(route, batches))
+
+    with cache_lock:
+        for batch, miles_list in zip(batches, routed):
+            for position, miles in zip(batch, miles_list):
+                if miles is not None:
+                    road[position] = miles
+                    location = locations[ordinals[position]]
+                    cache_put(cache, f"{router.source}|{origin['key']}|{geocode.normalize_address(location['address'])}", miles, max_entries)
+    return road, {'cache_hits': hits, 'routed': len(missing), 'routing_calls': len(batches)}
+
+# Distances from an origin to every geocoded agency, closest first: road miles
+# for every agency that can be among the k nearest by road, straight-line miles
+# for the rest. Returns (distances, stats); distances are (ordinal, miles, by_road)
+def nearest_by_road(engine, origin, k, router, cache, cache_lock=None, ttl_days=30, max_entries=100000):
+    cache_lock = cache_lock or threading.Lock()
+    straight = straight_line_miles(engine, origin)
+    count = len(straight)
+    k = min(k, count)
+    stats = {'agencies': count, 'cache_hits': 0, 'routed': 0, 'routing_calls': 0}
+    if not count:
+        return [], stats
+
+    order = np.argsort(straight, kind='stable')
+    road = {}
+    start, end = 0, k
+    while True:
+        road_update, batch_stats = fetch_road_miles(
+            engine, origin, [int(position) for position in order[start:end]], router, cache, cache_lock, ttl_days, max_entries
+        )
+        road.update(road_update)
+        start = end
+        for name, value in batch_stats.items():
+            stats[name] += value
+        known = sorted(road.values())
+        if len(known) < k or end >= min(count, k * MAX_ROUTED_FACTOR):
+            break
+        # Agencies closer in a straight line than the k-th road distance may still be closer by road
+        next_end = int(np.searchsorted(straight[order], known[k - 1], side='left'))
+        if next_end <= end:
+            break
+        end = min(next_end, count, k * MAX_ROUTED_FACTOR)
+
+    ordinals = engine['arrays']['ordinals']
+    distances = [
+        (int(ordinals[position]), float(road.get(position, straight[position])), position in road)
+        for position in range(count)
+    ]
+    distances.sort(key=lambda item: item[1])
+    return distances, stats
+
+# Find the agencies nearest to a ZIP code, address or "lat,lng" by road from a built agency_locations.json
+def main():
+    parser = argparse.ArgumentParser(description="Rank agencies by road distance with as few routing calls as possible")
+    parser.add_argument('origin', help="ZIP code, address with a ZIP code, or \"lat,lng\"")
+    parser.add_argument('--k', type=int, default=10, help="Number of agencies to rank by road (default: 10)")
+    parser.add_argument('--zip-centroids', default=geocode.ZIP_CENTROIDS_PATH, help="ZCTA gazetteer with ZIP code centroids")
+    add_distance_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        with open(geocode.OUTPUT_PATH, encoding='utf-8') as f:
+            locations = json.load(f)['agencies']
+    except OSError:
+        raise SystemExit(f"Error: '{geocode.OUTPUT_PATH}' not found, run `python etl.py locations` first")
+
+    start = time.perf_counter()
+    engine = build_engine(locations, dict(geocode.derive_zip_centroids(locations), **geocode.load_zip_centroids(args.zip_centroids)))
+    print(f"Built distance engine for {len(engine['arrays']['ordinals'])} agencies and "
+          f"{len(engine['zip_rows'])} ZIP codes in {time.perf_counter() - start:.3f}s")
+    origin = resolve_origin(engine, args.origin)
+    if origin is None:
+        raise SystemExit(f"Error: Can't place '{args.origin}', give a ZIP code we have a centroid for or \"lat,lng\"")
+
+    # The vectorized pass against the per-agency loop the fallback used to run
+    start = time.perf_counter()
+    for _ in range(100):
+        haversine_to_all(engine['arrays'], origin['lat'], origin['lng'])
+    vector_time = (time.perf_counter() - start) / 100
+    located = [location for location in locations if location['lat'] is not None]
+    start = time.perf_counter()
+    for _ in range(10):
+        [geocode.haversine_miles(origin['lat'], origin['lng'], location['lat'], location['lng']) for location in located]
+    loop_time = (time.perf_counter() - start) / 10
+    print(f"Straight-line distances to all agencies: {vector_time * 1000:.3f} ms vectorized, {loop_time * 1000:.3f} ms per-agency loop")
+
+    cache = load_route_cache(args.route_cache, args.route_ttl_days)
+    router = ROUTERS[args.router]()
+    start = time.perf_counter()
+    distances, stats = nearest_by_road(engine, origin, args.k, router, cache, ttl_days=args.route_ttl_days, max_entries=args.route_cache_size)
+    elapsed = time.perf_counter() - start
+    save_route_cache(cache, args.route_cache)
+
+    for ordinal, miles, by_road in distances[:args.k]:
+        print(f"{miles:6.2f} mi {'road' if by_road else 'line'}  {locations[ordinal]['name']} ({locations[ordinal]['address']})")
+    print(f"Ranked {stats['agencies']} agencies in {elapsed * 1000:.1f} ms: {stats['routed']} routed in "
+          f"{stats['routing_calls']} {router.source} calls, {stats['cache_hits']} from the cache "
+          f"(one call per {ROUTE_BATCH_SIZE} agencies would be {-(-stats['agencies'] // ROUTE_BATCH_SIZE)} calls)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,344 @@
+import argparse
+import contextlib
+import io
+import os
+import resource
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+import process_agencies
+import process_services
+import geocode
+from workbook_loader import read_workbook, iter_workbook_chunks, add_cache_arguments, configure_cache, cache_settings
+from incremental import add_incremental_arguments
+from json_output import add_output_arguments
+from geocode import add_geocode_arguments
+from shards import add_shard_arguments
+from binary_export import add_export_arguments, write_exports, EXPORT_DIR
+from locale_bundles import add_locale_arguments, write_locale_bundles
+from validation import (
+    add_validation_arguments, configure_validation, validation_settings, quarantine_frames, validate_frame,
+    check_invalid_share, write_quarantine, ValidationError
+)
+from entity_resolution import (
+    add_resolution_arguments, configure_resolution, resolution_settings, match_records, resolve_cultures,
+    resolve_service_rows, write_match_report
+)
+from instrumentation import (
+    add_instrumentation_arguments, configure_logging, peak_memory_mb, stage, stage_records, take_stages,
+    print_summary, write_report, profiled
+)
+
+# Single entry point for the data pipeline.
+#
+#   python etl.py all          # agencies.json and services.json
+#   python etl.py agencies     # agencies.json only
+#   python etl.py services     # services.json only
+#   python etl.py locations    # agency_locations.json (geocoded addresses and nearest-agency index)
+#   python etl.py all --export parquet arrow msgpack   # plus binary copies in Data/export/ (see binary_export.py)
+#   python etl.py all --locale-bundles   # plus localized copies per locale (see locale_bundles.py)
+#
+# Every workbook a command needs is read and pre-cleaned once, optionally in
+# parallel (--workers) and/or streamed in bounded chunks (--chunk-size) so no
+# whole sheet is held in memory. The per-workbook partials are merged in a
+# fixed order into one in-memory agency model, agencies the cultures served
+# and services workbooks spell differently are resolved to their HOO records
+# (see entity_resolution.py), and each requested JSON file is emitted from
+# that model. process_agencies.py and process_services.py still work on their
+# own and run the matching subcommand.
+
+DATA_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Data'))
+
+WORKBOOKS = {
+    'markets_hoo': 'CAFB_Markets_HOO.xlsx',
+    'shopping_hoo': 'CAFB_Shopping_Partners_HOO.xlsx',
+    'markets_cultures': 'CAFB_Markets_Cultures_Served.xlsx',
+    'shopping_cultures': 'CAFB_Shopping_Partners_Cultures_Served.xlsx',
+    'markets_services': 'CAFB_Markets_Wraparound_Services.xlsx',
+    'shopping_services': 'CAFB_Shopping_Partners_Wraparound_Services.xlsx',
+}
+
+HOO_WORKBOOKS = ['markets_hoo', 'shopping_hoo']
+
+# Name column of each cultures served workbook
+CULTURES_NAME_COLUMNS = {
+    'markets_cultures': 'Agency Name',
+    'shopping_cultures': 'Company Name',
+}
+
+# Workbooks each output is built from
+OUTPUT_WORKBOOKS = {
+    'agencies': ['markets_hoo', 'shopping_hoo', 'markets_cultures', 'shopping_cultures'],
+    'services': ['markets_services', 'shopping_services', 'markets_hoo', 'shopping_hoo'],
+    'locations': ['markets_hoo', 'shopping_hoo'],
+}
+
+# Outputs built by the all command; locations may call a remote geocoder so it is run on its own
+ALL_OUTPUTS = ['agencies', 'services']
+
+COMMANDS = {
+    'all': "Build agencies.json and services.json",
+    'agencies': "Build agencies.json from the HOO and cultures served workbooks",
+    'services': "Build services.json from the wraparound services and HOO workbooks",
+    'locations': "Geocode the agency addresses and build agency_locations.json with the nearest-agency index",
+}
+
+# Validate and pre-clean one workbook dataframe (or chunk of one) for the requested outputs
+def clean_frame(name, df, outputs, check_share=True):
+    cleaned = {}
+    if validation_settings['enabled']:
+        kind = 'hoo' if name in HOO_WORKBOOKS else 'cultures' if name in CULTURES_NAME_COLUMNS else 'services'
+        with stage('validation', WORKBOOKS[name], rows_in=len(df)) as record:
+            df, cleaned['quarantine'] = validate_frame(WORKBOOKS[name], df, kind, CULTURES_NAME_COLUMNS.get(name, 'Agency Name'), check_share)
+            record['rows_out'] = len(df)
+
+    steps = []
+    if name in HOO_WORKBOOKS:
+        if 'agencies' in outputs or 'locations' in outputs:
+            steps.append(('agency_rows', 'hoo_processing', lambda: process_agencies.process_hoo_data(df)))
+        if 'services' in outputs:
+            steps.append(('service_hoo_rows', 'hoo_processing', lambda: process_services.clean_hoo_rows(df)))
+    elif name in CULTURES_NAME_COLUMNS:
+        steps.append(('cultures', 'cultures_processing', lambda: process_agencies.process_cultures_data(df, CULTURES_NAME_COLUMNS[name])))
+    else:
+        steps.append(('service_rows', 'service_rows', lambda: process_services.clean_service_rows(df)))
+
+    for key, stage_name, clean in steps:
+        with stage(stage_name, f"{name} ({key})", rows_in=len(df)) as record:
+            cleaned[key] = clean()
+            record['rows_out'] = len(cleaned[key])
+    return cleaned
+
+# Stream one workbook in chunks, keeping only the pre-cleaned rows of each
+# chunk; the invalid row share is checked once, over the whole workbook
+def stream_partial(name, outputs, path, chunk_size):
+    start = time.perf_counter()
+    partial = {'rows': 0, 'columns': []}
+    cleaned_chunks = []
+    for number, chunk in enumerate(iter_workbook_chunks(path, chunk_size)):
+        if number == 0:
+            partial['columns'] = chunk.columns.tolist()
+            cleaned_chunks.append(clean_frame(name, chunk, outputs, check_share=False))
+        else:
+            # The cleaning steps log the columns they use, which is the same for every chunk
+            with contextlib.redirect_stdout(io.StringIO()):
+                cleaned_chunks.append(clean_frame(name, chunk, outputs, check_share=False))
+        partial['rows'] += len(chunk)
+
+    for key in cleaned_chunks[0]:
+        partial[key] = pd.concat([cleaned[key] for cleaned in cleaned_chunks], ignore_index=True)
+    if 'quarantine' in partial:
+        # Every chunk reports the workbook's missing columns; row issues are unique by row
+        partial['quarantine'] = partial['quarantine'].drop_duplicates(ignore_index=True)
+        check_invalid_share(WORKBOOKS[name], partial['quarantine'], partial['rows'])
+
+    elapsed = time.perf_counter() - start
+    print(f"Streamed {path} in {elapsed:.3f}s: {partial['rows']} rows in chunks of {chunk_size} "
+          f"({partial['rows'] / elapsed:.0f} rows/s)")
+    return partial
+
+# Read one workbook and pre-clean it for the requested outputs, streaming it in
+# chunks when chunk_size is set. Runs in a worker process when loading in
+# parallel, so it returns its log instead of printing it
+def load_partial(name, outputs, data_dir, settings, chunk_size=None, validation=None):
+    cache_settings.update(settings)
+    validation_settings.update(validation or {})
+    path = os.path.join(data_dir, WORKBOOKS[name])
+    mark = len(stage_records)
+    log = io.StringIO()
+    with contextlib.redirect_stdout(log):
+        if chunk_size:
+            with stage('workbook_stream', WORKBOOKS[name]) as record:
+                partial = stream_partial(name, outputs, path, chunk_size)
+                record['rows_out'] = partial['rows']
+        else:
+            with stage('workbook_load', WORKBOOKS[name]) as record:
+                df = read_workbook(path)
+                record['rows_out'] = len(df)
+            partial = dict(clean_frame(name, df, outputs), rows=len(df), columns=df.columns.tolist())
+    partial['log'] = log.getvalue()
+    partial['stages'] = take_stages(mark)
+    return partial
+
+# Read and pre-clean every workbook the requested outputs need, once each,
+# using a process pool when workers > 1 (0 means one worker per CPU)
+def load_sources(outputs, workers=1, data_dir=DATA_DIR, chunk_size=None):
+    names = list(dict.fromkeys(name for output in outputs for name in OUTPUT_WORKBOOKS[output]))
+    hoo_optional = 'agencies' not in outputs and 'locations' not in outputs
+    workers = min(workers or os.cpu_count(), len(names))
+    settings = dict(cache_settings)
+    validation = dict(validation_settings)
+
+    mode = f"streaming chunks of {chunk_size} rows" if chunk_size else "whole sheets"
+    print(f"Reading Excel files with {workers} worker(s), {mode}...")
+    pool = None
+    if workers > 1:
+        pool = ProcessPoolExecutor(max_workers=workers)
+        futures = {name: pool.submit(load_partial, name, outputs, data_dir, settings, chunk_size, validation) for name in names}
+        load = lambda name: futures[name].result()
+    else:
+        load = lambda name: load_partial(name, outputs, data_dir, settings, chunk_size, validation)
+
+    # Collect the partials in a fixed order so the merge doesn't depend on which worker finishes first
+    sources = {}
+    try:
+        for name in names:
+            try:
+                sources[name] = load(name)
+            except Exception as e:
+                # services.json can be built without hours of operation, but not from a broken HOO workbook
+                if isinstance(e, ValidationError) or not (hoo_optional and name in HOO_WORKBOOKS):
+                    raise
+                print(f"Warning: Could not load hours of operation data: {e}")
+                continue
+            print(sources[name]['log'], end='')
+            stage_records.extend(sources[name]['stages'])
+            if 'quarantine' in sources[name]:
+                quarantine_frames.append(sources[name].pop('quarantine'))
+    finally:
+        if pool is not None:
+            pool.shutdown(cancel_futures=True)
+
+    if not all(name in sources for name in HOO_WORKBOOKS):
+        for name in HOO_WORKBOOKS:
+            sources.pop(name, None)
+    else:
+        print(f"Loaded hours of operation data: {sources['markets_hoo']['rows']} markets rows, {sources['shopping_hoo']['rows']} shopping partners rows")
+        # Print column names for debugging
+        print("Markets HOO columns:", sources['markets_hoo']['columns'])
+        print("Shopping HOO columns:", sources['shopping_hoo']['columns'])
+    if 'markets_cultures' in sources:
+        print(f"Loaded cultures data: {sources['markets_cultures']['rows']} markets cultures rows, {sources['shopping_cultures']['rows']} shopping partners cultures rows")
+    if 'markets_services' in sources:
+        print(f"Loaded services data: {sources['markets_services']['rows']} markets rows, {sources['shopping_services']['rows']} shopping partners rows")
+
+    return sources
+
+# Merge the per-workbook partials into the agency model the outputs are emitted from
+def build_model(sources, outputs):
+    model = {}
+    hoo_sources = [sources[name] for name in HOO_WORKBOOKS if name in sources]
+
+    if 'agencies' in outputs or 'locations' in outputs:
+        model['agency_rows'] = pd.concat([source['agency_rows'] for source in hoo_sources], ignore_index=True)
+    if 'agencies' in outputs:
+        model['cultures'] = pd.concat(
+            [sources[name]['cultures'] for name in CULTURES_NAME_COLUMNS], ignore_index=True
+        )
+        if resolution_settings['enabled']:
+            with stage('entity_resolution', 'cultures', rows_in=len(model['cultures'])) as record:
+                model['cultures'] = resolve_cultures(model['agency_rows'], model['cultures'])
+                record['rows_out'] = int(model['cultures']['name'].isin(set(model['agency_rows']['name'])).sum())
+
+    if 'services' in outputs:
+        services_sources = [sources['markets_services'], sources['shopping_services']]
+        model['service_row_count'] = sum(source['rows'] for source in services_sources)
+        model['service_rows'] = pd.concat([source['service_rows'] for source in services_sources], ignore_index=True)
+        model['agency_info_by_id'], model['agency_info_by_name'] = {}, {}
+        if hoo_sources:
+            hoo_rows = pd.concat([source['service_hoo_rows'] for source in hoo_sources], ignore_index=True)
+            with stage('agency_info', rows_in=len(hoo_rows)) as record:
+                model['agency_info_by_id'], model['agency_info_by_name'] = process_services.build_agency_info(hoo_rows)
+                record['rows_out'] = len(model['agency_info_by_id']) + len(model['agency_info_by_name'])
+            if resolution_settings['enabled']:
+                with stage('entity_resolution', 'services', rows_in=len(model['service_rows'])) as record:
+                    model['service_rows'] = resolve_service_rows(
+                        model['service_rows'], model['agency_info_by_id'], model['agency_info_by_name'], hoo_rows['name']
+                    )
+                    record['rows_out'] = len(model['service_rows'])
+
+    return model
+
+# Emit the requested JSON files from the agency model
+def write_outputs(model, outputs, incremental=False, verify=False, profile='pretty', compress=(), services_format='nested',
+                  geocoder='google', zip_centroids=geocode.ZIP_CENTROIDS_PATH, shard_by=None, hashed_names=False,
+                  export=(), export_dir=EXPORT_DIR, locale_bundles=None, locale_workers=0):
+    agency_list = services = None
+    if 'agencies' in outputs:
+        agency_list = process_agencies.write_agencies_json(
+            model['agency_rows'], model['cultures'], incremental=incremental, verify=verify,
+            profile=profile, compress=compress, shard_by=shard_by, hashed_names=hashed_names
+        )
+    if 'services' in outputs:
+        services = process_services.write_services_json(
+            model['service_rows'], model['agency_info_by_id'], model['agency_info_by_name'],
+            model['service_row_count'], incremental=incremental, verify=verify,
+            profile=profile, compress=compress, services_format=services_format,
+            shard_by=shard_by, hashed_names=hashed_names
+        )
+    if 'locations' in outputs:
+        # Same agencies, in the same order, as agencies.json
+        agencies_by_name = process_agencies.merge_agencies(model['agency_rows'])
+        agencies = [agencies_by_name[name] for name in sorted(agencies_by_name)]
+        geocode.write_locations_json(agencies, geocoder, zip_centroids, profile=profile, compress=compress)
+    if export and (agency_list is not None or services is not None):
+        write_exports(export, export_dir, agency_list=agency_list, services=services)
+    if locale_bundles is not None and (agency_list is not None or services is not None):
+        write_locale_bundles(locale_bundles, agency_list=agency_list, services=services,
+                             services_format=services_format, workers=locale_workers)
+
+def main(argv=None):
+    common = argparse.ArgumentParser(add_help=False)
+    add_cache_arguments(common)
+    add_incremental_arguments(common)
+    add_output_arguments(common)
+    add_geocode_arguments(common)
+    add_shard_arguments(common)
+    add_instrumentation_arguments(common)
+    add_resolution_arguments(common)
+    add_export_arguments(common)
+    add_locale_arguments(common)
+    add_validation_arguments(common)
+    common.add_argument('--services-format', choices=process_services.SERVICES_FORMATS, default='nested', help="Shape of services.json: full agency records per service, or one agency table referenced by offset (default: nested)")
+    common.add_argument('--workers', type=int, default=1, help="Number of processes reading and cleaning workbooks in parallel (0 = one per CPU)")
+    common.add_argument('--chunk-size', type=int, help="Stream the workbooks in chunks of this many rows instead of loading whole sheets (bypasses the workbook cache)")
+
+    parser = argparse.ArgumentParser(description="Build the agency and services JSON files from the CAFB workbooks")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    for command, description in COMMANDS.items():
+        subparsers.add_parser(command, parents=[common], help=description, description=description)
+    args = parser.parse_args(argv)
+    configure_cache(args)
+    configure_logging(args.log_level)
+    configure_resolution(args)
+    configure_validation(args)
+
+    outputs = ALL_OUTPUTS if args.command == 'all' else [args.command]
+    print(f"Starting data processing: {', '.join(outputs)}...")
+
+    def run():
+        sources = load_sources(outputs, workers=args.workers, chunk_size=args.chunk_size)
+        model = build_model(sources, outputs)
+        write_outputs(
+            model, outputs, incremental=args.incremental, verify=args.verify,
+            profile=args.profile, compress=args.compress, services_format=args.services_format,
+            geocoder=args.geocoder, zip_centroids=args.zip_centroids,
+            shard_by=args.shard_by, hashed_names=args.hashed_names,
+            export=args.export, export_dir=args.export_dir,
+            locale_bundles=args.locale_bundles, locale_workers=args.locale_workers
+        )
+
+    try:
+        profiled(args.cprofile, run)
+    except ValidationError as e:
+        if quarantine_frames:
+            write_quarantine(args.quarantine, quarantine_frames)
+        raise SystemExit(f"Error: {e}")
+
+    if validation_settings['enabled']:
+        write_quarantine(args.quarantine, quarantine_frames)
+
+    if args.match_report:
+        write_match_report(args.match_report, match_records)
+
+    print_summary(stage_records)
+    if args.report:
+        write_report(args.report, stage_records, sys.argv if argv is None else argv)
+    print(f"Peak memory: {peak_memory_mb(resource.RUSAGE_SELF):.1f} MB"
+          f" (workers: {peak_memory_mb(resource.RUSAGE_CHILDREN):.1f} MB)")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,196 @@
+import argparse
+import json
+import os
+import random
+import re
+import time
+
+from json_output import write_json
+from hours import agency_slots
+
+# Facet indexes for the filters of the find-nearby page.
+#
+# agency_facets.json maps every filter option to the posting list (sorted
+# ordinals into agencies.json) of the agencies it matches, so a filter query is
+# a union of posting lists within a facet and an intersection across facets
+# instead of a scan over every agency's strings. The options and predicates
+# below mirror FindNearbyAgenciesPage.tsx and have to be kept in sync with it;
+# `python facets.py` checks the index against the scan and times both.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+OUTPUT_PATH = os.path.normpath(os.path.join(BASE_DIR, '..', 'frontend', 'src', 'data', 'agency_facets.json'))
+AGENCIES_PATH = os.path.normpath(os.path.join(BASE_DIR, '..', 'frontend', 'src', 'data', 'agencies.json'))
+
+DAYS_OF_WEEK = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+TIME_BLOCKS = ['0-6', '6-12', '12-18', '18-24']
+
+CULTURAL_OPTIONS = [
+    'East African',
+    'West African',
+    'Central/South Asian',
+    'East Asian',
+    'Eastern European',
+    'Latin American',
+    'Middle Eastern/North African',
+]
+
+DISTRIBUTION_MODELS = ['Home Delivery', 'Drive-thru', 'Pickup', 'Walk-up']
+
+FOOD_FORMATS = ['Groceries', 'Prepared Meals', 'Fresh Produce', 'Canned Goods', 'Pantry Items']
+
+PREPARED_KEYWORDS = ['meal', 'prepared', 'cooked', 'hot food', 'ready-to-eat', 'ready to eat', 'boxed lunch']
+
+# Keywords the page infers each food format from when food_format doesn't name it
+FOOD_FORMAT_KEYWORDS = {
+    'groceries': (['grocer', 'food pantry', 'food bank'], ['pantry', 'food bank']),
+    'prepared meals': (PREPARED_KEYWORDS + ['lunch', 'dinner'], PREPARED_KEYWORDS + ['lunch', 'dinner']),
+    'fresh produce': (['produce', 'fresh', 'vegetable', 'veggies', 'fruit'], []),
+    'canned goods': (['canned', 'can', 'non-perishable'], []),
+    'pantry items': (['pantry', 'non-perishable', 'dry goods', 'staple'], ['pantry']),
+}
+
+LEADING_INT = re.compile(r'\s*([+-]?\d+)')
+
+# Hour of an "HH:MM:SS" time the way parseInt reads it, or None
+def parse_hour(value):
+    match = LEADING_INT.match(str(value).split(':')[0])
+    return int(match.group(1)) if match else None
+
+def is_open_on_day(agency, day):
+    return any(slot_day == day for slot_day, _, _ in agency_slots(agency))
+
+def is_open_during_time_block(agency, time_block):
+    start_hour, end_hour = map(int, time_block.split('-'))
+    for _, start, end in agency_slots(agency):
+        slot_start, slot_end = parse_hour(start), parse_hour(end)
+        if slot_start is None or slot_end is None:
+            continue
+        if (start_hour <= slot_start < end_hour or start_hour < slot_end <= end_hour
+                or (slot_start <= start_hour and slot_end >= end_hour)):
+            return True
+    return False
+
+def serves_culture(agency, culture):
+    return any(culture.lower() in served.lower() for served in agency['cultures_served'])
+
+def has_distribution_model(agency, model):
+    return model.lower() in agency['distribution_model'].lower()
+
+def has_food_format(agency, food_format):
+    food_format = food_format.lower()
+    notes = agency['notes'].lower()
+    distribution = agency['distribution_model'].lower()
+    if agency['food_format'] and food_format in agency['food_format'].lower():
+        return True
+    notes_keywords, distribution_keywords = FOOD_FORMAT_KEYWORDS.get(food_format, ([food_format], [food_format]))
+    return (any(keyword in notes for keyword in notes_keywords)
+            or any(keyword in distribution for keyword in distribution_keywords))
+
+def offers_prepared_meals(agency):
+    fields = [agency['distribution_model'].lower(), agency['notes'].lower(), agency['food_format'].lower()]
+    return any(keyword in field for keyword in PREPARED_KEYWORDS for field in fields)
+
+def offers_home_delivery(agency):
+    return 'delivery' in agency['distribution_model'].lower()
+
+# Options of each multi-select facet and the predicate an agency has to pass for an option
+FACETS = {
+    'day': (DAYS_OF_WEEK, is_open_on_day),
+    'time_block': (TIME_BLOCKS, is_open_during_time_block),
+    'culture': (CULTURAL_OPTIONS, serves_culture),
+    'distribution_model': (DISTRIBUTION_MODELS, has_distribution_model),
+    'food_format': (FOOD_FORMATS, has_food_format),
+}
+
+# Yes/no filters
+FLAGS = {
+    'prepared_meals': offers_prepared_meals,
+    'home_delivery': offers_home_delivery,
+}
+
+# Posting lists of every facet option and flag over the agency list
+def build_facets(agency_list):
+    return {
+        'count': len(agency_list),
+        'facets': {
+            facet: {
+                option: [ordinal for ordinal, agency in enumerate(agency_list) if matches(agency, option)]
+                for option in options
+            }
+            for facet, (options, matches) in FACETS.items()
+        },
+        'flags': {
+            flag: [ordinal for ordinal, agency in enumerate(agency_list) if matches(agency)]
+            for flag, matches in FLAGS.items()
+        },
+    }
+
+def write_facets_json(agency_list, profile='pretty', compress=()):
+    os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
+    write_json(OUTPUT_PATH, build_facets(agency_list), profile, compress)
+
+# Ordinals matching a selection ({facet: [options]}, {flag: True}) from the
+# index: options of a facet are OR-ed, facets and flags are AND-ed
+def query_facets(facets, selection, flags=()):
+    result = None
+    for facet, options in selection.items():
+        if not options:
+            continue
+        matched = set().union(*(facets['facets'][facet][option] for option in options))
+        result = matched if result is None else result & matched
+    for flag in flags:
+        matched = set(facets['flags'][flag])
+        result = matched if result is None else result & matched
+    return set(range(facets['count'])) if result is None else result
+
+# The same selection by scanning every agency, the way the page filters
+def scan_facets(agency_list, selection, flags=()):
+    result = set()
+    for ordinal, agency in enumerate(agency_list):
+        if all(any(FACETS[facet][1](agency, option) for option in options)
+               for facet, options in selection.items() if options) \
+                and all(FLAGS[flag](agency) for flag in flags):
+            result.add(ordinal)
+    return result
+
+def random_selection(rng):
+    selection = {}
+    for facet, (options, _) in FACETS.items():
+        if rng.random() < 0.5:
+            selection[facet] = rng.sample(options, rng.randint(1, 2))
+    flags = [flag for flag in FLAGS if rng.random() < 0.2]
+    return selection, flags
+
+# Check the facet index against the scan on random multi-filter queries and time both
+def main():
+    parser = argparse.ArgumentParser(description="Compare facet index queries with scanning agencies.json")
+    parser.add_argument('--queries', type=int, default=1000, help="Number of random filter queries (default: 1000)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with open(AGENCIES_PATH, encoding='utf-8') as f:
+        agency_list = json.load(f)['agencies']
+
+    start = time.perf_counter()
+    facets = build_facets(agency_list)
+    print(f"Built facet index for {len(agency_list)} agencies in {time.perf_counter() - start:.3f}s")
+
+    rng = random.Random(args.seed)
+    queries = [random_selection(rng) for _ in range(args.queries)]
+
+    start = time.perf_counter()
+    scanned = [scan_facets(agency_list, selection, flags) for selection, flags in queries]
+    scan_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexed = [query_facets(facets, selection, flags) for selection, flags in queries]
+    index_time = time.perf_counter() - start
+
+    if scanned != indexed:
+        raise SystemExit("Error: Facet index results differ from the scan")
+    print(f"{args.queries} queries: scan {scan_time * 1000 / args.queries:.3f} ms/query, "
+          f"index {index_time * 1000 / args.queries:.3f} ms/query ({scan_time / index_time:.1f}x)")
+
+if __name__ == '__main__':
+    main()
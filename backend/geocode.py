@@ -0,0 +1,298 @@
+import argparse
+import csv
+import heapq
+import json
+import math
+import os
+import re
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+
+from json_output import write_json
+from workbook_loader import CACHE_DIR_NAME, write_atomic
+
+# Build-time geocoding of agency addresses and the nearest-agency index.
+#
+# Every agency's Shipping Address is geocoded once, at build time, and written
+# to agency_locations.json together with a grid index over the coordinates.
+# The frontend takes the coordinates from it instead of geocoding every agency
+# address in the browser, and the agency service (agency_service.py) answers
+# its nearest-agency queries with the grid index.
+#
+# Addresses are resolved in this order:
+#
+#   cache    Data/.cache/geocode.json, results of earlier runs keyed by address
+#   geocoder the --geocoder backend (google needs GOOGLE_MAPS_API_KEY, the same
+#            key as the routes proxy; offline never leaves the machine)
+#   zip      centroid of the address' ZIP code, from a ZCTA gazetteer file
+#            (--zip-centroids, e.g. the Census 2020_Gaz_zcta_national.txt) or
+#            else the mean of the agencies already geocoded in that ZIP
+#
+# Only geocoder results are cached, so ZIP centroid fallbacks are retried on the next run.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+OUTPUT_PATH = os.path.normpath(os.path.join(BASE_DIR, '..', 'frontend', 'src', 'data', 'agency_locations.json'))
+GEOCODE_CACHE_PATH = os.path.normpath(os.path.join(BASE_DIR, '..', 'Data', CACHE_DIR_NAME, 'geocode.json'))
+ZIP_CENTROIDS_PATH = os.path.normpath(os.path.join(BASE_DIR, '..', 'Data', 'zip_centroids.txt'))
+
+GOOGLE_GEOCODE_URL = 'https://maps.googleapis.com/maps/api/geocode/json'
+
+# Grid cell size in degrees; 0.05 degrees of latitude is about 3.5 miles
+GRID_CELL_DEGREES = 0.05
+
+EARTH_RADIUS_MILES = 3958.8
+
+ZIP_PATTERN = re.compile(r'\b(\d{5})(?:-\d{4})?\b')
+
+# Add the geocoding switches to a script's argument parser
+def add_geocode_arguments(parser):
+    parser.add_argument('--geocoder', choices=list(GEOCODERS), default='google', help="Geocoding backend for addresses not in the cache (default: google, offline when GOOGLE_MAPS_API_KEY is not set)")
+    parser.add_argument('--zip-centroids', default=ZIP_CENTROIDS_PATH, help="ZCTA gazetteer file with ZIP code centroids for addresses that can't be geocoded")
+
+def normalize_address(address):
+    return ' '.join(address.upper().split())
+
+# Last ZIP code in an address, so 5-digit street numbers aren't mistaken for one
+def extract_zip(address):
+    matches = ZIP_PATTERN.findall(address)
+    return matches[-1] if matches else None
+
+# Geocoder using the Google Geocoding API
+def google_geocoder():
+    api_key = os.environ.get('GOOGLE_MAPS_API_KEY')
+    if not api_key:
+        print("Warning: GOOGLE_MAPS_API_KEY is not set, geocoding offline")
+        return offline_geocoder()
+
+    def geocode(address):
+        query = urllib.parse.urlencode({'address': address, 'key': api_key})
+        try:
+            with urllib.request.urlopen(f"{GOOGLE_GEOCODE_URL}?{query}", timeout=10) as response:
+                result = json.load(response)
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            print(f"Warning: Geocoding failed for '{address}': {e}")
+            return None
+        if result.get('status') != 'OK' or not result.get('results'):
+            if result.get('status') != 'ZERO_RESULTS':
+                print(f"Warning: Geocoding failed for '{address}': {result.get('status')}")
+            return None
+        location = result['results'][0]['geometry']['location']
+        return location['lat'], location['lng']
+
+    geocode.source = 'google'
+    return geocode
+
+# Geocoder that never resolves anything, leaving addresses to the cache and ZIP centroids
+def offline_geocoder():
+    geocode = lambda address: None
+    geocode.source = 'offline'
+    return geocode
+
+# Geocoder factories by --geocoder name; a geocoder maps an address to (lat, lng) or None
+GEOCODERS = {
+    'google': google_geocoder,
+    'offline': offline_geocoder,
+}
+
+def load_geocode_cache(path=GEOCODE_CACHE_PATH):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_geocode_cache(cache, path=GEOCODE_CACHE_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    def write(tmp_path):
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, indent=2, sort_keys=True)
+
+    write_atomic(path, write)
+
+# ZIP code centroids from a ZCTA gazetteer (tab or comma separated, with
+# GEOID/INTPTLAT/INTPTLONG or zip/lat/lng columns), or {} if there is none
+def load_zip_centroids(path):
+    if not path or not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8', newline='') as f:
+        dialect = 'excel-tab' if '\t' in f.readline() else 'excel'
+        f.seek(0)
+        reader = csv.reader(f, dialect)
+        header = [column.strip().lower() for column in next(reader)]
+        zip_at = next(header.index(name) for name in ('geoid', 'zcta5', 'zip') if name in header)
+        lat_at = next(header.index(name) for name in ('intptlat', 'lat') if name in header)
+        lng_at = next(header.index(name) for name in ('intptlong', 'lng', 'lon') if name in header)
+        return {
+            row[zip_at].strip().zfill(5): (float(row[lat_at]), float(row[lng_at]))
+            for row in reader if row
+        }
+
+# Mean coordinates of the geocoded locations in each ZIP code
+def derive_zip_centroids(locations):
+    points = {}
+    for location in locations:
+        zip_code = extract_zip(location['address'])
+        if zip_code and location['lat'] is not None and location['source'] != 'zip':
+            points.setdefault(zip_code, []).append((location['lat'], location['lng']))
+    return {
+        zip_code: (sum(lat for lat, _ in coords) / len(coords), sum(lng for _, lng in coords) / len(coords))
+        for zip_code, coords in points.items()
+    }
+
+# Resolve the address of every agency, in the order given, to a location record
+def geocode_agencies(agencies, geocoder, cache, zip_centroids):
+    start = time.perf_counter()
+    locations = []
+    lookups = 0
+    for agency in agencies:
+        location = {'name': agency['name'], 'address': agency['address'], 'lat': None, 'lng': None, 'source': None}
+        key = normalize_address(agency['address'])
+        if key and key not in cache:
+            lookups += 1
+            coords = geocoder(agency['address'])
+            if coords is not None:
+                cache[key] = {'lat': coords[0], 'lng': coords[1], 'source': geocoder.source}
+        if key in cache:
+            location.update(cache[key])
+        locations.append(location)
+
+    # Fall back to ZIP centroids for whatever the cache and geocoder couldn't resolve
+    centroids = dict(derive_zip_centroids(locations), **zip_centroids)
+    for location in locations:
+        zip_code = extract_zip(location['address'])
+        if location['lat'] is None and zip_code in centroids:
+            location['lat'], location['lng'] = centroids[zip_code]
+            location['source'] = 'zip'
+
+    resolved = sum(location['lat'] is not None for location in locations)
+    by_zip = sum(location['source'] == 'zip' for location in locations)
+    print(f"Geocoded {resolved} of {len(locations)} agencies ({by_zip} by ZIP centroid, "
+          f"{lookups} {geocoder.source} lookups) in {time.perf_counter() - start:.3f}s")
+    return locations
+
+def grid_cell(lat, lng, cell_degrees):
+    return math.floor(lat / cell_degrees), math.floor(lng / cell_degrees)
+
+# Bucket the location offsets by grid cell ("row,column" keys)
+def build_grid_index(locations, cell_degrees=GRID_CELL_DEGREES):
+    cells = {}
+    for offset, location in enumerate(locations):
+        if location['lat'] is not None:
+            row, column = grid_cell(location['lat'], location['lng'], cell_degrees)
+            cells.setdefault(f"{row},{column}", []).append(offset)
+    return {'type': 'grid', 'cell_degrees': cell_degrees, 'cells': dict(sorted(cells.items()))}
+
+def haversine_miles(lat1, lng1, lat2, lng2):
+    dlat = math.radians(lat2 - lat1)
+    dlng = math.radians(lng2 - lng1)
+    a = math.sin(dlat / 2) ** 2 + math.cos(math.radians(lat1)) * math.cos(math.radians(lat2)) * math.sin(dlng / 2) ** 2
+    return 2 * EARTH_RADIUS_MILES * math.asin(math.sqrt(a))
+
+# Cells at Chebyshev distance ring from (row, column): the perimeter of that square
+def ring_cells(row, column, ring):
+    if ring == 0:
+        yield row, column
+        return
+    for c in range(column - ring, column + ring + 1):
+        yield row - ring, c
+        yield row + ring, c
+    for r in range(row - ring + 1, row + ring):
+        yield r, column - ring
+        yield r, column + ring
+
+# Parse the grid index of agency_locations.json data once for nearest_locations:
+# the cells by (row, column) and the row and column extents of the occupied ones
+def prepare_locations(data):
+    cells = {tuple(map(int, key.split(','))): offsets for key, offsets in data['index']['cells'].items()}
+    rows = [row for row, _ in cells] or [0]
+    columns = [column for _, column in cells] or [0]
+    return dict(data, grid={
+        'cell_degrees': data['index']['cell_degrees'],
+        'cells': cells,
+        'rows': (min(rows), max(rows)),
+        'columns': (min(columns), max(columns)),
+    })
+
+def is_coordinate(lat, lng):
+    return math.isfinite(lat) and math.isfinite(lng) and -90 <= lat <= 90 and -180 <= lng <= 180
+
+# The k locations closest to (lat, lng) as (miles, location) pairs from data
+# prepared by prepare_locations. Rings of grid cells are scanned outwards from
+# the query cell, clamped to the occupied cells' bounding box so a far query
+# doesn't walk empty rings, until no unscanned cell can hold a closer one
+def nearest_locations(data, lat, lng, k=10):
+    if not is_coordinate(lat, lng):
+        raise ValueError(f"({lat}, {lng}) is not a latitude and longitude")
+    grid = data['grid']
+    cells, cell_degrees = grid['cells'], grid['cell_degrees']
+    if not cells:
+        return []
+
+    (min_row, max_row), (min_column, max_column) = grid['rows'], grid['columns']
+    row, column = grid_cell(lat, lng, cell_degrees)
+    # Every occupied cell is at least as many rows and columns from the query cell as from the clamped one
+    row, column = min(max(row, min_row), max_row), min(max(column, min_column), max_column)
+    max_ring = max(row - min_row, max_row - row, column - min_column, max_column - column)
+    unscanned = len(cells)
+    found = []
+    for ring in range(max_ring + 1):
+        for cell in ring_cells(row, column, ring):
+            offsets = cells.get(cell)
+            if offsets is None:
+                continue
+            unscanned -= 1
+            for offset in offsets:
+                location = data['agencies'][offset]
+                found.append((haversine_miles(lat, lng, location['lat'], location['lng']), offset))
+        if not unscanned:
+            break
+
+        # Anything outside the scanned rings is at least ring cells away in latitude or longitude
+        reach = math.radians(ring * cell_degrees) * EARTH_RADIUS_MILES
+        reach *= math.cos(math.radians(min(89.0, abs(lat) + ring * cell_degrees)))
+        if len(found) >= k and heapq.nsmallest(k, found)[-1][0] <= reach:
+            break
+
+    return [(miles, data['agencies'][offset]) for miles, offset in heapq.nsmallest(k, found)]
+
+# Geocode the agencies and write agency_locations.json with the grid index
+def write_locations_json(agencies, geocoder_name='google', zip_centroids_path=ZIP_CENTROIDS_PATH, profile='pretty', compress=()):
+    cache = load_geocode_cache()
+    cached = len(cache)
+    geocoder = GEOCODERS[geocoder_name]()
+    locations = geocode_agencies(agencies, geocoder, cache, load_zip_centroids(zip_centroids_path))
+    if len(cache) != cached:
+        save_geocode_cache(cache)
+
+    data = {
+        'agencies': locations,
+        'index': build_grid_index(locations),
+    }
+    os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
+    write_json(OUTPUT_PATH, data, profile, compress)
+    print(f"Indexed {sum(len(offsets) for offsets in data['index']['cells'].values())} agency locations "
+          f"in {len(data['index']['cells'])} grid cells")
+    print(f"Data saved to '{OUTPUT_PATH}'")
+
+# Query the nearest agencies from a built agency_locations.json
+def main():
+    parser = argparse.ArgumentParser(description="Find the agencies nearest to a point using the prebuilt location index")
+    parser.add_argument('lat', type=float)
+    parser.add_argument('lng', type=float)
+    parser.add_argument('--k', type=int, default=10, help="Number of agencies to return (default: 10)")
+    args = parser.parse_args()
+
+    with open(OUTPUT_PATH, encoding='utf-8') as f:
+        data = prepare_locations(json.load(f))
+    start = time.perf_counter()
+    nearest = nearest_locations(data, args.lat, args.lng, args.k)
+    elapsed = time.perf_counter() - start
+    for miles, location in nearest:
+        print(f"{miles:6.2f} mi  {location['name']} ({location['address']})")
+    print(f"Found {len(nearest)} agencies in {elapsed * 1000:.2f} ms")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,182 @@
+import argparse
+import bisect
+import json
+import os
+import random
+import re
+import time
+
+from json_output import write_json
+
+# Hours of operation as minute-of-week intervals.
+#
+# Times are parsed once, at build time, into half-open [start, end) minute
+# intervals counted from Monday 00:00, merged and sorted per agency. Slots
+# ending before they start run past midnight, and slots running past Sunday
+# midnight wrap to Monday.
+#
+# agency_hours.json has the intervals of every agency (in agencies.json order)
+# and an index to answer "which agencies are open at minute T" with one binary
+# search: the sorted boundaries of all intervals, and for each span between
+# two boundaries the ordinals of the agencies open during it. The find-nearby
+# page matches its time-of-day filter on that index (utils/agencyHours.ts), and
+# the agency service answers its open-at queries with it.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+OUTPUT_PATH = os.path.normpath(os.path.join(BASE_DIR, '..', 'frontend', 'src', 'data', 'agency_hours.json'))
+AGENCIES_PATH = os.path.normpath(os.path.join(BASE_DIR, '..', 'frontend', 'src', 'data', 'agencies.json'))
+
+DAYS = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+# "13:30", "13:30:00" or "1:30 PM"
+TIME_PATTERN = re.compile(r'^\s*(\d{1,2}):(\d{2})(?::\d{2})?\s*([AaPp][Mm])?\s*$')
+
+# Minutes after midnight of a time string, or None if it isn't one
+def parse_minutes(value):
+    match = TIME_PATTERN.match(str(value))
+    if not match:
+        return None
+    hour, minute, meridiem = int(match.group(1)), int(match.group(2)), match.group(3)
+    if meridiem:
+        if not 1 <= hour <= 12:
+            return None
+        hour = hour % 12 + (12 if meridiem.lower() == 'pm' else 0)
+    if hour > 23 or minute > 59:
+        return None
+    return hour * 60 + minute
+
+# Position of a day name in the week (Monday is 0), or None
+def day_number(day):
+    for number, name in enumerate(DAYS):
+        if name.lower() == str(day).strip().lower():
+            return number
+    return None
+
+# Minute of the week of a day name and time string
+def minute_of_week(day, time_value):
+    number, minutes = day_number(day), parse_minutes(time_value)
+    if number is None or minutes is None:
+        return None
+    return number * MINUTES_PER_DAY + minutes
+
+# The minute-of-week interval of one slot, or None if it can't be parsed or is empty
+def slot_interval(day, start_value, end_value):
+    start = minute_of_week(day, start_value)
+    end_minutes = parse_minutes(end_value)
+    if start is None or end_minutes is None:
+        return None
+    end = start - start % MINUTES_PER_DAY + end_minutes
+    if end < start:
+        end += MINUTES_PER_DAY
+    return (start, end) if end > start else None
+
+# Sort and merge intervals, splitting the ones that run past the end of the week
+def merge_intervals(intervals):
+    split = []
+    for start, end in intervals:
+        if end > MINUTES_PER_WEEK:
+            split.append((start, MINUTES_PER_WEEK))
+            split.append((0, end - MINUTES_PER_WEEK))
+        else:
+            split.append((start, end))
+
+    merged = []
+    for start, end in sorted(split):
+        if merged and start <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], end)
+        else:
+            merged.append([start, end])
+    return merged
+
+# (day, start, end) of every time slot of an agency: an agency_model.Agency
+# reads them from its slot table without building its hours dict, an
+# agencies.json dict from its hours
+def agency_slots(agency):
+    iter_slots = getattr(agency, 'iter_slots', None)
+    if iter_slots is not None:
+        return iter_slots()
+    return ((day, slot['start'], slot['end']) for day, slots in agency['hours'].items() for slot in slots)
+
+# Intervals of an agency's hours ({day: [{"start", "end"}]} in agencies.json)
+def agency_intervals(agency):
+    return merge_intervals(filter(None, (slot_interval(day, start, end) for day, start, end in agency_slots(agency))))
+
+# Intervals of a services.json hours dictionary ({day: "start - end, start - end"})
+def service_intervals(hours):
+    intervals = []
+    for day, slots in hours.items():
+        for slot in slots.split(', '):
+            start, _, end = slot.partition(' - ')
+            intervals.append(slot_interval(day, start, end))
+    return merge_intervals(filter(None, intervals))
+
+def is_open(intervals, minute):
+    return any(start <= minute < end for start, end in intervals)
+
+# Boundaries of all intervals and the agencies open in each span between two of them
+def build_hours_index(interval_lists):
+    boundaries = sorted({point for intervals in interval_lists for interval in intervals for point in interval})
+    open_lists = [[] for _ in boundaries]
+    for ordinal, intervals in enumerate(interval_lists):
+        for start, end in intervals:
+            for span in range(bisect.bisect_left(boundaries, start), bisect.bisect_left(boundaries, end)):
+                open_lists[span].append(ordinal)
+    return {'boundaries': boundaries, 'open': open_lists}
+
+# Ordinals of the agencies open at a minute of the week
+def open_at(index, minute):
+    span = bisect.bisect_right(index['boundaries'], minute % MINUTES_PER_WEEK) - 1
+    return index['open'][span] if span >= 0 else []
+
+def build_hours(agency_list):
+    intervals = [agency_intervals(agency) for agency in agency_list]
+    return {
+        'count': len(agency_list),
+        'intervals': intervals,
+        'index': build_hours_index(intervals),
+    }
+
+def write_hours_json(agency_list, profile='pretty', compress=()):
+    os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
+    write_json(OUTPUT_PATH, build_hours(agency_list), profile, compress)
+
+# List the agencies open at a day and time, checking the index against the intervals and timing both
+def main():
+    parser = argparse.ArgumentParser(description="Find the agencies open at a day and time using the hours index")
+    parser.add_argument('day', choices=DAYS)
+    parser.add_argument('time', help="Time of day, e.g. 17:30 or 5:30 PM")
+    parser.add_argument('--queries', type=int, default=10000, help="Number of random times to check the index with (default: 10000)")
+    args = parser.parse_args()
+
+    minute = minute_of_week(args.day, args.time)
+    if minute is None:
+        raise SystemExit(f"Error: Can't parse time '{args.time}'")
+
+    with open(AGENCIES_PATH, encoding='utf-8') as f:
+        agency_list = json.load(f)['agencies']
+    data = build_hours(agency_list)
+    index = data['index']
+    print(f"Indexed {sum(map(len, data['intervals']))} intervals of {len(agency_list)} agencies: "
+          f"{len(index['boundaries'])} boundaries, {sum(map(len, index['open']))} entries")
+
+    for ordinal in open_at(index, minute):
+        print(f"  {agency_list[ordinal]['name']}")
+    print(f"{len(open_at(index, minute))} agencies open {args.day} at {args.time}")
+
+    minutes = [random.randrange(MINUTES_PER_WEEK) for _ in range(args.queries)]
+    start = time.perf_counter()
+    scanned = [[ordinal for ordinal, intervals in enumerate(data['intervals']) if is_open(intervals, m)] for m in minutes]
+    scan_time = time.perf_counter() - start
+    start = time.perf_counter()
+    indexed = [open_at(index, m) for m in minutes]
+    index_time = time.perf_counter() - start
+    if scanned != indexed:
+        raise SystemExit("Error: Hours index results differ from the intervals")
+    print(f"{args.queries} queries: scan {scan_time * 1000 / args.queries:.3f} ms/query, "
+          f"index {index_time * 1000 / args.queries:.4f} ms/query")
+
+if __name__ == '__main__':
+    main()
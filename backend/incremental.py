@@ -0,0 +1,92 @@
+import hashlib
+import json
+import os
+
+import pandas as pd
+
+from workbook_loader import hash_file
+from json_output import RecordEncoder
+
+# Shared helpers for the --incremental mode of process_agencies.py and
+# process_services.py.
+#
+# Each script fingerprints the cleaned source rows behind every agency (and,
+# for services, every service bucket) and stores the fingerprints in a
+# <output>.fingerprints.json file next to the JSON it writes. On an incremental
+# run only the entries whose fingerprint changed are rebuilt and patched into
+# the existing output; everything else is taken from the previous output as is.
+
+# Bump when the processing logic changes so old fingerprints force a full rebuild
+FINGERPRINT_VERSION = 5
+
+# Add the incremental switches to a script's argument parser
+def add_incremental_arguments(parser):
+    parser.add_argument('--incremental', action='store_true', help="Only rebuild the entries whose source rows changed since the last run")
+    parser.add_argument('--verify', action='store_true', help="With --incremental, also do a full rebuild and fail if the outputs differ")
+
+def fingerprints_path(output_path):
+    return f"{os.path.splitext(output_path)[0]}.fingerprints.json"
+
+# One digest per key over that key's rows, in row order
+def fingerprint_rows(df, key):
+    if df.empty:
+        return {}
+    row_hashes = pd.util.hash_pandas_object(df, index=False).to_numpy()
+    keys = df[key] if isinstance(key, str) else key
+    return {
+        group: hashlib.sha1(row_hashes[positions].tobytes()).hexdigest()
+        for group, positions in keys.groupby(keys, sort=False).indices.items()
+    }
+
+# One digest per key of a dictionary of JSON-serializable values
+def fingerprint_values(values):
+    return {
+        key: hashlib.sha1(json.dumps(value, sort_keys=True).encode('utf-8')).hexdigest()
+        for key, value in values.items()
+    }
+
+# Merge several fingerprint dictionaries into one digest per key
+def combine_fingerprints(*parts):
+    keys = set().union(*parts)
+    return {
+        key: hashlib.sha1('|'.join(part.get(key, '') for part in parts).encode('utf-8')).hexdigest()
+        for key in keys
+    }
+
+# Keys that were added, removed or whose fingerprint differs
+def changed_keys(old, new):
+    return {key for key in set(old) | set(new) if old.get(key) != new.get(key)}
+
+# Load the fingerprints and previous output, or None if a full rebuild is needed
+def load_previous(output_path):
+    try:
+        with open(fingerprints_path(output_path), encoding='utf-8') as f:
+            fingerprints = json.load(f)
+        with open(output_path, encoding='utf-8') as f:
+            data = json.load(f)
+        output_digest = hash_file(output_path)
+    except (OSError, ValueError) as e:
+        print(f"No usable previous output for incremental rebuild ({e}), doing a full rebuild")
+        return None
+
+    if fingerprints.get('version') != FINGERPRINT_VERSION:
+        print("Fingerprints were written by a different version, doing a full rebuild")
+        return None
+    if fingerprints.get('output_sha256') != output_digest:
+        print(f"{output_path} was changed after the fingerprints were written, doing a full rebuild")
+        return None
+    return fingerprints, data
+
+# Store the fingerprints along with the digest of the output they describe
+def save_fingerprints(output_path, fingerprints):
+    meta = dict(fingerprints, version=FINGERPRINT_VERSION, output_sha256=hash_file(output_path))
+    with open(fingerprints_path(output_path), 'w', encoding='utf-8') as f:
+        json.dump(meta, f, indent=2, sort_keys=True)
+
+# Compare an incrementally patched output with a full rebuild
+def verify_output(incremental_data, full_data):
+    incremental_json = json.dumps(incremental_data, indent=2, ensure_ascii=True, cls=RecordEncoder)
+    full_json = json.dumps(full_data, indent=2, ensure_ascii=True, cls=RecordEncoder)
+    if incremental_json != full_json:
+        raise SystemExit("Error: Incremental output differs from a full rebuild")
+    print("Verified: incremental output is identical to a full rebuild")
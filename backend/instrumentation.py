@@ -0,0 +1,107 @@
+import contextlib
+import cProfile
+import csv
+import json
+import logging
+import os
+import resource
+import sys
+import time
+
+# Per-stage instrumentation for the data pipeline.
+#
+# Each stage of a run (workbook load, HOO processing, cultures merge, service
+# bucketing, JSON write, ...) is wrapped in stage(), which records its wall
+# time, CPU time, rows in and out and the peak RSS of the process at its end.
+# etl.py prints a per-stage summary after every run and can write the records
+# as a JSON or CSV report (--report), and dump a cProfile profile of the whole
+# run (--cprofile) for pstats or snakeviz. For a sampling profile without
+# the cProfile overhead, run it under py-spy instead:
+#
+#   py-spy record --format speedscope -o profile.json -- python etl.py all
+#
+# Per-agency details are logged at DEBUG level, off unless --log-level DEBUG.
+
+LOG_LEVELS = ['DEBUG', 'INFO', 'WARNING']
+
+REPORT_FIELDS = ['stage', 'detail', 'wall_s', 'cpu_s', 'rows_in', 'rows_out', 'peak_rss_mb', 'pid']
+
+# Records of the stages run in this process, in the order they finished
+stage_records = []
+
+# Add the instrumentation switches to a script's argument parser
+def add_instrumentation_arguments(parser):
+    parser.add_argument('--report', help="Write per-stage timings to this file (.json or .csv)")
+    parser.add_argument('--cprofile', help="Write a cProfile profile of the run to this file")
+    parser.add_argument('--log-level', choices=LOG_LEVELS, default='INFO', help="DEBUG also logs every agency matched to a service (default: INFO)")
+
+# Log plain messages, like the print output around them
+def configure_logging(level):
+    logging.basicConfig(level=getattr(logging, level), format='%(message)s', stream=sys.stdout, force=True)
+
+# Peak resident set size in MB (ru_maxrss is in KB on Linux and bytes on macOS)
+def peak_memory_mb(who=resource.RUSAGE_SELF):
+    peak = resource.getrusage(who).ru_maxrss
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+# Time a stage; set rows_out (and rows_in, if not known up front) on the yielded record
+@contextlib.contextmanager
+def stage(name, detail='', rows_in=None):
+    record = {'stage': name, 'detail': detail, 'rows_in': rows_in, 'rows_out': None}
+    wall_start, cpu_start = time.perf_counter(), time.process_time()
+    try:
+        yield record
+    finally:
+        record['wall_s'] = round(time.perf_counter() - wall_start, 6)
+        record['cpu_s'] = round(time.process_time() - cpu_start, 6)
+        record['peak_rss_mb'] = round(peak_memory_mb(), 1)
+        record['pid'] = os.getpid()
+        stage_records.append(record)
+
+# Take the records of the stages finished since mark out of this process' list,
+# to hand them back from a worker
+def take_stages(mark):
+    taken = stage_records[mark:]
+    del stage_records[mark:]
+    return taken
+
+# Per-stage totals, in order of first appearance
+def summarize(records):
+    totals = {}
+    for record in records:
+        total = totals.setdefault(record['stage'], {'count': 0, 'wall_s': 0.0, 'cpu_s': 0.0, 'rows_in': 0, 'rows_out': 0, 'peak_rss_mb': 0.0})
+        total['count'] += 1
+        total['wall_s'] += record['wall_s']
+        total['cpu_s'] += record['cpu_s']
+        total['rows_in'] += record['rows_in'] or 0
+        total['rows_out'] += record['rows_out'] or 0
+        total['peak_rss_mb'] = max(total['peak_rss_mb'], record['peak_rss_mb'])
+    return totals
+
+def print_summary(records):
+    print(f"{'Stage':<22} {'n':>3} {'wall s':>8} {'cpu s':>8} {'rows in':>9} {'rows out':>9} {'peak MB':>8}")
+    for name, total in summarize(records).items():
+        print(f"{name:<22} {total['count']:>3} {total['wall_s']:>8.3f} {total['cpu_s']:>8.3f} "
+              f"{total['rows_in']:>9} {total['rows_out']:>9} {total['peak_rss_mb']:>8.1f}")
+
+def write_report(path, records, argv=()):
+    if path.endswith('.csv'):
+        with open(path, 'w', encoding='utf-8', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=REPORT_FIELDS)
+            writer.writeheader()
+            writer.writerows(records)
+    else:
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'argv': list(argv), 'stages': records, 'totals': summarize(records)}, f, indent=2)
+    print(f"Stage report saved to '{path}'")
+
+# Run func under cProfile when path is set, writing the profile there
+def profiled(path, func, *args):
+    if not path:
+        return func(*args)
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(func, *args)
+    finally:
+        profiler.dump_stats(path)
+        print(f"Profile saved to '{path}' (view with `python -m pstats {path}` or snakeviz)")
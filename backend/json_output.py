@@ -0,0 +1,138 @@
+import argparse
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import time
+from collections.abc import Mapping
+
+from instrumentation import stage
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Streaming JSON writer for agencies.json and services.json.
+#
+# Containers down to the record lists are written piece by piece and every
+# record is encoded on its own, so the output never exists as one big string.
+# Two profiles:
+#
+#   pretty   indent=2 with \u escapes, byte-identical to json.dump(indent=2, ensure_ascii=True)
+#   compact  no whitespace and raw UTF-8, encoded with the C encoder
+#
+# Either can be written with precompressed .gz and .br siblings for static
+# hosting (.br needs the brotli package).
+
+PROFILES = {
+    'pretty': {'indent': 2, 'ensure_ascii': True},
+    'compact': {'separators': (',', ':'), 'ensure_ascii': False},
+}
+
+COMPRESSIONS = ['gzip', 'brotli']
+
+BLOCK_SIZE = 1 << 16
+
+# Encodes read-only mapping records (agency_model.Agency) as the JSON objects they stand for
+class RecordEncoder(json.JSONEncoder):
+    def default(self, o):
+        if isinstance(o, Mapping):
+            return dict(o)
+        return super().default(o)
+
+# Add the output switches to a script's argument parser
+def add_output_arguments(parser):
+    parser.add_argument('--profile', choices=list(PROFILES), default='pretty', help="JSON output profile (default: pretty)")
+    parser.add_argument('--compress', nargs='+', choices=COMPRESSIONS, default=[], help="Also write precompressed copies of the JSON files")
+
+# JSON text of a value in pieces: containers are written item by item,
+# the items of lists (the records) are encoded whole
+def iter_json(value, encoder, indent, depth=0):
+    if not isinstance(value, (dict, list)) or not value:
+        yield encoder.encode(value)
+        return
+
+    if indent is None:
+        newline, item_separator, key_separator = '', encoder.item_separator, encoder.key_separator
+    else:
+        newline, item_separator, key_separator = '\n' + ' ' * (indent * (depth + 1)), ',', ': '
+
+    opening, closing = ('{', '}') if isinstance(value, dict) else ('[', ']')
+    yield opening
+    for i, item in enumerate(value.items() if isinstance(value, dict) else value):
+        yield (item_separator if i else '') + newline
+        if isinstance(value, dict):
+            key, item = item
+            yield encoder.encode(str(key)) + key_separator
+            yield from iter_json(item, encoder, indent, depth + 1)
+        elif indent is None:
+            yield encoder.encode(item)
+        else:
+            # Re-indent the record to its depth; JSON strings can't contain raw newlines
+            yield encoder.encode(item).replace('\n', newline)
+    if indent is not None:
+        yield '\n' + ' ' * (indent * depth)
+    yield closing
+
+def compressed_path(path, method):
+    return f"{path}.gz" if method == 'gzip' else f"{path}.br"
+
+def compress_file(path, method):
+    with open(path, 'rb') as src, open(compressed_path(path, method), 'wb') as dst:
+        if method == 'gzip':
+            # mtime=0 keeps the .gz byte-identical between runs with the same data
+            with gzip.GzipFile(fileobj=dst, mode='wb', compresslevel=9, mtime=0) as gz:
+                shutil.copyfileobj(src, gz, BLOCK_SIZE)
+        else:
+            compressor = brotli.Compressor(quality=11)
+            for block in iter(lambda: src.read(BLOCK_SIZE), b''):
+                dst.write(compressor.process(block))
+            dst.write(compressor.finish())
+
+# Stream data to path in the given profile, write any compressed siblings and report sizes and time
+def write_json(path, data, profile='pretty', compress=(), cls=RecordEncoder):
+    options = PROFILES[profile]
+    encoder = cls(**options)
+    start = time.perf_counter()
+
+    with stage('json_write', os.path.basename(path)), open(path, 'w', encoding='utf-8') as f:
+        for piece in iter_json(data, encoder, options.get('indent')):
+            f.write(piece)
+    write_time = time.perf_counter() - start
+    sizes = [f"{os.path.getsize(path) / 1024:.1f} KB"]
+
+    # Drop siblings from earlier runs that would otherwise be served stale
+    for method in COMPRESSIONS:
+        if method not in compress and os.path.exists(compressed_path(path, method)):
+            os.remove(compressed_path(path, method))
+
+    for method in compress:
+        if method == 'brotli' and brotli is None:
+            print(f"Warning: brotli is not installed, skipping {path}.br")
+            continue
+        compress_file(path, method)
+        sizes.append(f"{os.path.splitext(compressed_path(path, method))[1]} {os.path.getsize(compressed_path(path, method)) / 1024:.1f} KB")
+
+    report = f"Wrote {path} ({profile}): {', '.join(sizes)} in {write_time:.3f}s"
+    if compress:
+        report += f" (+{time.perf_counter() - start - write_time:.3f}s compressing)"
+    print(report)
+
+# Compare the profiles on existing JSON files: size, write time and compressed sizes
+def main():
+    parser = argparse.ArgumentParser(description="Compare the size and write time of the JSON output profiles")
+    parser.add_argument('paths', nargs='+')
+    args = parser.parse_args()
+
+    compress = [method for method in COMPRESSIONS if method != 'brotli' or brotli is not None]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for path in args.paths:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            for profile in PROFILES:
+                write_json(os.path.join(tmp_dir, f"{profile}-{os.path.basename(path)}"), data, profile, compress)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,111 @@
+import argparse
+import json
+import random
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+from facets import FACETS
+from hours import DAYS
+
+# Load test for agency_service.py.
+#
+#   python agency_service.py &
+#   python load_test_service.py --requests 5000 --concurrency 16
+#
+# Sends a mix of the queries the pages make (service listings, facet filters,
+# open-now, search terms, nearest by ZIP code) from --concurrency threads and
+# reports throughput and the p50/p90/p99 latency of every kind of query. Run
+# it while replacing a workbook in Data/ to check that a hot reload doesn't
+# fail or stall requests.
+
+SEARCH_TERMS = ['church', 'food', 'pantry', 'center', 'ministr', 'dc', 'silver spring', 'bread', 'xyz']
+
+def get_json(url, timeout=30):
+    with urllib.request.urlopen(url, timeout=timeout) as response:
+        return json.load(response)
+
+# Random queries of every kind, as (kind, query string) pairs
+def sample_queries(service_ids, zip_codes, count, rng):
+    queries = []
+    for _ in range(count):
+        kind = rng.choice(['all', 'service', 'facets', 'open', 'search', 'nearest'] if zip_codes else
+                          ['all', 'service', 'facets', 'open', 'search'])
+        params = [('page', rng.randint(1, 3)), ('page_size', rng.choice([20, 50]))]
+        if kind == 'service':
+            params.append(('service', rng.choice(service_ids)))
+        elif kind == 'facets':
+            for facet in rng.sample(list(FACETS), rng.randint(1, 2)):
+                params.append((facet, rng.choice(FACETS[facet][0])))
+        elif kind == 'open':
+            params += [('open_day', rng.choice(DAYS)), ('open_time', f"{rng.randint(7, 19)}:{rng.choice(['00', '30'])}")]
+        elif kind == 'search':
+            params.append(('q', rng.choice(SEARCH_TERMS)))
+        elif kind == 'nearest':
+            params.append(('zip', rng.choice(zip_codes)))
+        queries.append((kind, urllib.parse.urlencode(params)))
+    return queries
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(int(len(ordered) * share), len(ordered) - 1)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Report the latency of agency_service.py under concurrent queries")
+    parser.add_argument('--url', default='http://127.0.0.1:3002', help="Base URL of the service (default: http://127.0.0.1:3002)")
+    parser.add_argument('--requests', type=int, default=2000, help="Number of requests (default: 2000)")
+    parser.add_argument('--concurrency', type=int, default=8, help="Requests in flight at once (default: 8)")
+    parser.add_argument('--zip-codes', nargs='*', default=['20002', '20020', '20785', '20910', '22304'],
+                        help="ZIP codes for the nearest queries; none to skip them")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    health = get_json(f"{args.url}/api/health")
+    service_ids = [service['id'] for service in get_json(f"{args.url}/api/services")['services']]
+    print(f"Service version {health['version']}: {health['agencies']} agencies, {health['services']} services, "
+          f"{health['located']} located")
+    # Only query ZIP codes the service can place
+    zip_codes = []
+    for zip_code in args.zip_codes:
+        try:
+            get_json(f"{args.url}/api/agencies?zip={zip_code}&page_size=1")
+            zip_codes.append(zip_code)
+        except urllib.error.HTTPError:
+            print(f"Skipping ZIP code {zip_code}: the service has no location for it")
+
+    queries = sample_queries(service_ids, zip_codes, args.requests, random.Random(args.seed))
+
+    def send(query):
+        kind, query_string = query
+        start = time.perf_counter()
+        try:
+            body = get_json(f"{args.url}/api/agencies?{query_string}")
+            error, version = None, body['version']
+        except (urllib.error.URLError, OSError, ValueError) as e:
+            error, version = str(e), None
+        return kind, time.perf_counter() - start, error, version
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(send, queries))
+    elapsed = time.perf_counter() - start
+
+    errors = [error for _, _, error, _ in results if error]
+    versions = sorted({version for _, _, _, version in results if version})
+    print(f"{len(results)} requests with {args.concurrency} in flight in {elapsed:.2f}s: "
+          f"{len(results) / elapsed:.0f} requests/s, {len(errors)} errors, versions served: {', '.join(versions)}")
+    print(f"{'Query':<10} {'n':>6} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'max ms':>8}")
+    for kind in ['all', 'service', 'facets', 'open', 'search', 'nearest', None]:
+        latencies = [latency * 1000 for k, latency, error, _ in results if not error and (kind is None or k == kind)]
+        if latencies:
+            print(f"{kind or 'overall':<10} {len(latencies):>6} {percentile(latencies, 0.5):>8.2f} "
+                  f"{percentile(latencies, 0.9):>8.2f} {percentile(latencies, 0.99):>8.2f} {max(latencies):>8.2f}")
+    for error in sorted(set(errors))[:5]:
+        print(f"Error: {error}")
+    if errors:
+        raise SystemExit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,276 @@
+import argparse
+import contextlib
+import filecmp
+import io
+import json
+import os
+import tempfile
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+
+from instrumentation import stage, stage_records, take_stages
+from json_output import write_json, compressed_path, COMPRESSIONS
+import process_agencies
+import process_services
+from process_services import normalize_services, denormalize_services
+
+# Localized, precompressed copies of agencies.json and services.json, one per locale.
+#
+#   python etl.py all --locale-bundles          # every locale in frontend/src/locales
+#   python etl.py all --locale-bundles es       # Spanish only
+#   python locale_bundles.py --copies 4         # serial against parallel bundle writing on the current JSON
+#
+# The frontend translates its own text through i18n.ts, but the values in the
+# data (service names, distribution models, food formats, requirements,
+# cultures served and appointment flags) are the English of the workbooks.
+# A locale directory under frontend/src/locales can hold a data.json catalog
+# of those values next to its translation.json:
+#
+#   {"services": {"housing": "Vivienda", ...}, "distributionModel": {"Walk up": ...},
+#    "foodFormat": {...}, "requirements": {...}, "cultures": {...}, "appointment": {...}}
+#
+# Services are keyed by their id in process_services.service_map, the other
+# sections by the English value, and comma-separated lists such as
+# "Drive thru,Walk up" are translated item by item. A value the catalog
+# doesn't have stays in English, like i18next's fallbackLng, and is reported.
+# Day names stay as they are; the frontend parses them and translates them
+# through its time.* keys.
+#
+# The translations are added next to the English values, never in their
+# place: the frontend matches on the English (appointment_needed == "Yes",
+# the distribution model and food format filters, the facet, search and hours
+# indexes), so a bundle keeps every canonical field and record order of
+# agencies.json and adds display labels:
+#
+#   agencies   distribution_model_label, food_format_label, requirements_label,
+#              appointment_needed_label, cultures_served_labels
+#   services   name_label on each service, appointment_needed_label on each
+#              agency listed under one
+#
+# FindNearbyAgenciesPage.tsx loads /data/locales/<language>/agencies.json
+# instead of /data/agencies.json for a language other than English, falling
+# back to agencies.json when there is no bundle, and AgencyCard shows the
+# labels where a record has them. Any client can consume a bundle the same
+# way, since the canonical fields and the agency order are unchanged.
+#
+# With --locale-bundles the canonical data built in the run is localized into
+# frontend/src/data/locales/<locale>/agencies.json and services.json, in the
+# compact profile with .gz and .br siblings. The locales are localized,
+# serialized and compressed at the same time in a process pool
+# (--locale-workers, by default one per locale up to the number of CPUs) that
+# is handed the canonical data once per worker. Translations are memoized,
+# so each distinct value is looked up once per locale and process.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+LOCALES_DIR = os.path.normpath(os.path.join(BASE_DIR, '..', 'frontend', 'src', 'locales'))
+BUNDLES_DIR = os.path.normpath(os.path.join(BASE_DIR, '..', 'frontend', 'src', 'data', 'locales'))
+
+CATALOG_NAME = 'data.json'
+
+# The language of the workbooks, whose untranslated values aren't reported
+CANONICAL_LOCALE = 'en'
+
+# Catalog section of each translated agency field
+FIELD_SECTIONS = {
+    'distribution_model': 'distributionModel',
+    'food_format': 'foodFormat',
+    'requirements': 'requirements',
+    'appointment_needed': 'appointment',
+}
+
+LIST_SEPARATOR = ','
+
+# State of the process writing bundles: the canonical data, the catalogs by
+# locale, and the values each (locale, section) had no translation for
+canonical = {}
+catalogs = {}
+missing_translations = {}
+
+# Add the locale bundle switches to a script's argument parser
+def add_locale_arguments(parser):
+    parser.add_argument('--locale-bundles', nargs='*', metavar='LOCALE', help=f"Also write localized, precompressed agencies.json and services.json per locale (default: every locale in {LOCALES_DIR})")
+    parser.add_argument('--locale-workers', type=int, default=0, help="Processes writing locale bundles in parallel (0 = one per locale, up to the number of CPUs)")
+
+def available_locales(locales_dir=LOCALES_DIR):
+    return sorted(name for name in os.listdir(locales_dir) if os.path.isdir(os.path.join(locales_dir, name)))
+
+# A locale's catalog of data values; without one everything stays in English
+def load_catalog(locale, locales_dir=LOCALES_DIR):
+    path = os.path.join(locales_dir, locale, CATALOG_NAME)
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+# Catalogs of the requested locales, or of every locale when none are given
+def load_catalogs(locales=None, locales_dir=LOCALES_DIR):
+    known = available_locales(locales_dir)
+    unknown = [locale for locale in locales or [] if locale not in known]
+    if unknown:
+        raise SystemExit(f"Error: Unknown locale(s) {', '.join(unknown)}, expected some of {', '.join(known)}")
+    return {locale: load_catalog(locale, locales_dir) for locale in locales or known}
+
+def note_missing(locale, section, value):
+    if locale != CANONICAL_LOCALE:
+        missing_translations.setdefault(locale, {}).setdefault(section, set()).add(value)
+
+# A value, or every item of a comma-separated list, in the locale
+@lru_cache(maxsize=None)
+def translate(locale, section, value):
+    if not value:
+        return value
+    entries = catalogs[locale].get(section, {})
+    items = []
+    for item in value.split(LIST_SEPARATOR):
+        if item not in entries:
+            note_missing(locale, section, item)
+        items.append(entries.get(item, item))
+    return LIST_SEPARATOR.join(items)
+
+@lru_cache(maxsize=None)
+def translate_service(locale, service_id, name):
+    names = catalogs[locale].get('services', {})
+    if service_id not in names:
+        note_missing(locale, 'services', service_id)
+    return names.get(service_id, name)
+
+# An agency with a display label in the locale next to each translated field
+def localize_agency(locale, agency):
+    localized = dict(agency)
+    for field, section in FIELD_SECTIONS.items():
+        localized[f"{field}_label"] = translate(locale, section, agency[field])
+    localized['cultures_served_labels'] = [translate(locale, 'cultures', culture) for culture in agency['cultures_served']]
+    return localized
+
+# Nested services data with labels in the locale next to the service names and appointment flags
+def localize_services(locale, data):
+    return {
+        'services': [dict(service, name_label=translate_service(locale, service['id'], service['name'])) for service in data['services']],
+        'agencyData': {
+            service_id: [dict(agency, appointment_needed_label=translate(locale, 'appointment', agency['appointment_needed']))
+                         for agency in agencies]
+            for service_id, agencies in data['agencyData'].items()
+        },
+    }
+
+# Set up a process to write bundles; the pool's initializer, so the canonical
+# data is sent to each worker once rather than with every locale
+def init_worker(data, locale_catalogs):
+    canonical.clear()
+    canonical.update(data)
+    catalogs.clear()
+    catalogs.update(locale_catalogs)
+    missing_translations.clear()
+    translate.cache_clear()
+    translate_service.cache_clear()
+
+# Localize, serialize and compress one locale's bundle. Runs in a worker
+# process when writing in parallel, so it returns its log instead of printing it
+def write_bundle(locale, bundles_dir=BUNDLES_DIR, services_format='nested'):
+    locale_dir = os.path.join(bundles_dir, locale)
+    os.makedirs(locale_dir, exist_ok=True)
+    mark = len(stage_records)
+    log = io.StringIO()
+    paths = []
+    with contextlib.redirect_stdout(log), stage('locale_bundle', locale) as record:
+        if canonical.get('agencies') is not None:
+            paths.append(os.path.join(locale_dir, 'agencies.json'))
+            agencies = [localize_agency(locale, agency) for agency in canonical['agencies']]
+            write_json(paths[-1], {'agencies': agencies}, 'compact', COMPRESSIONS)
+        if canonical.get('services') is not None:
+            paths.append(os.path.join(locale_dir, 'services.json'))
+            services = localize_services(locale, canonical['services'])
+            write_json(paths[-1], normalize_services(services) if services_format == 'normalized' else services, 'compact', COMPRESSIONS)
+        record['rows_out'] = len(paths)
+    return {
+        'log': log.getvalue(),
+        'stages': take_stages(mark),
+        'paths': paths,
+        'missing': {section: sorted(values) for section, values in missing_translations.get(locale, {}).items()},
+    }
+
+# Write the bundle of every locale in locale_catalogs from the canonical data,
+# in a process pool when workers > 1 (0 means one per locale, up to the CPUs)
+def run_bundles(locale_catalogs, data, bundles_dir=BUNDLES_DIR, services_format='nested', workers=0):
+    locales = list(locale_catalogs)
+    workers = min(workers or os.cpu_count(), len(locales))
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_worker,
+                                 initargs=(data, locale_catalogs)) as pool:
+            futures = {locale: pool.submit(write_bundle, locale, bundles_dir, services_format) for locale in locales}
+            # Collected in a fixed order so the log doesn't depend on which worker finishes first
+            return {locale: futures[locale].result() for locale in locales}, workers
+
+    init_worker(data, locale_catalogs)
+    try:
+        return {locale: write_bundle(locale, bundles_dir, services_format) for locale in locales}, 1
+    finally:
+        canonical.clear()
+
+# Write the locale bundles of the agency list (agencies.json order) and the
+# nested services data built in this run
+def write_locale_bundles(locales=None, agency_list=None, services=None, services_format='nested', workers=0,
+                         locales_dir=LOCALES_DIR, bundles_dir=BUNDLES_DIR):
+    locale_catalogs = load_catalogs(locales, locales_dir)
+    data = {
+        # Plain dicts, so the workers don't need the records' slot tables
+        'agencies': [dict(agency) for agency in agency_list] if agency_list is not None else None,
+        'services': services,
+    }
+
+    start = time.perf_counter()
+    results, workers = run_bundles(locale_catalogs, data, bundles_dir, services_format, workers)
+    for locale, result in results.items():
+        print(result['log'], end='')
+        stage_records.extend(result['stages'])
+        if locale != CANONICAL_LOCALE and not locale_catalogs[locale]:
+            print(f"Warning: {locale} has no {CATALOG_NAME} catalog, its bundle is in English")
+            continue
+        for section, values in result['missing'].items():
+            print(f"Warning: {locale} has no translation for {len(values)} {section} value(s): {', '.join(values)}")
+    print(f"Wrote {len(results)} locale bundles ({', '.join(results)}) to '{bundles_dir}' "
+          f"with {workers} worker(s) in {time.perf_counter() - start:.3f}s")
+
+# Time writing the bundles serially and in parallel from the current JSON
+# outputs, and check both write the same files
+def main():
+    parser = argparse.ArgumentParser(description="Compare writing the locale bundles serially and in a process pool")
+    parser.add_argument('--locales', nargs='+', help="Locales to write (default: every locale)")
+    parser.add_argument('--copies', type=int, default=1, help="Write every locale this many times, as if there were more languages")
+    parser.add_argument('--workers', type=int, default=0, help="Processes of the parallel run (default: one per bundle)")
+    args = parser.parse_args()
+
+    with open(process_agencies.OUTPUT_PATH, encoding='utf-8') as f:
+        agency_list = json.load(f)['agencies']
+    with open(process_services.OUTPUT_PATH, encoding='utf-8') as f:
+        services = denormalize_services(json.load(f))
+    data = {'agencies': agency_list, 'services': services}
+    locale_catalogs = {
+        locale if copy == 0 else f"{locale}-{copy}": catalog
+        for locale, catalog in load_catalogs(args.locales).items() for copy in range(args.copies)
+    }
+
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        timings = {}
+        for mode, workers in [('serial', 1), ('parallel', args.workers or len(locale_catalogs))]:
+            start = time.perf_counter()
+            run_bundles(locale_catalogs, data, os.path.join(tmp_dir, mode), workers=workers)
+            timings[mode] = (workers, time.perf_counter() - start)
+            if mode == 'serial':
+                cache = translate.cache_info()
+                print(f"Translation lookups: {cache.hits + cache.misses}, memoized hits {cache.hits / max(cache.hits + cache.misses, 1):.1%}")
+
+        for locale in locale_catalogs:
+            for name in ['agencies.json', 'services.json']:
+                for path in [name, *(compressed_path(name, method) for method in COMPRESSIONS)]:
+                    serial_path, parallel_path = (os.path.join(tmp_dir, mode, locale, path) for mode in ['serial', 'parallel'])
+                    if os.path.exists(serial_path) and not filecmp.cmp(serial_path, parallel_path, shallow=False):
+                        raise SystemExit(f"Error: {locale}/{path} differs between the serial and parallel runs")
+
+    print(f"{len(locale_catalogs)} bundles on {os.cpu_count()} CPU(s)")
+    for mode, (workers, elapsed) in timings.items():
+        print(f"{mode:<9} {workers:>3} worker(s) {elapsed:>8.3f}s {elapsed / len(locale_catalogs):>8.3f}s per bundle")
+
+if __name__ == '__main__':
+    main()
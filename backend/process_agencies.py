@@ -1,23 +1,22 @@
+import heapq
 import pandas as pd
-import json
+import numpy as np
 import os
-from collections import defaultdict
+import sys
 
-print("Starting agency data processing...")
+from json_output import write_json
+from facets import write_facets_json
+from search_index import write_search_json
+from hours import write_hours_json
+from shards import shard_agency_list, write_shards
+from instrumentation import stage
+from agency_model import agency_records
+from incremental import (
+    fingerprint_rows, combine_fingerprints, changed_keys,
+    load_previous, save_fingerprints, verify_output
+)
 
-# Read the Excel files
-print("Reading agency Excel files...")
-markets_hoo_df = pd.read_excel('../Data/CAFB_Markets_HOO.xlsx', engine='openpyxl')
-shopping_hoo_df = pd.read_excel('../Data/CAFB_Shopping_Partners_HOO.xlsx', engine='openpyxl')
-markets_cultures_df = pd.read_excel('../Data/CAFB_Markets_Cultures_Served.xlsx', engine='openpyxl')
-shopping_cultures_df = pd.read_excel('../Data/CAFB_Shopping_Partners_Cultures_Served.xlsx', engine='openpyxl')
-
-print(f"Loaded data: {len(markets_hoo_df)} markets rows, {len(shopping_hoo_df)} shopping partners rows")
-print(f"Loaded cultures data: {len(markets_cultures_df)} markets cultures rows, {len(shopping_cultures_df)} shopping partners cultures rows")
-
-# Debug: Print column names to verify
-print("Markets HOO columns:", markets_hoo_df.columns.tolist())
-print("Shopping HOO columns:", shopping_hoo_df.columns.tolist())
+OUTPUT_PATH = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'frontend', 'src', 'data', 'agencies.json'))
 
 # Function to clean text
 def clean_text(text):
@@ -29,198 +28,249 @@ def clean_text(text):
 def format_time(time_value):
     if pd.isna(time_value):
         return ""
-    
+
     if isinstance(time_value, pd.Timestamp):
         return time_value.strftime("%H:%M:%S")
-    
+
     if isinstance(time_value, str):
         # Try to convert to HH:MM:SS format if it's not already
         try:
             # Parse time from 12-hour format (e.g., "10:00 AM") if needed
             return pd.to_datetime(time_value).strftime("%H:%M:%S")
-        except:
+        except (ValueError, TypeError, OverflowError):
+            # Free text such as "As Needed"; validation.py reports anything else
             return time_value
-    
+
     return str(time_value)
 
+# Check if appointment is needed
+def parse_appointment_flag(value):
+    if isinstance(value, bool) and value:
+        return "Yes"
+    if isinstance(value, str) and value.lower() in ['yes', 'true', '1', 'required', 'y', 'by appointment only']:
+        return "Yes"
+    return "No"
+
 # Function to find column name that contains a specific text
 def find_column(df, text):
     matching_cols = [col for col in df.columns if text.lower() in col.lower()]
     return matching_cols[0] if matching_cols else None
 
-# Dictionary to store agency information by name
-agencies_by_name = {}
+# Apply a scalar function once per distinct value of a column and broadcast
+# the results back, instead of calling it on every cell.
+def map_unique(series, func, missing=""):
+    if series.dtype != object or pd.api.types.infer_dtype(series, skipna=True) in ('string', 'empty'):
+        codes, uniques = pd.factorize(series)
+        # Missing values get code -1, which picks the trailing `missing` entry
+        mapped = np.array([func(value) for value in uniques] + [missing], dtype=object)
+        return pd.Series(mapped[codes], index=series.index, dtype=object)
+
+    # Mixed object columns: key on the type as well, so that e.g. True and 1
+    # (or a Timestamp and an equal datetime) are not formatted as one value
+    cache = {}
+    result = []
+    for value, is_missing in zip(series.to_numpy(dtype=object), series.isna().to_numpy()):
+        if is_missing:
+            result.append(missing)
+            continue
+        key = (type(value), value)
+        if key not in cache:
+            cache[key] = func(value)
+        result.append(cache[key])
+    return pd.Series(result, index=series.index, dtype=object)
 
-# Process hours of operation data
+# Get a column by name, or an all-empty column if the sheet doesn't have it
+def get_column(df, name):
+    if name is not None and name in df.columns:
+        return df[name]
+    return pd.Series("", index=df.index, dtype=object)
+
+# Clean one hours of operation dataframe into a frame with one row per HOO record
 def process_hoo_data(hoo_df):
     # Find the actual column names that contain our target data
     distribution_col = find_column(hoo_df, 'Distribution Model') or find_column(hoo_df, 'Distribution') or 'Distribution Model'
     food_format_col = find_column(hoo_df, 'Food Format') or find_column(hoo_df, 'Format') or 'Food Format'
     hours_notes_col = find_column(hoo_df, 'Additional Note') or find_column(hoo_df, 'Hours Notes') or find_column(hoo_df, 'Hours Note') or 'Hours Notes'
-    
+
     print(f"Using columns: Distribution={distribution_col}, Food Format={food_format_col}, Hours Notes={hours_notes_col}")
-    
-    for index, row in hoo_df.iterrows():
-        # Get agency name
-        agency_name = clean_text(row.get('Agency Name', ''))
-        if not agency_name:
-            continue
-            
-        # Get address
-        address = clean_text(row.get('Shipping Address', ''))
-            
-        # Get phone
-        phone = clean_text(row.get('Phone', ''))
-        
-        # Get days and hours of operation
-        day = clean_text(row.get('Day or Week', ''))
-        start_time = format_time(row.get('Starting Time', ''))
-        end_time = format_time(row.get('Ending Time', ''))
-        
-        # Check if appointment is needed
-        appointment_needed = "No"
-        if 'By Appointment Only' in row and pd.notna(row['By Appointment Only']):
-            value = row['By Appointment Only']
-            if isinstance(value, bool) and value:
-                appointment_needed = "Yes"
-            elif isinstance(value, str) and value.lower() in ['yes', 'true', '1', 'required', 'y', 'by appointment only']:
-                appointment_needed = "Yes"
-        
-        # Get food pantry requirements
-        requirements = clean_text(row.get('Food Pantry Requirements', ''))
-        
-        # Get distribution model
-        distribution_model = ""
-        if distribution_col in row:
-            distribution_model = clean_text(row[distribution_col])
-        
-        # Get food format if available
-        food_format = ""
-        if food_format_col in row:
-            food_format = clean_text(row[food_format_col])
-        
-        # Get additional notes on hours
-        hours_notes = ""
-        if hours_notes_col in row:
-            hours_notes = clean_text(row[hours_notes_col])
-        
-        # Get general notes
-        notes = clean_text(row.get('Notes', ''))
-        
-        # Combine hours notes with general notes if both exist
-        if hours_notes and notes:
-            notes = f"Hours Notes: {hours_notes}. {notes}"
-        elif hours_notes:
-            notes = f"Hours Notes: {hours_notes}"
-        
-        # If agency doesn't exist yet, create it
-        if agency_name not in agencies_by_name:
-            agencies_by_name[agency_name] = {
-                'name': agency_name,
-                'address': address,
-                'phone': phone,
-                'hours': {},
-                'appointment_needed': appointment_needed,
-                'requirements': requirements,
-                'distribution_model': distribution_model,
-                'notes': notes,
-                'cultures_served': [],
-                'food_format': food_format,
-            }
-        else:
-            # Update existing agency data if fields are empty
-            agency = agencies_by_name[agency_name]
-            if not agency['address'] and address:
-                agency['address'] = address
-            if not agency['phone'] and phone:
-                agency['phone'] = phone
-            if appointment_needed == "Yes":
-                agency['appointment_needed'] = "Yes"
-            if not agency['requirements'] and requirements:
-                agency['requirements'] = requirements
-            if not agency['distribution_model'] and distribution_model:
-                agency['distribution_model'] = distribution_model
-            if not agency['notes'] and notes:
-                agency['notes'] = notes
-            elif hours_notes and not agency['notes'].startswith("Hours Notes:"):
-                # Add hours notes to existing notes
-                agency['notes'] = f"Hours Notes: {hours_notes}. {agency['notes']}"
-            if not agency.get('food_format') and food_format:
-                agency['food_format'] = food_format
-        
-        # If we have valid day and times, add to hours
-        if day and start_time and end_time:
-            agency = agencies_by_name[agency_name]
-            
-            # Create time slot as structured data with start and end times
-            time_slot = {
-                "start": start_time,
-                "end": end_time
-            }
-            
-            if day in agency['hours']:
-                # Check if this exact time slot already exists
-                if not any(ts["start"] == time_slot["start"] and ts["end"] == time_slot["end"] 
-                          for ts in agency['hours'][day]):
-                    agency['hours'][day].append(time_slot)
-            else:
-                agency['hours'][day] = [time_slot]
-
-# Process cultures served data
+
+    # Markets HOO identifies agencies by 'Agency ID', shopping partners HOO by 'External ID'
+    agency_id = map_unique(get_column(hoo_df, 'Agency ID'), clean_text)
+    agency_id = agency_id.where(agency_id != "", map_unique(get_column(hoo_df, 'External ID'), clean_text))
+
+    rows = pd.DataFrame({
+        'id': agency_id,
+        'name': map_unique(get_column(hoo_df, 'Agency Name'), clean_text),
+        'address': map_unique(get_column(hoo_df, 'Shipping Address'), clean_text),
+        'region': map_unique(get_column(hoo_df, 'Agency Region'), clean_text),
+        'county': map_unique(get_column(hoo_df, 'County/Ward'), clean_text),
+        'phone': map_unique(get_column(hoo_df, 'Phone'), clean_text),
+        'day': map_unique(get_column(hoo_df, 'Day or Week'), clean_text),
+        'start': map_unique(get_column(hoo_df, 'Starting Time'), format_time),
+        'end': map_unique(get_column(hoo_df, 'Ending Time'), format_time),
+        'appointment_needed': map_unique(get_column(hoo_df, 'By Appointment Only'), parse_appointment_flag, missing="No"),
+        'requirements': map_unique(get_column(hoo_df, 'Food Pantry Requirements'), clean_text),
+        'distribution_model': map_unique(get_column(hoo_df, distribution_col), clean_text),
+        'food_format': map_unique(get_column(hoo_df, food_format_col), clean_text),
+        'hours_notes': map_unique(get_column(hoo_df, hours_notes_col), clean_text),
+    })
+
+    # Combine hours notes with general notes if both exist
+    notes = map_unique(get_column(hoo_df, 'Notes'), clean_text)
+    hours_notes = rows['hours_notes']
+    has_notes = notes != ""
+    has_hours_notes = hours_notes != ""
+    rows['notes'] = notes.where(~has_hours_notes, "Hours Notes: " + hours_notes)
+    rows.loc[has_hours_notes & has_notes, 'notes'] = "Hours Notes: " + hours_notes + ". " + notes
+
+    # Skip rows without an agency name
+    return rows[rows['name'] != ""]
+
+# Merge cleaned HOO rows into one record per agency, in order of first appearance
+def merge_agencies(rows):
+    rows = rows.reset_index(drop=True)
+    position = pd.Series(np.arange(len(rows)), index=rows.index)
+    names = rows['name']
+
+    # First non-empty value of a field for each agency
+    def first_value(column):
+        values = rows[column].where(rows[column] != "")
+        return values.groupby(names, sort=False).first().reindex(names.unique()).fillna("")
+
+    merged = pd.DataFrame({
+        'address': first_value('address'),
+        'region': first_value('region'),
+        'county': first_value('county'),
+        'phone': first_value('phone'),
+        'requirements': first_value('requirements'),
+        'distribution_model': first_value('distribution_model'),
+        'food_format': first_value('food_format'),
+        'notes': first_value('notes'),
+    })
+
+    # Appointment is needed if any row says so
+    appointment = (rows['appointment_needed'] == "Yes").groupby(names, sort=False).any()
+    merged['appointment_needed'] = np.where(appointment.reindex(merged.index), "Yes", "No")
+
+    # Hours notes seen after an agency's notes were set get prepended to them once
+    has_notes = rows['notes'] != ""
+    notes_at = position[has_notes].groupby(names[has_notes], sort=False).first()
+    has_hours_notes = rows['hours_notes'] != ""
+    later = rows.loc[has_hours_notes, ['name', 'hours_notes']]
+    later = later[position[has_hours_notes] > later['name'].map(notes_at)]
+    later_hours_notes = later.drop_duplicates('name').set_index('name')['hours_notes']
+    prepend = merged.index.isin(later_hours_notes.index) & ~merged['notes'].str.startswith("Hours Notes:")
+    merged.loc[prepend, 'notes'] = (
+        "Hours Notes: " + later_hours_notes.reindex(merged.index[prepend]) + ". " + merged.loc[prepend, 'notes']
+    )
+
+    # If we have valid day and times, add to hours, skipping exact duplicate time slots
+    valid = (rows['day'] != "") & (rows['start'] != "") & (rows['end'] != "")
+    slots = rows.loc[valid, ['name', 'day', 'start', 'end']].drop_duplicates()
+    return agency_records(merged, slots)
+
+# Clean one cultures served dataframe into (agency name, culture) pairs, with the agency ID
 def process_cultures_data(cultures_df, name_column='Agency Name'):
-    for index, row in cultures_df.iterrows():
-        # Get agency name (handle different column names)
-        agency_name = clean_text(row.get(name_column, ''))
-        if not agency_name or agency_name not in agencies_by_name:
-            continue
-        
-        # Get cultures served (handle different column names)
-        culture = clean_text(row.get('Cultural Populations Served', ''))
-        if culture and culture not in agencies_by_name[agency_name]['cultures_served']:
-            agencies_by_name[agency_name]['cultures_served'].append(culture)
-
-# Process both HOO dataframes
-print("Processing hours of operation data...")
-process_hoo_data(markets_hoo_df)
-process_hoo_data(shopping_hoo_df)
-
-# Process both cultures served dataframes
-print("Processing cultures served data...")
-process_cultures_data(markets_cultures_df, 'Agency Name')
-process_cultures_data(shopping_cultures_df, 'Company Name')
+    return pd.DataFrame({
+        'id': map_unique(get_column(cultures_df, 'Agency ID'), clean_text),
+        'name': map_unique(get_column(cultures_df, name_column), clean_text),
+        'culture': map_unique(get_column(cultures_df, 'Cultural Populations Served'), clean_text),
+    })
+
+# Attach cultures served to known agencies, keeping first-seen order
+def merge_cultures(agencies_by_name, cultures):
+    cultures = cultures[cultures['name'].isin(agencies_by_name.keys()) & (cultures['culture'] != "")]
+    cultures = cultures.drop_duplicates(['name', 'culture'])
+    for name, served in cultures.groupby('name', sort=False)['culture']:
+        agencies_by_name[name].add_cultures(served)
+
+# Clean the HOO and cultures dataframes into combined HOO rows and culture pairs
+def clean_agency_rows(hoo_dfs, cultures_dfs):
+    print("Processing hours of operation data...")
+    rows = pd.concat([process_hoo_data(hoo_df) for hoo_df in hoo_dfs], ignore_index=True)
+
+    print("Processing cultures served data...")
+    cultures = pd.concat(
+        [process_cultures_data(cultures_df, name_column) for cultures_df, name_column in cultures_dfs],
+        ignore_index=True
+    )
+    return rows, cultures
+
+# Build the agency dictionary from cleaned HOO rows and culture pairs
+def build_agencies_from_rows(rows, cultures):
+    agencies_by_name = merge_agencies(rows)
+    merge_cultures(agencies_by_name, cultures)
+    return agencies_by_name
+
+# Build the agency dictionary from the HOO and cultures dataframes
+def build_agencies(hoo_dfs, cultures_dfs):
+    return build_agencies_from_rows(*clean_agency_rows(hoo_dfs, cultures_dfs))
 
 # Format the final agency list - hours are already structured, so we don't need the format_hours function
-agency_list = []
-for name, data in agencies_by_name.items():
-    agency = {
-        'name': data['name'],
-        'address': data['address'],
-        'phone': data['phone'],
-        'hours': data['hours'],  # Keep structured format
-        'appointment_needed': data['appointment_needed'],
-        'requirements': data['requirements'],
-        'distribution_model': data['distribution_model'],
-        'notes': data['notes'],
-        'cultures_served': data['cultures_served'],
-        'food_format': data['food_format'],
+def build_agency_list(agencies_by_name):
+    # Sort agencies by name
+    return sorted(agencies_by_name.values(), key=lambda x: x['name'])
+
+# Fingerprint every agency name over its HOO rows and culture pairs
+def agency_fingerprints(rows, cultures):
+    return combine_fingerprints(fingerprint_rows(rows, 'name'), fingerprint_rows(cultures, 'name'))
+
+# Rebuild only the changed agencies and merge them into the previous sorted agency list
+def update_agency_list(agency_list, rows, cultures, changed):
+    rows = rows[rows['name'].isin(changed)]
+    cultures = cultures[cultures['name'].isin(changed)]
+    updated = build_agency_list(build_agencies_from_rows(rows, cultures)) if not rows.empty else []
+    kept = [agency for agency in agency_list if agency['name'] not in changed]
+    return list(heapq.merge(kept, updated, key=lambda x: x['name']))
+
+# Write agencies.json from cleaned HOO rows and culture pairs, patching the previous output when incremental;
+# returns the agency list written
+def write_agencies_json(rows, cultures, incremental=False, verify=False, profile='pretty', compress=(),
+                        shard_by=None, hashed_names=False):
+    fingerprints = agency_fingerprints(rows, cultures)
+
+    # The previous agencies.json has no region and county to shard by
+    previous = load_previous(OUTPUT_PATH) if incremental and not shard_by else None
+    with stage('agency_merge', rows_in=len(rows)) as record:
+        if previous is not None:
+            previous_fingerprints, previous_data = previous
+            changed = changed_keys(previous_fingerprints.get('agencies', {}), fingerprints)
+            print(f"Incremental rebuild: {len(changed)} of {len(fingerprints)} agencies changed")
+            agency_list = update_agency_list(previous_data['agencies'], rows, cultures, changed)
+        else:
+            agency_list = build_agency_list(build_agencies_from_rows(rows, cultures))
+        record['rows_out'] = len(agency_list)
+
+    # Create the final data structure
+    data = {
+        'agencies': agency_list
     }
-    
-    agency_list.append(agency)
 
-# Sort agencies by name
-agency_list.sort(key=lambda x: x['name'])
+    if previous is not None and verify:
+        verify_output(data, {'agencies': build_agency_list(build_agencies_from_rows(rows, cultures))})
+
+    # Create the output directory if it doesn't exist
+    os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
+
+    # Write to a JSON file
+    write_json(OUTPUT_PATH, data, profile, compress)
+    save_fingerprints(OUTPUT_PATH, {'agencies': fingerprints})
 
-# Create the final data structure
-data = {
-    'agencies': agency_list
-}
+    # Filter, search and hours indexes over the same agency ordinals
+    write_facets_json(agency_list, profile, compress)
+    write_search_json(agency_list, profile, compress)
+    write_hours_json(agency_list, profile, compress)
 
-# Create the output directory if it doesn't exist
-os.makedirs('../frontend/src/data', exist_ok=True)
+    if shard_by:
+        shards = shard_agency_list(agency_list, shard_by)
+        write_shards('agencies', {key: {'agencies': agencies} for key, agencies in shards.items()}, shards,
+                     shard_by, profile, compress, hashed_names)
 
-# Write to a JSON file
-with open('../frontend/src/data/agencies.json', 'w', encoding='utf-8') as f:
-    json.dump(data, f, indent=2, ensure_ascii=True)
+    print(f"Processed {len(agency_list)} agencies.")
+    print(f"Data saved to '{OUTPUT_PATH}'")
+    return agency_list
 
-print(f"Processed {len(agency_list)} agencies.")
-print(f"Data saved to '../frontend/src/data/agencies.json'") 
\ No newline at end of file
+if __name__ == '__main__':
+    # Same as `python etl.py agencies`
+    import etl
+    etl.main(['agencies', *sys.argv[1:]])
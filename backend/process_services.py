@@ -1,35 +1,31 @@
+import contextlib
+import io
+import logging
 import pandas as pd
+import numpy as np
 import json
 import os
 import re
+import sys
 from collections import defaultdict
 
-print("Starting data processing...")
-
-# Read the Excel files
-print("Reading Excel files...")
-markets_services_df = pd.read_excel('Data/CAFB_Markets_Wraparound_Services.xlsx')
-shopping_services_df = pd.read_excel('Data/CAFB_Shopping_Partners_Wraparound_Services.xlsx', engine='openpyxl')
-
-print(f"Loaded services data: {len(markets_services_df)} markets rows, {len(shopping_services_df)} shopping partners rows")
-
-# Try to read the hours of operation files
-try:
-    markets_hoo_df = pd.read_excel('Data/CAFB_Markets_HOO.xlsx', engine='openpyxl')
-    shopping_hoo_df = pd.read_excel('Data/CAFB_Shopping_Partners_HOO.xlsx', engine='openpyxl')
-    has_hoo_data = True
-    print(f"Successfully loaded hours of operation data: {len(markets_hoo_df)} markets rows, {len(shopping_hoo_df)} shopping partners rows")
-    
-    # Print column names for debugging
-    print("Markets HOO columns:", markets_hoo_df.columns.tolist())
-    print("Shopping HOO columns:", shopping_hoo_df.columns.tolist())
-    
-except Exception as e:
-    print(f"Warning: Could not load hours of operation data: {e}")
-    has_hoo_data = False
-
-# Combine both services dataframes
-services_df = pd.concat([markets_services_df, shopping_services_df], ignore_index=True)
+from json_output import write_json
+from hours import day_number, service_intervals
+from shards import shard_services_data, write_shards, without_shard_fields
+from instrumentation import stage
+from incremental import (
+    fingerprint_rows, fingerprint_values, changed_keys,
+    load_previous, save_fingerprints, verify_output
+)
+
+OUTPUT_PATH = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'frontend', 'src', 'data', 'services.json'))
+SAMPLE_PATH = os.path.join(os.path.dirname(OUTPUT_PATH), 'services_sample.json')
+
+logger = logging.getLogger(__name__)
+
+# nested: full agency records under every service (the shape ServicesPage was built on)
+# normalized: one agency table, services hold offsets into it
+SERVICES_FORMATS = ['nested', 'normalized']
 
 # Map services to their IDs (slugs)
 service_map = {
@@ -53,22 +49,18 @@ service_map = {
 def clean_text(text):
     if pd.isna(text) or text is None:
         return ""
-    
+
     # Convert to string if not already
     text = str(text).strip()
-    
+
     # Replace problematic characters
     text = re.sub(r'[\x00-\x1F\x7F-\x9F]', '', text)  # Remove control characters
-    
+
     # Replace special quotes with standard ones
     text = text.replace('"', '"').replace('"', '"')
     text = text.replace("'", "'").replace("'", "'")
-    
-    return text
 
-# Create dictionaries to store agency information with different keys for better matching
-agency_info_by_id = {}
-agency_info_by_name = {}
+    return text
 
 # Map day names to database day names
 day_map = {
@@ -88,115 +80,147 @@ day_map = {
     'Sun': 'sunday'
 }
 
-# Process hours of operation data if available
-if has_hoo_data:
-    combined_hoo_df = pd.concat([markets_hoo_df, shopping_hoo_df], ignore_index=True)
-    
-    print(f"Processing {len(combined_hoo_df)} combined HOO rows")
-    missing_address = 0
-    missing_phone = 0
-    missing_hours = 0
-    
-    for index, row in combined_hoo_df.iterrows():
-        # Get agency identifiers - markets uses 'Agency ID', shopping uses 'External ID'
-        agency_id = ""
-        if 'Agency ID' in row and pd.notna(row['Agency ID']):
-            agency_id = clean_text(str(row['Agency ID']))
-        elif 'External ID' in row and pd.notna(row['External ID']):
-            agency_id = clean_text(str(row['External ID']))
-            
-        agency_name = ""
-        if 'Agency Name' in row and pd.notna(row['Agency Name']):
-            agency_name = clean_text(str(row['Agency Name']))
-        
-        if not agency_id and not agency_name:
-            print(f"Warning: Row {index} has no agency ID or name, skipping")
+# Try to map a day to a standard format, returns (day_key, normalized_day) or None
+def normalize_day(day):
+    day_lower = day.lower()
+    for day_key, day_value in day_map.items():
+        if day_key.lower() in day_lower:
+            return day_key, day_value
+    return None
+
+# Format times as strings
+def format_hours_time(time_value):
+    if isinstance(time_value, pd.Timestamp):
+        return time_value.strftime("%I:%M %p")
+    return clean_text(str(time_value))
+
+# Check if appointment is needed
+def parse_appointment_flag(value):
+    if isinstance(value, bool):
+        return "Yes" if value else "No"
+    elif isinstance(value, str):
+        if value.lower() in ['yes', 'true', '1', 'required', 'y', 'by appointment only']:
+            return "Yes"
+        elif value.lower() in ['no', 'false', '0', 'not required', 'n']:
+            return "No"
+    return "Unknown"
+
+# Clean an identifier or name cell the way the services loop always has
+def clean_str(value):
+    return clean_text(str(value))
+
+# Apply a scalar function once per distinct value of a column and broadcast
+# the results back, instead of calling it on every cell.
+def map_unique(series, func, missing=""):
+    if series.dtype != object or pd.api.types.infer_dtype(series, skipna=True) in ('string', 'empty'):
+        codes, uniques = pd.factorize(series)
+        # Missing values get code -1, which picks the trailing `missing` entry
+        mapped = np.array([func(value) for value in uniques] + [missing], dtype=object)
+        return pd.Series(mapped[codes], index=series.index, dtype=object)
+
+    # Mixed object columns: key on the type as well, so that e.g. True and 1
+    # (or a Timestamp and an equal datetime) are not formatted as one value
+    cache = {}
+    result = []
+    for value, is_missing in zip(series.to_numpy(dtype=object), series.isna().to_numpy()):
+        if is_missing:
+            result.append(missing)
             continue
-            
-        # Get address - both use 'Shipping Address'
-        address = ""
-        if 'Shipping Address' in row and pd.notna(row['Shipping Address']):
-            address = clean_text(row['Shipping Address'])
-                
-        if not address:
-            missing_address += 1
-            
-        # Get phone - shopping HOO has 'Phone'
-        phone = ""
-        if 'Phone' in row and pd.notna(row['Phone']):
-            phone = clean_text(row['Phone'])
-                
-        if not phone:
-            missing_phone += 1
-        
-        # Extract days and hours of operation
-        days_open = []
-        hours_info = {}
-        
-        # Check if this row has hours data
-        has_hours = False
-        
-        # Both files use 'Day or Week', 'Starting Time', 'Ending Time'
-        if 'Day or Week' in row and pd.notna(row['Day or Week']) and \
-           'Starting Time' in row and pd.notna(row['Starting Time']) and \
-           'Ending Time' in row and pd.notna(row['Ending Time']):
-            
-            day = clean_text(row['Day or Week'])
-            start_time = row['Starting Time']
-            end_time = row['Ending Time']
-            
-            # Check if we have valid day and times
-            if day and pd.notna(start_time) and pd.notna(end_time):
-                # Try to map the day to a standard format
-                day_lower = day.lower()
-                
-                for day_key, day_value in day_map.items():
-                    if day_key.lower() in day_lower:
-                        normalized_day = day_value
-                        days_open.append(day_key)
-                        has_hours = True
-                        
-                        # Format times as strings
-                        try:
-                            start_str = start_time.strftime("%I:%M %p") if isinstance(start_time, pd.Timestamp) else clean_text(str(start_time))
-                            end_str = end_time.strftime("%I:%M %p") if isinstance(end_time, pd.Timestamp) else clean_text(str(end_time))
-                            
-                            hours_info[normalized_day] = f"{start_str} - {end_str}"
-                        except Exception as e:
-                            print(f"Error formatting time for {agency_name}: {e}")
-                        
-                        break
-        
-        if not has_hours:
-            missing_hours += 1
-        
-        # Check if appointment is needed
-        appointment_needed = "Unknown"
-        if 'By Appointment Only' in row and pd.notna(row['By Appointment Only']):
-            value = row['By Appointment Only']
-            if isinstance(value, bool):
-                appointment_needed = "Yes" if value else "No"
-            elif isinstance(value, str):
-                if value.lower() in ['yes', 'true', '1', 'required', 'y', 'by appointment only']:
-                    appointment_needed = "Yes"
-                elif value.lower() in ['no', 'false', '0', 'not required', 'n']:
-                    appointment_needed = "No"
-        
-        agency_data = {
-            'address': address,
-            'phone': phone,
-            'days_open': days_open,
-            'hours': hours_info,
-            'appointment_needed': appointment_needed
-        }
-        
-        # Store by ID and name for better matching
-        if agency_id:
-            agency_info_by_id[agency_id] = agency_data
-        
-        if agency_name:
-            agency_info_by_name[agency_name.lower()] = agency_data
-    
+        key = (type(value), value)
+        if key not in cache:
+            cache[key] = func(value)
+        result.append(cache[key])
+    return pd.Series(result, index=series.index, dtype=object)
+
+# Get a column by name, or an all-missing column if the sheet doesn't have it
+def get_column(df, name):
+    if name in df.columns:
+        return df[name]
+    return pd.Series(np.nan, index=df.index, dtype=object)
+
+# Build agency information keyed by ID and by lowercased name from the combined HOO rows
+def process_hoo_data(combined_hoo_df):
+    return build_agency_info(clean_hoo_rows(combined_hoo_df))
+
+# Clean a HOO dataframe into one row per HOO record with the agency keys and formatted hours
+def clean_hoo_rows(hoo_df):
+    # Get agency identifiers - markets uses 'Agency ID', shopping uses 'External ID'
+    agency_id_col = get_column(hoo_df, 'Agency ID')
+    agency_id = map_unique(agency_id_col, clean_str).where(
+        agency_id_col.notna(), map_unique(get_column(hoo_df, 'External ID'), clean_str)
+    )
+    agency_name = map_unique(get_column(hoo_df, 'Agency Name'), clean_str)
+
+    # Get address - both use 'Shipping Address'; phone - shopping HOO has 'Phone'
+    rows = pd.DataFrame({
+        'id': agency_id,
+        'name': agency_name,
+        'address': map_unique(get_column(hoo_df, 'Shipping Address'), clean_text),
+        'region': map_unique(get_column(hoo_df, 'Agency Region'), clean_text),
+        'county': map_unique(get_column(hoo_df, 'County/Ward'), clean_text),
+        'phone': map_unique(get_column(hoo_df, 'Phone'), clean_text),
+        'appointment_needed': map_unique(get_column(hoo_df, 'By Appointment Only'), parse_appointment_flag, missing="Unknown"),
+    })
+
+    # Both files use 'Day or Week', 'Starting Time', 'Ending Time'
+    day_col = get_column(hoo_df, 'Day or Week')
+    start_col = get_column(hoo_df, 'Starting Time')
+    end_col = get_column(hoo_df, 'Ending Time')
+    has_times = day_col.notna() & start_col.notna() & end_col.notna()
+    day = map_unique(day_col.where(has_times), lambda value: normalize_day(clean_text(value)), missing=None)
+    start_str = map_unique(start_col.where(day.notna()), format_hours_time)
+    end_str = map_unique(end_col.where(day.notna()), format_hours_time)
+    rows['day'] = day
+    rows['hours'] = start_str + " - " + end_str
+    return rows
+
+# Build agency information keyed by ID and by lowercased name from cleaned HOO rows
+def build_agency_info(rows):
+    print(f"Processing {len(rows)} combined HOO rows")
+
+    unnamed = (rows['id'] == "") & (rows['name'] == "")
+    for index in rows.index[unnamed]:
+        print(f"Warning: Row {index} has no agency ID or name, skipping")
+    rows = rows[~unnamed]
+
+    missing_address = int((rows['address'] == "").sum())
+    missing_phone = int((rows['phone'] == "").sum())
+    missing_hours = int(rows['day'].isna().sum())
+
+    # Later rows for the same agency replace its details; the time slots of all its rows are kept
+    def agency_info(rows):
+        info = {}
+        slots = {}
+        for key, address, region, county, phone, day, hours, appointment_needed in zip(
+            rows['key'], rows['address'], rows['region'], rows['county'], rows['phone'], rows['day'],
+            rows['hours'], rows['appointment_needed']
+        ):
+            info[key] = {
+                'address': address,
+                'region': region,
+                'county': county,
+                'phone': phone,
+                'appointment_needed': appointment_needed
+            }
+            if day:
+                # Grouped by the normalized day, so "Mon" and "Monday" rows share one entry
+                day_slots = slots.setdefault(key, {}).setdefault(day[1], [])
+                if hours not in day_slots:
+                    day_slots.append(hours)
+
+        for key, agency in info.items():
+            days = sorted(slots.get(key, {}).items(), key=lambda item: day_number(item[0]))
+            agency['days_open'] = [day.capitalize() for day, _ in days]
+            agency['hours'] = {day: ", ".join(day_slots) for day, day_slots in days}
+            agency['open_intervals'] = service_intervals(agency['hours'])
+        return info
+
+    # Store by ID and name for better matching
+    by_id = rows[rows['id'] != ""].assign(key=lambda df: df['id'])
+    by_name = rows[rows['name'] != ""].assign(key=lambda df: map_unique(df['name'], str.lower))
+    agency_info_by_id = agency_info(by_id)
+    agency_info_by_name = agency_info(by_name)
+
     print(f"Agency data summary:")
     print(f"- Total agencies processed: {len(agency_info_by_id) + len(agency_info_by_name)}")
     print(f"- Agencies with missing address: {missing_address}")
@@ -205,154 +229,300 @@ if has_hoo_data:
     print(f"- Agencies by ID: {len(agency_info_by_id)}")
     print(f"- Agencies by name: {len(agency_info_by_name)}")
 
+    return agency_info_by_id, agency_info_by_name
+
+# Clean the identifying columns once, keeping only services in our mapping
+def clean_service_rows(services_df):
+    service_ids = map_unique(services_df['Wraparound Service'], lambda service: service_map.get(clean_text(service)), missing=None)
+    mapped = service_ids.notna()
+    return pd.DataFrame({
+        'id': map_unique(services_df['Agency ID'], clean_str, missing=clean_str(np.nan))[mapped],
+        'name': map_unique(services_df['Agency Name'], clean_text)[mapped],
+        'service': service_ids[mapped],
+    })
+
+# Try to get agency info by ID or name
+def lookup_agency_info(agency_id, agency_name_lower, agency_info_by_id, agency_info_by_name):
+    if agency_id in agency_info_by_id:
+        return agency_info_by_id[agency_id]
+    if agency_name_lower in agency_info_by_name:
+        return agency_info_by_name[agency_name_lower]
+    return None
+
+# Build the agency record listed under a service
+def agency_entry(agency_id, agency_name, info):
+    return {
+        'id': agency_id,
+        'name': agency_name,
+        'address': info.get('address', ''),
+        'region': info.get('region', ''),
+        'county': info.get('county', ''),
+        'phone': info.get('phone', ''),
+        'days_open': info.get('days_open', []),
+        'hours': info.get('hours', {}),
+        'open_intervals': info.get('open_intervals', []),
+        'appointment_needed': info.get('appointment_needed', 'Unknown'),
+        'website': ''  # No website in data, leave empty for now
+    }
+
 # Create a dictionary with services as keys and lists of agencies as values
-services_data = defaultdict(list)
-agencies_processed = 0
-agencies_with_details = 0
-
-# Process each row in the dataframe
-for index, row in services_df.iterrows():
-    agency_id = clean_text(str(row['Agency ID']))
-    agency_name = clean_text(row['Agency Name'])
-    service = clean_text(row['Wraparound Service'])
-    
-    # Skip if service is not in our mapping
-    if service not in service_map:
-        continue
-    
-    service_id = service_map[service]
-    
-    # Check if agency already exists in this service
-    agency_exists = False
-    for agency in services_data[service_id]:
-        if agency['id'] == agency_id or agency['name'].lower() == agency_name.lower():
-            agency_exists = True
-            break
-    
-    # If agency doesn't exist, add it
-    if not agency_exists:
-        agencies_processed += 1
-        
-        # Try to get agency info by ID or name
-        info = {}
-        if agency_id in agency_info_by_id:
-            info = agency_info_by_id[agency_id]
-            agencies_with_details += 1
-        elif agency_name.lower() in agency_info_by_name:
-            info = agency_info_by_name[agency_name.lower()]
-            agencies_with_details += 1
-        
-        has_details = any([
-            info.get('address', ''),
-            info.get('phone', ''),
-            info.get('days_open', []),
-            info.get('hours', {})
-        ])
-        
-        if has_details:
-            print(f"Found details for {agency_name}")
-            if info.get('address'):
-                print(f"  - Address: {info['address']}")
-            if info.get('phone'):
-                print(f"  - Phone: {info['phone']}")
-            if info.get('days_open'):
-                print(f"  - Days open: {info['days_open']}")
-            if info.get('hours'):
-                print(f"  - Hours: {info['hours']}")
-        
-        agency_data = {
-            'id': agency_id,
-            'name': agency_name,
-            'address': info.get('address', ''),
-            'phone': info.get('phone', ''),
-            'days_open': info.get('days_open', []),
-            'hours': info.get('hours', {}),
-            'appointment_needed': info.get('appointment_needed', 'Unknown'),
-            'website': ''  # No website in data, leave empty for now
-        }
-        
-        services_data[service_id].append(agency_data)
+def build_services_data(services_df, agency_info_by_id, agency_info_by_name):
+    return bucket_services(clean_service_rows(services_df), agency_info_by_id, agency_info_by_name)
+
+# Bucket cleaned service rows into per-service agency lists
+def bucket_services(service_rows, agency_info_by_id, agency_info_by_name):
+    services_data = defaultdict(list)
+    # Per-service index of the IDs and lowercased names already added
+    seen_ids = defaultdict(set)
+    seen_names = defaultdict(set)
+    agencies_processed = 0
+    agencies_with_details = 0
+
+    for agency_id, agency_name, service_id in zip(service_rows['id'], service_rows['name'], service_rows['service']):
+        # Check if agency already exists in this service, matching on ID or name
+        agency_name_lower = agency_name.lower()
+        agency_exists = agency_id in seen_ids[service_id] or agency_name_lower in seen_names[service_id]
+
+        # If agency doesn't exist, add it
+        if not agency_exists:
+            agencies_processed += 1
+
+            info = lookup_agency_info(agency_id, agency_name_lower, agency_info_by_id, agency_info_by_name)
+            if info is not None:
+                agencies_with_details += 1
+            else:
+                info = {}
+
+            has_details = any([
+                info.get('address', ''),
+                info.get('phone', ''),
+                info.get('days_open', []),
+                info.get('hours', {})
+            ])
 
-print(f"Agency processing summary:")
-print(f"- Total unique agencies processed: {agencies_processed}")
-print(f"- Agencies with details: {agencies_with_details}")
+            if has_details and logger.isEnabledFor(logging.DEBUG):
+                logger.debug(f"Found details for {agency_name}")
+                if info.get('address'):
+                    logger.debug(f"  - Address: {info['address']}")
+                if info.get('phone'):
+                    logger.debug(f"  - Phone: {info['phone']}")
+                if info.get('days_open'):
+                    logger.debug(f"  - Days open: {info['days_open']}")
+                if info.get('hours'):
+                    logger.debug(f"  - Hours: {info['hours']}")
+
+            services_data[service_id].append(agency_entry(agency_id, agency_name, info))
+            seen_ids[service_id].add(agency_id)
+            seen_names[service_id].add(agency_name_lower)
+
+    print(f"Agency processing summary:")
+    print(f"- Total unique agencies processed: {agencies_processed}")
+    print(f"- Agencies with details: {agencies_with_details}")
+
+    return services_data
+
+# Fingerprint every service over its rows, and every agency info record by ID and by name
+def services_fingerprints(service_rows, agency_info_by_id, agency_info_by_name):
+    return {
+        'services': fingerprint_rows(service_rows, 'service'),
+        'agency_ids': fingerprint_values(agency_info_by_id),
+        'agency_names': fingerprint_values(agency_info_by_name),
+    }
+
+# Rebuild the services whose rows changed and patch the agencies whose info changed in the rest
+def update_services_data(previous_services_data, service_rows, agency_info_by_id, agency_info_by_name,
+                         changed_services, changed_ids, changed_names):
+    rebuilt = bucket_services(
+        service_rows[service_rows['service'].isin(changed_services)], agency_info_by_id, agency_info_by_name
+    )
+
+    patched = 0
+    # Services are listed in order of their first row, like a full rebuild
+    services_data = defaultdict(list)
+    for service_id in service_rows['service'].unique():
+        if service_id in changed_services:
+            services_data[service_id] = rebuilt[service_id]
+            continue
+
+        agencies = previous_services_data.get(service_id, [])
+        for i, agency in enumerate(agencies):
+            agency_name_lower = agency['name'].lower()
+            if agency['id'] in changed_ids or agency_name_lower in changed_names:
+                info = lookup_agency_info(agency['id'], agency_name_lower, agency_info_by_id, agency_info_by_name)
+                agencies[i] = agency_entry(agency['id'], agency['name'], info or {})
+                patched += 1
+        services_data[service_id] = agencies
+
+    print(f"Incremental rebuild: {len(changed_services)} services rebuilt, {patched} agency entries patched")
+    return services_data
+
+# Store each distinct agency record once and list offsets into that table per service
+def normalize_services(data):
+    agencies = []
+    offsets = {}
+    agency_data = {}
+    for service_id, service_agencies in data['agencyData'].items():
+        agency_data[service_id] = []
+        for agency in service_agencies:
+            # The same agency can be listed under a different name in another service
+            key = json.dumps(agency, sort_keys=True)
+            if key not in offsets:
+                offsets[key] = len(agencies)
+                agencies.append(agency)
+            agency_data[service_id].append(offsets[key])
+
+    return {
+        'format': 'normalized',
+        'services': data['services'],
+        'agencies': agencies,
+        'agencyData': agency_data
+    }
+
+# Expand normalized services data back to full agency records per service
+def denormalize_services(data):
+    if data.get('format') != 'normalized':
+        return data
+    return {
+        'services': data['services'],
+        'agencyData': {
+            service_id: [data['agencies'][offset] for offset in offsets]
+            for service_id, offsets in data['agencyData'].items()
+        }
+    }
 
 # Create the services list
-services_list = []
-for service_name, service_id in service_map.items():
-    # Only add services that have agencies
-    if services_data[service_id]:
-        services_list.append({
-            'id': service_id,
-            'name': service_name
-        })
-
-# Create the final data structure
-data = {
-    'services': services_list,
-    'agencyData': services_data
-}
+def build_services_list(services_data):
+    services_list = []
+    for service_name, service_id in service_map.items():
+        # Only add services that have agencies
+        if services_data[service_id]:
+            services_list.append({
+                'id': service_id,
+                'name': service_name
+            })
+    return services_list
+
+# Write services.json (and the debugging sample) from cleaned service rows and agency info,
+# patching the previous output when incremental; returns the nested services data
+def write_services_json(service_rows, agency_info_by_id, agency_info_by_name, row_count, incremental=False, verify=False,
+                        profile='pretty', compress=(), services_format='nested', shard_by=None, hashed_names=False):
+    fingerprints = services_fingerprints(service_rows, agency_info_by_id, agency_info_by_name)
+
+    # The previous services.json has no region and county to shard by
+    previous = load_previous(OUTPUT_PATH) if incremental and not shard_by else None
+    with stage('service_bucketing', rows_in=len(service_rows)) as record:
+        if previous is not None:
+            previous_fingerprints, previous_data = previous
+            previous_data = denormalize_services(previous_data)
+            services_data = update_services_data(
+                previous_data['agencyData'], service_rows, agency_info_by_id, agency_info_by_name,
+                changed_keys(previous_fingerprints.get('services', {}), fingerprints['services']),
+                changed_keys(previous_fingerprints.get('agency_ids', {}), fingerprints['agency_ids']),
+                changed_keys(previous_fingerprints.get('agency_names', {}), fingerprints['agency_names'])
+            )
+        else:
+            services_data = bucket_services(service_rows, agency_info_by_id, agency_info_by_name)
+        record['rows_out'] = sum(map(len, services_data.values()))
+
+    services_list = build_services_list(services_data)
+
+    if shard_by:
+        shards = shard_services_data(services_list, services_data, shard_by)
+        write_shards(
+            'services',
+            {key: normalize_services(shard) if services_format == 'normalized' else shard for key, shard in shards.items()},
+            {key: [agency for agencies in shard['agencyData'].values() for agency in agencies] for key, shard in shards.items()},
+            shard_by, profile, compress, hashed_names
+        )
+    # Region and county are only kept for the shards
+    services_data = {
+        service_id: [without_shard_fields(agency) for agency in agencies] for service_id, agencies in services_data.items()
+    }
+
+    # Create the final data structure
+    data = {
+        'services': services_list,
+        'agencyData': services_data
+    }
 
-# Create the output directory if it doesn't exist
-os.makedirs('frontend/src/data', exist_ok=True)
-
-# Write to a JSON file
-try:
-    # First try the standard JSON dump
-    with open('frontend/src/data/services.json', 'w', encoding='utf-8') as f:
-        json.dump(data, f, indent=2, ensure_ascii=True)
-        
-    print("JSON successfully written using standard method")
-    
-    # Write a sample of the data for debugging
-    with open('frontend/src/data/services_sample.json', 'w', encoding='utf-8') as f:
-        sample_data = {}
-        for service_id, agencies in services_data.items():
-            if agencies:
-                # Find up to 3 agencies with the most complete info
-                agencies_with_info = []
-                for agency in agencies:
-                    if agency['address'] or agency['phone'] or agency['days_open'] or agency['hours']:
-                        agencies_with_info.append(agency)
-                        if len(agencies_with_info) >= 3:
-                            break
-                
-                # If we don't have 3 agencies with info, just take the first 3
-                if not agencies_with_info:
-                    agencies_with_info = agencies[:3]
-                    
-                sample_data[service_id] = agencies_with_info[:3]  # Just the first 3 agencies per service
-                
-        json.dump({"sample": sample_data}, f, indent=2, ensure_ascii=True)
-    
-    print("Sample data written for debugging")
-    
-except Exception as e:
-    print(f"Error with standard JSON writing: {e}")
-    
+    if previous is not None and verify:
+        with contextlib.redirect_stdout(io.StringIO()):
+            full_services_data = bucket_services(service_rows, agency_info_by_id, agency_info_by_name)
+            full_data = {'services': build_services_list(full_services_data), 'agencyData': {
+                service_id: [without_shard_fields(agency) for agency in agencies]
+                for service_id, agencies in full_services_data.items()
+            }}
+        verify_output(data, full_data)
+
+    # Create the output directory if it doesn't exist
+    os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
+
+    output_data = normalize_services(data) if services_format == 'normalized' else data
+
+    # Write to a JSON file
     try:
-        # Manual JSON serialization for safety
-        with open('frontend/src/data/services.json', 'w', encoding='utf-8') as f:
+        # First try the standard JSON encoder
+        write_json(OUTPUT_PATH, output_data, profile, compress)
+
+        save_fingerprints(OUTPUT_PATH, fingerprints)
+
+        print("JSON successfully written using standard method")
+
+        # Write a sample of the data for debugging
+        with open(SAMPLE_PATH, 'w', encoding='utf-8') as f:
+            sample_data = {}
+            for service_id, agencies in services_data.items():
+                if agencies:
+                    # Find up to 3 agencies with the most complete info
+                    agencies_with_info = []
+                    for agency in agencies:
+                        if agency['address'] or agency['phone'] or agency['days_open'] or agency['hours']:
+                            agencies_with_info.append(agency)
+                            if len(agencies_with_info) >= 3:
+                                break
+
+                    # If we don't have 3 agencies with info, just take the first 3
+                    if not agencies_with_info:
+                        agencies_with_info = agencies[:3]
+
+                    sample_data[service_id] = agencies_with_info[:3]  # Just the first 3 agencies per service
+
+            json.dump({"sample": sample_data}, f, indent=2, ensure_ascii=True)
+
+        print("Sample data written for debugging")
+
+    except Exception as e:
+        print(f"Error with standard JSON writing: {e}")
+
+        try:
+            # Manual JSON serialization for safety
             # Simple manual conversion for specific problematic values
-            import json
             class SafeEncoder(json.JSONEncoder):
                 def default(self, obj):
                     if isinstance(obj, pd.Timestamp):
                         return obj.strftime("%I:%M %p")
                     return json.JSONEncoder.default(self, obj)
-            
-            json.dump(data, f, indent=2, ensure_ascii=True, cls=SafeEncoder)
-            
-        print("JSON successfully written using manual serialization")
-    except Exception as e:
-        print(f"Error with manual serialization: {e}")
 
-print(f"Processed {len(services_df)} rows.")
-print(f"Created {len(services_list)} services.")
-print(f"Data saved to 'frontend/src/data/services.json'")
+            write_json(OUTPUT_PATH, output_data, profile, compress, cls=SafeEncoder)
+            save_fingerprints(OUTPUT_PATH, fingerprints)
+
+            print("JSON successfully written using manual serialization")
+        except Exception as e:
+            print(f"Error with manual serialization: {e}")
+
+    print(f"Processed {row_count} rows.")
+    print(f"Created {len(services_list)} services.")
+    print(f"Data saved to '{OUTPUT_PATH}'")
+
+    # Print some statistics
+    print("\nAgencies per service:")
+    for service_name, service_id in service_map.items():
+        agency_count = len(services_data[service_id])
+        print(f"{service_name}: {agency_count} agencies")
+
+    return data
 
-# Print some statistics
-print("\nAgencies per service:")
-for service_name, service_id in service_map.items():
-    agency_count = len(services_data[service_id])
-    print(f"{service_name}: {agency_count} agencies") 
\ No newline at end of file
+if __name__ == '__main__':
+    # Same as `python etl.py services`
+    import etl
+    etl.main(['services', *sys.argv[1:]])
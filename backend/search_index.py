@@ -0,0 +1,150 @@
+import argparse
+import bisect
+import json
+import os
+import random
+import re
+import time
+
+from json_output import write_json
+
+# Inverted index for the search box of the find-nearby page.
+#
+# The page matches the lower-cased search term as a substring of an agency's
+# name, address, requirements, distribution model, notes and cultures served.
+# agency_search.json holds every distinct lower-cased alphanumeric token of
+# those fields with the ordinals (positions in agencies.json) of the agencies
+# using it. Any alphanumeric run of a matching search term is a substring of
+# one of the agency's tokens, so looking the runs up in a sorted list of token
+# suffixes gives a small candidate set; the substring test then only runs on
+# those candidates and the result is exactly that of the scan.
+#
+# test_search_index.py asserts the index returns the same agencies as the scan;
+# `python search_index.py` checks it on agencies.json and times both.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+OUTPUT_PATH = os.path.normpath(os.path.join(BASE_DIR, '..', 'frontend', 'src', 'data', 'agency_search.json'))
+AGENCIES_PATH = os.path.normpath(os.path.join(BASE_DIR, '..', 'frontend', 'src', 'data', 'agencies.json'))
+
+# ASCII only, so the page's /[a-z0-9]+/g splits terms the same way
+TOKEN_PATTERN = re.compile(r'[a-z0-9]+')
+
+# Lower-cased fields the page searches; a term can't contain a newline so it never matches across two
+def search_text(agency):
+    fields = [agency['name'], agency['address'], agency['requirements'], agency['distribution_model'],
+              agency['notes'], *agency['cultures_served']]
+    return '\n'.join(field.lower() for field in fields if field)
+
+def build_search_index(agency_list):
+    postings = {}
+    for ordinal, agency in enumerate(agency_list):
+        for token in set(TOKEN_PATTERN.findall(search_text(agency))):
+            postings.setdefault(token, []).append(ordinal)
+    terms = sorted(postings)
+    return {
+        'count': len(agency_list),
+        'terms': terms,
+        'postings': [postings[term] for term in terms],
+    }
+
+def write_search_json(agency_list, profile='pretty', compress=()):
+    os.makedirs(os.path.dirname(OUTPUT_PATH), exist_ok=True)
+    write_json(OUTPUT_PATH, build_search_index(agency_list), profile, compress)
+
+# Prepare a loaded index for queries: the sorted suffixes of every term with
+# the term each comes from, and the searched text of every agency
+def prepare_search(index, agency_list):
+    pairs = sorted(
+        (term[start:], number)
+        for number, term in enumerate(index['terms'])
+        for start in range(len(term))
+    )
+    return {
+        'postings': index['postings'],
+        'suffixes': [suffix for suffix, _ in pairs],
+        'suffix_terms': [number for _, number in pairs],
+        'texts': [search_text(agency) for agency in agency_list],
+    }
+
+# Ordinals of the agencies that may contain term, or None if term has no
+# alphanumeric run to look up and every agency is a candidate
+def search_candidates(prepared, term):
+    runs = TOKEN_PATTERN.findall(term.lower())
+    if not runs:
+        return None
+    suffixes, suffix_terms, postings = prepared['suffixes'], prepared['suffix_terms'], prepared['postings']
+    candidates = None
+    # Longest runs first, they match the fewest terms
+    for run in sorted(set(runs), key=len, reverse=True):
+        start = bisect.bisect_left(suffixes, run)
+        end = bisect.bisect_left(suffixes, run + '\x7f', start)
+        matched = set()
+        for number in set(suffix_terms[start:end]):
+            matched.update(postings[number])
+        candidates = matched if candidates is None else candidates & matched
+        if not candidates:
+            break
+    return candidates
+
+# Ordinals of the agencies whose searched fields contain term
+def search(prepared, term):
+    term = term.lower()
+    texts = prepared['texts']
+    candidates = search_candidates(prepared, term)
+    if candidates is None:
+        candidates = range(len(texts))
+    return {ordinal for ordinal in candidates if term in texts[ordinal]}
+
+# The page's search: a substring scan over every agency
+def scan(agency_list, term):
+    term = term.lower()
+    return {ordinal for ordinal, agency in enumerate(agency_list) if term in search_text(agency)}
+
+# Search terms like the ones typed into the page: prefixes of words and
+# phrases from the data, plus random strings that mostly match nothing
+def sample_terms(agency_list, count, rng):
+    texts = [search_text(agency) for agency in agency_list]
+    terms = []
+    while len(terms) < count:
+        if rng.random() < 0.8:
+            text = rng.choice(texts)
+            start = rng.randrange(len(text))
+            terms.append(text[start:start + rng.randint(1, 12)].replace('\n', ' '))
+        else:
+            terms.append(''.join(rng.choice('abcdefghijklmnopqrstuvwxyz0123456789 -,.') for _ in range(rng.randint(1, 6))))
+    return terms
+
+# Check the index against the scan on sampled search terms and time both
+def main():
+    parser = argparse.ArgumentParser(description="Compare search index queries with scanning agencies.json")
+    parser.add_argument('--queries', type=int, default=2000, help="Number of sampled search terms (default: 2000)")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    with open(AGENCIES_PATH, encoding='utf-8') as f:
+        agency_list = json.load(f)['agencies']
+
+    start = time.perf_counter()
+    index = build_search_index(agency_list)
+    prepared = prepare_search(index, agency_list)
+    print(f"Built search index for {len(agency_list)} agencies in {time.perf_counter() - start:.3f}s: "
+          f"{len(index['terms'])} terms, {sum(map(len, index['postings']))} postings, {len(prepared['suffixes'])} suffixes")
+
+    terms = sample_terms(agency_list, args.queries, random.Random(args.seed))
+
+    start = time.perf_counter()
+    scanned = [scan(agency_list, term) for term in terms]
+    scan_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    indexed = [search(prepared, term) for term in terms]
+    index_time = time.perf_counter() - start
+
+    for term, expected, found in zip(terms, scanned, indexed):
+        if expected != found:
+            raise SystemExit(f"Error: Search index results differ from the scan for {term!r}")
+    print(f"{args.queries} queries: scan {scan_time * 1000 / args.queries:.3f} ms/query, "
+          f"index {index_time * 1000 / args.queries:.3f} ms/query ({scan_time / index_time:.1f}x)")
+
+if __name__ == '__main__':
+    main()
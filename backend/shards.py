@@ -0,0 +1,180 @@
+import contextlib
+import hashlib
+import io
+import json
+import os
+import re
+
+from json_output import write_json
+from workbook_loader import write_atomic
+
+# Sharded copies of agencies.json and services.json.
+#
+# With --shard-by region or --shard-by county the agencies (and the agencies
+# listed under each service) are also split into one file per region or
+# county under frontend/src/data/shards/, so a client only downloads the part
+# of the network around the user. shards/manifest.json lists every shard with
+# its file, record count and content hash, and maps regions and three-digit
+# ZIP prefixes to the shards holding agencies there.
+#
+# The shards are for clients that only need the part of the network around
+# the user. The frontend pages don't load them: the facet, search and hours
+# indexes refer to agencies by their position in the full agencies.json, so
+# the pages still load that file.
+#
+# Region and county come from the Agency Region and County/Ward columns of the
+# Shopping Partners HOO workbook. Agencies without them (the Markets HOO
+# workbook has neither) fall back to the state in their address, and to an
+# "Other" county of that state. Only the shard files have region and county
+# fields; agencies.json and services.json keep their schema. --shard-by always
+# rebuilds in full, since the outputs an --incremental run patches don't have
+# the region and county to shard them by.
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SHARDS_DIR = os.path.normpath(os.path.join(BASE_DIR, '..', 'frontend', 'src', 'data', 'shards'))
+MANIFEST_PATH = os.path.join(SHARDS_DIR, 'manifest.json')
+
+SHARD_BY = ['region', 'county']
+
+# Fields of the agency records that only the shard files have
+SHARD_FIELDS = ['region', 'county']
+
+UNKNOWN_REGION = 'Unknown'
+
+# State and ZIP code at the end of an address, e.g. "Hyattsville MD 20785"
+STATE_ZIP_PATTERN = re.compile(r'\b([A-Z]{2})\s+(\d{5})(?:-\d{4})?\b')
+ZIP_PATTERN = re.compile(r'\b(\d{5})(?:-\d{4})?\b')
+
+# Add the sharding switches to a script's argument parser
+def add_shard_arguments(parser):
+    parser.add_argument('--shard-by', choices=SHARD_BY, help="Also write agencies.json and services.json split into one file per region or county, with a manifest")
+    parser.add_argument('--hashed-names', action='store_true', help="With --shard-by, put the content hash in the shard file names for cache-busting")
+
+def agency_region(agency):
+    if agency.get('region'):
+        return agency['region']
+    matches = STATE_ZIP_PATTERN.findall(agency.get('address', ''))
+    return matches[-1][0] if matches else UNKNOWN_REGION
+
+def shard_key(agency, shard_by):
+    region = agency_region(agency)
+    if shard_by == 'region':
+        return region
+    return agency.get('county') or f"{region} Other"
+
+def zip_prefix(agency):
+    matches = ZIP_PATTERN.findall(agency.get('address', ''))
+    return matches[-1][:3] if matches else None
+
+# A record as written to a shard file, with the shard fields
+def shard_record(agency):
+    return dict(agency, **{field: agency.get(field) or '' for field in SHARD_FIELDS})
+
+# A record as written to agencies.json or services.json, without them
+def without_shard_fields(agency):
+    return {key: value for key, value in agency.items() if key not in SHARD_FIELDS}
+
+def slugify(key):
+    return re.sub(r'[^a-z0-9]+', '-', key.lower()).strip('-') or 'unknown'
+
+# Agencies of agencies.json by shard, in their original order
+def shard_agency_list(agency_list, shard_by):
+    shards = {}
+    for agency in agency_list:
+        shards.setdefault(shard_key(agency, shard_by), []).append(shard_record(agency))
+    return dict(sorted(shards.items()))
+
+# services.json data by shard: each shard lists the services with an agency in it
+def shard_services_data(services_list, services_data, shard_by):
+    shards = {}
+    for service in services_list:
+        for agency in services_data.get(service['id'], []):
+            agency_data = shards.setdefault(shard_key(agency, shard_by), {})
+            agency_data.setdefault(service['id'], []).append(agency)
+    return {
+        key: {
+            'services': [service for service in services_list if service['id'] in agency_data],
+            'agencyData': agency_data,
+        }
+        for key, agency_data in sorted(shards.items())
+    }
+
+def read_manifest():
+    try:
+        with open(MANIFEST_PATH, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+# Write one kind of shard (agencies or services) and update the manifest.
+# shards maps each shard key to the data written for it, agencies_by_shard to
+# the agency records in it, which give the shard's region and ZIP prefixes
+def write_shards(kind, shards, agencies_by_shard, shard_by, profile='pretty', compress=(), hashed_names=False):
+    os.makedirs(SHARDS_DIR, exist_ok=True)
+    manifest = read_manifest()
+    if manifest is None or manifest.get('shard_by') != shard_by:
+        # Shards of another split can't be mixed with these
+        manifest = {'shard_by': shard_by, 'shards': {}}
+
+    written = set()
+    for key, data in shards.items():
+        path = os.path.join(SHARDS_DIR, f"{kind}-{slugify(key)}.json")
+        # One summary line for all shards instead of one per file
+        with contextlib.redirect_stdout(io.StringIO()):
+            write_json(path, data, profile, compress)
+        with open(path, 'rb') as f:
+            digest = hashlib.sha256(f.read()).hexdigest()
+        if hashed_names:
+            hashed_path = os.path.join(SHARDS_DIR, f"{kind}-{slugify(key)}.{digest[:12]}.json")
+            os.replace(path, hashed_path)
+            for suffix in ('.gz', '.br'):
+                if os.path.exists(path + suffix):
+                    os.replace(path + suffix, hashed_path + suffix)
+            path = hashed_path
+
+        agencies = agencies_by_shard[key]
+        entry = manifest['shards'].setdefault(key, {})
+        entry['region'] = agency_region(agencies[0])
+        entry[kind] = {
+            'path': os.path.basename(path),
+            'sha256': digest,
+            'count': len(agencies),
+            'zip_prefixes': sorted({prefix for prefix in map(zip_prefix, agencies) if prefix}),
+        }
+        written.add(os.path.basename(path))
+
+    # Forget shards of this kind that weren't written this time
+    for key in list(manifest['shards']):
+        if key not in shards:
+            manifest['shards'][key].pop(kind, None)
+            if not any(other in manifest['shards'][key] for other in ('agencies', 'services')):
+                del manifest['shards'][key]
+    manifest['shards'] = dict(sorted(manifest['shards'].items()))
+
+    # Regions and ZIP prefixes to the shards with agencies there, over every kind
+    regions, zip_prefixes = {}, {}
+    for key, entry in manifest['shards'].items():
+        regions.setdefault(entry['region'], []).append(key)
+        for other in ('agencies', 'services'):
+            for prefix in entry.get(other, {}).get('zip_prefixes', []):
+                if key not in zip_prefixes.setdefault(prefix, []):
+                    zip_prefixes[prefix].append(key)
+    manifest['regions'] = dict(sorted(regions.items()))
+    manifest['zip_prefixes'] = dict(sorted(zip_prefixes.items()))
+
+    def write(tmp_path):
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+
+    write_atomic(MANIFEST_PATH, write)
+
+    # Remove shard files from earlier runs that the manifest no longer lists
+    listed = {entry[other]['path'] for entry in manifest['shards'].values() for other in ('agencies', 'services') if other in entry}
+    for name in os.listdir(SHARDS_DIR):
+        base = re.sub(r'\.(gz|br)$', '', name)
+        if base.endswith('.json') and base != os.path.basename(MANIFEST_PATH) and base not in listed:
+            os.remove(os.path.join(SHARDS_DIR, name))
+
+    sizes = [os.path.getsize(os.path.join(SHARDS_DIR, name)) for name in written] or [0]
+    print(f"Wrote {len(written)} {kind} shards by {shard_by} to '{SHARDS_DIR}': "
+          f"largest {max(sizes) / 1024:.1f} KB, total {sum(sizes) / 1024:.1f} KB")
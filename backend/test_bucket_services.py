@@ -0,0 +1,63 @@
+import contextlib
+import io
+import math
+import time
+
+import pandas as pd
+
+from benchmark_processing import MAX_SCALING_EXPONENT
+from process_services import bucket_services
+
+# Service bucketing has to list each agency once per service, matched on ID or
+# name, in time linear in the service rows.
+#
+#   python -m pytest backend/test_bucket_services.py
+
+def rows(entries):
+    return pd.DataFrame(entries, columns=['id', 'name', 'service'])
+
+def bucket(service_rows, by_id=None, by_name=None):
+    with contextlib.redirect_stdout(io.StringIO()):
+        return bucket_services(service_rows, by_id or {}, by_name or {})
+
+def listed(services_data, service_id):
+    return [(agency['id'], agency['name']) for agency in services_data[service_id]]
+
+def test_same_name_with_another_id_is_listed_once():
+    services_data = bucket(rows([('A1', 'Pantry One', 'housing'), ('A2', 'PANTRY ONE', 'housing')]))
+    assert listed(services_data, 'housing') == [('A1', 'Pantry One')]
+
+def test_same_id_with_another_name_is_listed_once():
+    services_data = bucket(rows([('A1', 'Pantry One', 'housing'), ('A1', 'Pantry 1', 'housing')]))
+    assert listed(services_data, 'housing') == [('A1', 'Pantry One')]
+
+def test_agencies_are_matched_per_service():
+    services_data = bucket(rows([
+        ('A1', 'Pantry One', 'housing'), ('A1', 'Pantry One', 'childcare'), ('A2', 'Pantry Two', 'housing'),
+    ]))
+    assert listed(services_data, 'housing') == [('A1', 'Pantry One'), ('A2', 'Pantry Two')]
+    assert listed(services_data, 'childcare') == [('A1', 'Pantry One')]
+
+def test_details_come_from_the_id_before_the_name():
+    by_id = {'A1': {'address': 'by id'}}
+    by_name = {'pantry one': {'address': 'by name'}, 'pantry two': {'address': 'by name'}}
+    services_data = bucket(rows([('A1', 'Pantry One', 'housing'), ('B9', 'Pantry Two', 'housing'), ('C3', 'Nowhere', 'housing')]),
+                           by_id, by_name)
+    assert [agency['address'] for agency in services_data['housing']] == ['by id', 'by name', '']
+
+# Fastest of a few runs over one service of distinct agencies, each listed twice
+def bucketing_seconds(count, repeat=3):
+    service_rows = rows([(f"ID{number % count}", f"Agency {number % count}", 'housing') for number in range(2 * count)])
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        services_data = bucket(service_rows)
+        timings.append(time.perf_counter() - start)
+    assert len(services_data['housing']) == count
+    return min(timings)
+
+def test_bucketing_scales_about_linearly():
+    small, large = 2000, 20000
+    exponent = math.log(bucketing_seconds(large) / bucketing_seconds(small)) / math.log(large / small)
+    # A scan of the agencies already listed would be about 2
+    assert exponent < MAX_SCALING_EXPONENT, f"bucketing time grew as rows ** {exponent:.2f}"
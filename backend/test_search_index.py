@@ -0,0 +1,58 @@
+import json
+import os
+import random
+
+import pytest
+
+from search_index import AGENCIES_PATH, build_search_index, prepare_search, sample_terms, scan, search
+
+# The search index has to return exactly the agencies the page's substring scan does.
+#
+#   python -m pytest backend/test_search_index.py
+
+def agency(name, address='', requirements='', distribution_model='', notes='', cultures_served=()):
+    return {
+        'name': name, 'address': address, 'requirements': requirements,
+        'distribution_model': distribution_model, 'notes': notes, 'cultures_served': list(cultures_served),
+    }
+
+AGENCIES = [
+    agency('St. Mary\'s Food Pantry', '1401 Main St NW Washington DC 20001', 'ID,Zip Code', 'Walk up',
+           'Closed on holidays', ['Latin American', 'West African']),
+    agency('Capital Area Market', '6833 Hill Park Dr Lorton VA 22079', 'Income', 'Drive thru,Walk up',
+           '', ['Middle Eastern/ North African']),
+    agency('CAFÉ 21 Community Kitchen', '21 Oak Ave Hyattsville MD 20785', '', 'Home Delivery', 'Hot meals daily'),
+    agency('Pantry-on-Wheels', '', '', 'Home Delivery,Walk up', 'Walk-ups welcome', ['East Asian']),
+    agency('Oakwood Seniors', '500 Oakwood Rd Laurel MD 20707'),
+]
+
+TERMS = [
+    'pantry', 'PANTRY', 'st. mary', "mary's", 'walk up', 'walk-up', 'walk', 'up', 'delivery,walk',
+    '20785', '207', 'oak', 'oakwood rd', 'café', 'caf', 'é', '21 c', 'zip code', 'id,zip', 'n',
+    ' ', '-', '.', ',', '/ north', 'asian', 'holidays', 'wheels dr', 'xyz', 'kitchen 21', '',
+]
+
+def check_terms(agency_list, terms):
+    prepared = prepare_search(build_search_index(agency_list), agency_list)
+    for term in terms:
+        assert search(prepared, term) == scan(agency_list, term), term
+
+@pytest.mark.parametrize('term', TERMS)
+def test_matches_scan(term):
+    check_terms(AGENCIES, [term])
+
+def test_matches_scan_on_sampled_terms():
+    check_terms(AGENCIES, sample_terms(AGENCIES, 500, random.Random(0)))
+
+# The committed agencies.json, as built by the pipeline; nothing is regenerated
+@pytest.mark.skipif(not os.path.exists(AGENCIES_PATH), reason="agencies.json has not been built")
+def test_matches_scan_on_agencies_json():
+    with open(AGENCIES_PATH, encoding='utf-8') as f:
+        agency_list = json.load(f)['agencies']
+    check_terms(agency_list, sample_terms(agency_list, 2000, random.Random(0)))
+
+def test_index_lists_every_token_once_per_agency():
+    index = build_search_index(AGENCIES)
+    assert index['count'] == len(AGENCIES)
+    assert index['terms'] == sorted(set(index['terms']))
+    assert all(postings == sorted(set(postings)) for postings in index['postings'])
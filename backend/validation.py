@@ -0,0 +1,280 @@
+import datetime
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+
+from hours import parse_minutes
+from process_agencies import find_column
+from process_services import service_map, clean_text, normalize_day
+
+# Validation of the raw workbooks, before any cleaning or merging.
+#
+# Every workbook (or streamed chunk) is checked column by column as soon as it
+# is read:
+#
+#   schema   the columns the processors read must be there. A missing required
+#            column stops the run at once; a missing optional one (the fuzzy
+#            find_column lookups for distribution model, food format and hours
+#            notes) is reported, since its field will be empty everywhere
+#   rows     names, day names (the ones process_services.normalize_day
+#            recognizes, e.g. "Mondays" or "Mon."), time parseability, start
+#            before end, agency ID and phone formats, appointment and service
+#            values
+#
+# Rows with an error in what identifies them (no agency name) are quarantined:
+# left out of the outputs. Rows with an error in their time slot (an unknown
+# day, a time that isn't one, a slot ending when it starts) keep the agency's
+# details but have the day and times cleared, so no made-up hours are
+# published. Rows with a warning (an odd ID or phone number, a slot running past
+# midnight, a value the processors fall back on a default for) are kept as they
+# are. All of them are written to the quarantine CSV with the check, the action
+# taken, the column, the value and the whole source row, numbered as in Excel.
+#
+# The checks fail fast: when more than --max-invalid-share of a workbook's rows
+# have errors, the run stops after that check with the reason, instead of
+# producing outputs from an export with shifted or renamed columns. A workbook
+# streamed in chunks is held to the same share over all of its rows, once its
+# last chunk is checked, so neither a small chunk nor a cluster of bad rows in
+# one chunk decides it.
+
+QUARANTINE_PATH = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Data', 'quarantine.csv'))
+
+# Validation settings shared by every load in this process, set from the command line
+validation_settings = {
+    'enabled': True,
+    'max_invalid_share': 0.25,
+}
+
+# Issues found by the loads of this run, one frame per workbook or chunk
+quarantine_frames = []
+
+ISSUE_COLUMNS = ['workbook', 'row', 'severity', 'action', 'check', 'column', 'value', 'record']
+
+HOURS_COLUMNS = ['Day or Week', 'Starting Time', 'Ending Time']
+
+# Errors in a HOO row's time slot, which clear the slot instead of quarantining the row
+HOURS_CHECKS = {'day_unknown', 'time_unparseable', 'slot_empty'}
+
+# Workbooks this small can't tell a broken export from a few bad rows
+MIN_ROWS_FOR_SHARE = 20
+
+AGENCY_ID_PATTERN = re.compile(r'^\d{5}-[A-Z]{4}-\d{2}$')
+PHONE_PATTERN = re.compile(r'\(?\d{3}\)?[\s.-]*\d{3}[\s.-]*\d{4}')
+
+# Free-text values the partner sheets use on purpose, passed through as they are
+DAY_TEXT = {'as needed'}
+TIME_TEXT = {'as needed', 'until food runs out'}
+
+APPOINTMENT_VALUES = {'yes', 'true', '1', 'required', 'y', 'by appointment only', 'no', 'false', '0', 'not required', 'n'}
+
+# Columns every kind of workbook needs; an entry of several names needs one of them
+REQUIRED_COLUMNS = {
+    'hoo': ['Agency Name', ('Agency ID', 'External ID'), 'Shipping Address', 'Day or Week', 'Starting Time', 'Ending Time'],
+    'cultures': ['Agency ID', 'Cultural Populations Served'],
+    'services': ['Agency ID', 'Agency Name', 'Wraparound Service'],
+}
+
+# Columns process_agencies.process_hoo_data finds by part of their name
+FUZZY_COLUMNS = {
+    'hoo': [('Distribution Model', 'Distribution'), ('Food Format', 'Format'), ('Additional Note', 'Hours Notes', 'Hours Note')],
+}
+
+class ValidationError(Exception):
+    pass
+
+# Add the validation switches to a script's argument parser
+def add_validation_arguments(parser):
+    parser.add_argument('--no-validate', action='store_true', help="Skip the workbook checks and quarantine")
+    parser.add_argument('--max-invalid-share', type=float, default=validation_settings['max_invalid_share'], help=f"Stop when more than this share of a workbook's rows are invalid (default: {validation_settings['max_invalid_share']})")
+    parser.add_argument('--quarantine', default=QUARANTINE_PATH, help=f"Write the invalid and suspicious rows to this CSV file (default: {QUARANTINE_PATH})")
+
+# Apply the switches parsed by add_validation_arguments
+def configure_validation(args):
+    validation_settings['enabled'] = not args.no_validate
+    validation_settings['max_invalid_share'] = args.max_invalid_share
+
+# Evaluate a scalar test once per distinct value of a column
+def map_values(series, test):
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    results = np.array([test(value) for value in uniques] + [False], dtype=bool)
+    return results[codes]
+
+def is_blank(series):
+    return (series.isna() | (series.astype(str).str.strip() == "")).to_numpy()
+
+def text_key(value):
+    return str(value).strip().lower()
+
+# Minutes after midnight of a time cell, or None; the same values process_agencies.format_time accepts
+def cell_minutes(value):
+    if isinstance(value, (pd.Timestamp, datetime.datetime, datetime.time)):
+        return value.hour * 60 + value.minute
+    minutes = parse_minutes(value)
+    if minutes is None and isinstance(value, str):
+        try:
+            parsed = pd.to_datetime(value)
+        except (ValueError, TypeError, OverflowError):
+            return None
+        minutes = parsed.hour * 60 + parsed.minute
+    return minutes
+
+def time_minutes(series):
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    minutes = np.array([cell_minutes(value) if text_key(value) not in TIME_TEXT else -1 for value in uniques] + [-1], dtype=object)
+    return minutes[codes]
+
+def column(df, names):
+    for name in ([names] if isinstance(names, str) else names):
+        if name in df.columns:
+            return name
+    return None
+
+# Row checks of a HOO workbook as (name, severity, column, mask) in the order they run
+def hoo_checks(df):
+    name, day, start, end = 'Agency Name', 'Day or Week', 'Starting Time', 'Ending Time'
+    yield 'agency_name_missing', 'error', name, is_blank(df[name])
+
+    has_day = ~is_blank(df[day])
+    known_day = map_values(df[day], lambda value: normalize_day(clean_text(value)) is not None or text_key(value) in DAY_TEXT)
+    yield 'day_unknown', 'error', day, has_day & ~known_day
+
+    start_minutes, end_minutes = time_minutes(df[start]), time_minutes(df[end])
+    for col, minutes in [(start, start_minutes), (end, end_minutes)]:
+        blank = is_blank(df[col])
+        yield 'time_unparseable', 'error', col, ~blank & np.array([value is None for value in minutes])
+        yield 'time_missing', 'warning', col, has_day & blank
+
+    timed = np.array([isinstance(s, int) and isinstance(e, int) and s >= 0 and e >= 0 for s, e in zip(start_minutes, end_minutes)], dtype=bool)
+    starts = np.where(timed, start_minutes, 0).astype(int)
+    ends = np.where(timed, end_minutes, 0).astype(int)
+    yield 'slot_empty', 'error', end, timed & (starts == ends)
+    yield 'slot_past_midnight', 'warning', end, timed & (ends < starts)
+
+    id_column = column(df, ('Agency ID', 'External ID'))
+    yield from id_checks(df, id_column)
+    if 'Phone' in df.columns:
+        has_phone = ~is_blank(df['Phone'])
+        yield 'phone_format', 'warning', 'Phone', has_phone & ~map_values(df['Phone'], lambda value: bool(PHONE_PATTERN.search(str(value))))
+    if 'By Appointment Only' in df.columns:
+        col = 'By Appointment Only'
+        recognized = map_values(df[col], lambda value: isinstance(value, bool) or text_key(value) in APPOINTMENT_VALUES)
+        yield 'appointment_unrecognized', 'warning', col, ~is_blank(df[col]) & ~recognized
+
+def id_checks(df, id_column):
+    blank = is_blank(df[id_column])
+    yield 'agency_id_missing', 'warning', id_column, blank
+    yield 'agency_id_format', 'warning', id_column, ~blank & ~map_values(df[id_column], lambda value: bool(AGENCY_ID_PATTERN.match(str(value).strip())))
+
+def cultures_checks(df, name_column):
+    yield 'agency_name_missing', 'error', name_column, is_blank(df[name_column])
+    yield from id_checks(df, 'Agency ID')
+    yield 'culture_missing', 'warning', 'Cultural Populations Served', is_blank(df['Cultural Populations Served'])
+
+def services_checks(df):
+    yield 'agency_missing', 'error', 'Agency Name', is_blank(df['Agency Name']) & is_blank(df['Agency ID'])
+    yield from id_checks(df, 'Agency ID')
+    mapped = map_values(df['Wraparound Service'], lambda value: clean_text(value) in service_map)
+    yield 'service_unmapped', 'warning', 'Wraparound Service', ~mapped
+
+def issue_frame(workbook, df, rows, severity, action, check, col, values):
+    records = df.iloc[rows].astype(object).where(df.iloc[rows].notna(), None)
+    return pd.DataFrame({
+        'workbook': workbook,
+        'row': df.index[rows] + 2,  # Excel row: 1-based, after the header
+        'severity': severity,
+        'action': action,
+        'check': check,
+        'column': col,
+        'value': [None if pd.isna(value) else str(value) for value in values],
+        'record': [json.dumps(record, default=str, ensure_ascii=False) for record in records.to_dict('records')],
+    }, columns=ISSUE_COLUMNS)
+
+# Check one raw workbook frame (or chunk of one); returns the rows that weren't
+# quarantined, with invalid time slots cleared, and a frame of the issues
+# found. kind is 'hoo', 'cultures' or 'services'. Raises ValidationError when
+# a required column is missing or, with check_share, too many rows are
+# invalid; chunks leave that to check_invalid_share on the whole workbook
+def validate_frame(workbook, df, kind, name_column='Agency Name', check_share=True):
+    required = REQUIRED_COLUMNS[kind] + ([name_column] if kind == 'cultures' else [])
+    missing = [names if isinstance(names, str) else ' or '.join(names) for names in required if column(df, names) is None]
+    if missing and len(df.columns):
+        raise ValidationError(f"{workbook} is missing the column(s) {', '.join(repr(name) for name in missing)}; "
+                              f"its columns are {', '.join(repr(name) for name in df.columns)}")
+
+    issues = []
+    for names in FUZZY_COLUMNS.get(kind, []):
+        if not any(find_column(df, name) for name in names):
+            issues.append(pd.DataFrame([{
+                'workbook': workbook, 'row': None, 'severity': 'warning', 'action': 'kept', 'check': 'column_missing',
+                'column': names[0], 'value': None, 'record': None,
+            }], columns=ISSUE_COLUMNS))
+    if df.empty:
+        return df, pd.concat(issues, ignore_index=True) if issues else pd.DataFrame(columns=ISSUE_COLUMNS)
+
+    checks = (hoo_checks(df) if kind == 'hoo' else
+              cultures_checks(df, name_column) if kind == 'cultures' else services_checks(df))
+    quarantined = np.zeros(len(df), dtype=bool)
+    cleared = np.zeros(len(df), dtype=bool)
+    limit = validation_settings['max_invalid_share'] * len(df)
+    for check, severity, col, mask in checks:
+        action = 'kept' if severity == 'warning' else 'hours_cleared' if check in HOURS_CHECKS else 'quarantined'
+        rows = np.flatnonzero(mask)
+        if len(rows):
+            issues.append(issue_frame(workbook, df, rows, severity, action, check, col, df[col].to_numpy()[rows]))
+        if severity == 'error':
+            if action == 'hours_cleared':
+                cleared |= mask
+            else:
+                quarantined |= mask
+            invalid = int((quarantined | cleared).sum())
+            # Fail fast: no need to run the remaining checks on a broken export
+            if check_share and len(df) >= MIN_ROWS_FOR_SHARE and invalid > limit:
+                example = df[col].iloc[rows[0]] if len(rows) else None
+                raise ValidationError(
+                    f"{workbook}: {invalid} of {len(df)} rows are invalid, more than the allowed "
+                    f"{validation_settings['max_invalid_share']:.0%} (check {check} on {col!r}, e.g. {example!r} "
+                    f"in row {df.index[rows[0]] + 2 if len(rows) else '?'})"
+                )
+
+    issues = pd.concat(issues, ignore_index=True) if issues else pd.DataFrame(columns=ISSUE_COLUMNS)
+    if cleared.any():
+        df = df.copy()
+        df.loc[cleared, HOURS_COLUMNS] = np.nan
+    return df[~quarantined], issues
+
+# Raise ValidationError when more than the allowed share of a workbook's rows
+# were quarantined or had their hours cleared, from the issues of all its chunks
+def check_invalid_share(workbook, issues, rows):
+    invalid = issues[issues['action'].isin(['quarantined', 'hours_cleared'])]
+    count = invalid['row'].nunique()
+    if rows < MIN_ROWS_FOR_SHARE or count <= validation_settings['max_invalid_share'] * rows:
+        return
+    check, col = invalid.groupby(['check', 'column'], sort=False).size().idxmax()
+    example = invalid[(invalid['check'] == check) & (invalid['column'] == col)].iloc[0]
+    raise ValidationError(
+        f"{workbook}: {count} of {rows} rows are invalid, more than the allowed "
+        f"{validation_settings['max_invalid_share']:.0%} (mostly check {check} on {col!r}, e.g. {example['value']!r} "
+        f"in row {int(example['row'])})"
+    )
+
+def print_validation_summary(frames):
+    issues = pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=ISSUE_COLUMNS)
+    if issues.empty:
+        print("Validation: no invalid or suspicious rows")
+        return issues
+    rows = issues.dropna(subset=['row']).drop_duplicates(['workbook', 'row', 'action'])
+    print(f"Validation: {int((rows['action'] == 'quarantined').sum())} rows quarantined, "
+          f"{int((rows['action'] == 'hours_cleared').sum())} with their hours cleared, "
+          f"{int((issues['severity'] == 'warning').sum())} warnings")
+    for (action, check, workbook), count in issues.groupby(['action', 'check', 'workbook']).size().items():
+        print(f"  {action:<14} {check:<26} {workbook:<48} {count:>5}")
+    return issues
+
+def write_quarantine(path, frames):
+    issues = print_validation_summary(frames)
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    issues.sort_values(['workbook', 'row', 'severity'], kind='stable', na_position='first').to_csv(path, index=False)
+    print(f"Quarantine saved to '{path}'")
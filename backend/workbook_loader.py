@@ -0,0 +1,316 @@
+import argparse
+import contextlib
+import datetime
+import hashlib
+import io
+import json
+import os
+import time
+
+import numpy as np
+import openpyxl
+import pandas as pd
+from openpyxl.cell.cell import TYPE_ERROR, TYPE_NUMERIC
+from pandas.io.parsers import TextParser
+
+# Shared Excel loader for process_agencies.py and process_services.py.
+#
+# The first read of a workbook parses it with openpyxl and stores the resulting
+# DataFrame in a columnar cache next to it (Data/.cache/), keyed by the content
+# hash of the workbook. Later reads, from either script, load the cache instead.
+# Parquet is used when pyarrow is installed and the sheet converts cleanly;
+# sheets with mixed-type columns (e.g. IDs that are sometimes numbers) fall back
+# to a pickle so the values round-trip exactly.
+#
+# iter_workbook_chunks reads a workbook in bounded chunks instead, for sheets
+# too large to hold in memory; it doesn't use the cache.
+
+CACHE_DIR_NAME = '.cache'
+
+# Cache settings shared by every read in this process, set from the command line
+cache_settings = {
+    'enabled': True,
+    'rebuild': False,
+}
+
+# Add the cache switches to a script's argument parser
+def add_cache_arguments(parser):
+    parser.add_argument('--no-cache', action='store_true', help="Always parse the Excel files and don't touch the cache")
+    parser.add_argument('--rebuild-cache', action='store_true', help="Reparse the Excel files and overwrite the cache")
+
+# Apply the cache switches parsed by add_cache_arguments
+def configure_cache(args):
+    cache_settings['enabled'] = not args.no_cache
+    cache_settings['rebuild'] = args.rebuild_cache
+
+def hash_file(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def cache_paths(path):
+    cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), CACHE_DIR_NAME)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    return cache_dir, os.path.join(cache_dir, f"{stem}.meta.json")
+
+def read_meta(meta_path):
+    try:
+        with open(meta_path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+def write_atomic(path, write):
+    tmp_path = f"{path}.tmp"
+    try:
+        write(tmp_path)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+def write_meta(meta_path, meta):
+    def write(tmp_path):
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(meta, f, indent=2)
+    write_atomic(meta_path, write)
+
+# Store a parsed sheet in the cache, returns the cache file name and format
+def write_cache(df, cache_dir, stem, digest):
+    try:
+        cache_file = f"{stem}-{digest[:16]}.parquet"
+        write_atomic(os.path.join(cache_dir, cache_file), lambda tmp: df.to_parquet(tmp, engine='pyarrow', index=False))
+        return cache_file, 'parquet'
+    except (ImportError, TypeError, ValueError):
+        # No pyarrow, or a mixed-type column Arrow can't represent
+        cache_file = f"{stem}-{digest[:16]}.pkl"
+        write_atomic(os.path.join(cache_dir, cache_file), lambda tmp: df.to_pickle(tmp))
+        return cache_file, 'pickle'
+
+def read_cache(cache_dir, meta):
+    cache_path = os.path.join(cache_dir, meta['file'])
+    if meta['format'] == 'parquet':
+        return pd.read_parquet(cache_path, engine='pyarrow')
+    return pd.read_pickle(cache_path)
+
+# Read an Excel workbook into a DataFrame, going through the on-disk cache
+def read_workbook(path, use_cache=None, rebuild=None):
+    use_cache = cache_settings['enabled'] if use_cache is None else use_cache
+    rebuild = cache_settings['rebuild'] if rebuild is None else rebuild
+    start = time.perf_counter()
+
+    if not use_cache:
+        df = pd.read_excel(path, engine='openpyxl')
+        print(f"Parsed {path} in {time.perf_counter() - start:.3f}s (cache disabled)")
+        return df
+
+    cache_dir, meta_path = cache_paths(path)
+    stem = os.path.splitext(os.path.basename(path))[0]
+    stat = os.stat(path)
+    meta = None if rebuild else read_meta(meta_path)
+
+    if meta is not None:
+        # Same mtime and size means the workbook is unchanged; otherwise
+        # check the content hash before trusting the cache
+        unchanged = meta.get('mtime_ns') == stat.st_mtime_ns and meta.get('size') == stat.st_size
+        if not unchanged and meta.get('sha256') == hash_file(path):
+            meta.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+            write_meta(meta_path, meta)
+            unchanged = True
+        if unchanged:
+            try:
+                df = read_cache(cache_dir, meta)
+                print(f"Loaded {path} from {meta['format']} cache in {time.perf_counter() - start:.3f}s (warm)")
+                return df
+            except (OSError, ValueError, KeyError) as e:
+                print(f"Warning: Could not read cache for {path}, reparsing: {e}")
+
+    digest = hash_file(path)
+    df = pd.read_excel(path, engine='openpyxl')
+    parse_time = time.perf_counter() - start
+
+    os.makedirs(cache_dir, exist_ok=True)
+    cache_file, cache_format = write_cache(df, cache_dir, stem, digest)
+    # Drop the cache file of the previous version of this workbook
+    if meta is None:
+        meta = read_meta(meta_path)
+    if meta and meta.get('file') != cache_file:
+        try:
+            os.remove(os.path.join(cache_dir, meta['file']))
+        except (OSError, KeyError):
+            pass
+    meta = {
+        'source': os.path.basename(path),
+        'sha256': digest,
+        'mtime_ns': stat.st_mtime_ns,
+        'size': stat.st_size,
+        'file': cache_file,
+        'format': cache_format,
+    }
+    write_meta(meta_path, meta)
+
+    print(f"Parsed {path} in {parse_time:.3f}s and cached as {cache_format} (cold)")
+    return df
+
+# Convert an openpyxl cell value the way pandas' openpyxl reader does
+def convert_cell(cell):
+    if cell.value is None:
+        return ""
+    if cell.data_type == TYPE_ERROR:
+        return np.nan
+    if cell.data_type == TYPE_NUMERIC:
+        value = int(cell.value)
+        return value if value == cell.value else float(cell.value)
+    return cell.value
+
+# Converted sheet rows in read-only mode, without the trailing empty rows pandas drops
+def iter_sheet_rows(path):
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True, keep_links=False)
+    try:
+        sheet = workbook.worksheets[0]
+        sheet.reset_dimensions()
+        blank_rows = 0
+        for row in sheet.rows:
+            converted = [convert_cell(cell) for cell in row]
+            while converted and converted[-1] == "":
+                converted.pop()
+            if not converted:
+                # Only emitted if a row with data follows
+                blank_rows += 1
+                continue
+            for _ in range(blank_rows):
+                yield []
+            blank_rows = 0
+            yield converted
+    finally:
+        workbook.close()
+
+# Group rows into lists of at most chunk_size rows
+def iter_row_chunks(rows, chunk_size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+# Parse a header and rows padded to the sheet width, with the options read_excel uses
+def parse_rows(header, rows, width):
+    data = [row + [""] * (width - len(row)) for row in [header, *rows]]
+    return TextParser(data, header=0, skip_blank_lines=False).read()
+
+# Chunk dtype of text/number/boolean mixes, whose whole-column values depend on
+# the other chunks (pandas replaces e.g. 0 with an earlier False, or 'True' with True)
+MIXED = 'mixed'
+
+# dtype of a parsed chunk column, or None if every value in it is missing
+def chunk_dtype(series):
+    if series.dtype == np.float64 and series.isna().all():
+        return None
+    if series.dtype == object and not all(isinstance(value, (datetime.time, datetime.datetime)) for value in series.dropna()):
+        return MIXED
+    return series.dtype
+
+# dtype pandas infers for a whole column from the dtypes of its chunks, or None
+# if that depends on the values themselves (e.g. numbers in one chunk and text in another)
+def join_dtypes(dtypes):
+    present = {dtype for dtype in dtypes if dtype is not None}
+    has_missing = None in dtypes
+    if not present:
+        return np.dtype('float64')
+    if any(dtype is MIXED for dtype in present):
+        return None
+    if len(present) == 1:
+        dtype = present.pop()
+        if pd.api.types.is_bool_dtype(dtype):
+            # Booleans with missing values depend on whether the cells were text
+            return None if has_missing else dtype
+        if pd.api.types.is_integer_dtype(dtype) and has_missing:
+            return np.dtype('float64')
+        return dtype
+    if present == {np.dtype('int64'), np.dtype('float64')}:
+        return np.dtype('float64')
+    return None
+
+# Parse whole columns from their raw cell values, for columns whose dtype can't be
+# derived from the chunks. Only these columns are held in memory in full.
+def parse_whole_columns(path, positions):
+    values = {position: [] for position in positions}
+    rows = iter_sheet_rows(path)
+    next(rows)
+    for row in rows:
+        for position in positions:
+            values[position].append([row[position] if position < len(row) else ""])
+    return {
+        position: TextParser([['column'], *column], header=0, skip_blank_lines=False).read()['column']
+        for position, column in values.items()
+    }
+
+# Read an Excel workbook as DataFrames of at most chunk_size rows with openpyxl's
+# read-only mode, so the whole sheet is never in memory at once. The sheet is read
+# twice: the first pass only records the dtypes pandas gives each chunk's columns,
+# so that the second pass can give every chunk the dtypes read_workbook infers for
+# the whole sheet. Concatenated, the chunks equal what read_workbook returns.
+def iter_workbook_chunks(path, chunk_size):
+    rows = iter_sheet_rows(path)
+    header = next(rows, None)
+    if header is None:
+        yield pd.DataFrame()
+        return
+
+    width = len(header)
+    chunk_dtypes = []
+    for chunk in iter_row_chunks(rows, chunk_size):
+        width = max(width, *(len(row) for row in chunk))
+        df = parse_rows(header, chunk, width)
+        chunk_dtypes.append([chunk_dtype(df[column]) for column in df.columns])
+
+    if not chunk_dtypes:
+        yield parse_rows(header, [], width)
+        return
+
+    # Columns missing from a narrower chunk are all missing values
+    targets = [
+        join_dtypes([dtypes[position] if position < len(dtypes) else None for dtypes in chunk_dtypes])
+        for position in range(width)
+    ]
+    whole_columns = parse_whole_columns(path, [position for position, target in enumerate(targets) if target is None])
+
+    rows = iter_sheet_rows(path)
+    next(rows)
+    offset = 0
+    for chunk in iter_row_chunks(rows, chunk_size):
+        df = parse_rows(header, chunk, width)
+        index = pd.RangeIndex(offset, offset + len(df))
+        df.index = index
+        for position, (column, target) in enumerate(zip(df.columns, targets)):
+            if target is None:
+                df[column] = whole_columns[position].iloc[offset:offset + len(df)].set_axis(index)
+            elif df[column].dtype != target:
+                df[column] = df[column].astype(target)
+        offset += len(df)
+        yield df
+
+# Compare cold (openpyxl) and warm (cache) load times for the given workbooks
+def main():
+    parser = argparse.ArgumentParser(description="Compare cold and warm workbook load times")
+    parser.add_argument('paths', nargs='+')
+    args = parser.parse_args()
+
+    print(f"{'workbook':<50} {'cold':>9} {'warm':>9} {'speedup':>8}")
+    for path in args.paths:
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            read_workbook(path, rebuild=True)
+            cold = time.perf_counter() - start
+            start = time.perf_counter()
+            read_workbook(path)
+            warm = time.perf_counter() - start
+        print(f"{os.path.basename(path):<50} {cold:8.3f}s {warm:8.3f}s {cold / warm:7.1f}x")
+
+if __name__ == '__main__':
+    main()
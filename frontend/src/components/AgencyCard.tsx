@@ -116,7 +116,7 @@ const AgencyCard: React.FC<AgencyCardProps> = ({ agency }) => {
   
   // Infer food formats from agency data
   const inferFoodFormats = (): string[] => {
-    if (agency.food_format) return [agency.food_format];
+    if (agency.food_format) return [agency.food_format_label || agency.food_format];
     
     const notesLower = agency.notes ? agency.notes.toLowerCase() : '';
     const distributionLower = agency.distribution_model ? agency.distribution_model.toLowerCase() : '';
@@ -196,7 +196,7 @@ const AgencyCard: React.FC<AgencyCardProps> = ({ agency }) => {
             <Info className="h-4 w-4 mr-1 mt-1 flex-shrink-0 text-blue-500" />
             <div>
               <p className="text-sm font-medium text-gray-700 mb-1">Requirements:</p>
-              <p className="text-sm text-gray-600">{agency.requirements}</p>
+              <p className="text-sm text-gray-600">{agency.requirements_label || agency.requirements}</p>
             </div>
           </div>
         )}
@@ -206,7 +206,7 @@ const AgencyCard: React.FC<AgencyCardProps> = ({ agency }) => {
             <Package className="h-4 w-4 mr-1 mt-1 flex-shrink-0 text-green-500" />
             <div>
               <p className="text-sm font-medium text-gray-700 mb-1">Distribution Model:</p>
-              <p className="text-sm text-gray-600">{agency.distribution_model}</p>
+              <p className="text-sm text-gray-600">{agency.distribution_model_label || agency.distribution_model}</p>
             </div>
           </div>
         )}
@@ -251,7 +251,7 @@ const AgencyCard: React.FC<AgencyCardProps> = ({ agency }) => {
                     key={index} 
                     className="px-2 py-1 text-xs rounded-full bg-purple-100 text-purple-800"
                   >
-                    {culture}
+                    {agency.cultures_served_labels?.[index] || culture}
                   </span>
                 ))}
               </div>
@@ -5,6 +5,10 @@ import LocationFinder from '../components/LocationFinder';
 import AgencyCard from '../components/AgencyCard';
 import { Agency, Hours, TimeSlot } from '../types';
 import { sortAgenciesByDistance } from '../utils/routesApiUtils';
+import { Coordinates, loadAgencyLocations, coordinatesByAddress } from '../utils/agencyLocations';
+import { AgencyFacets, FacetFlag, loadAgencyFacets, matchFacets } from '../utils/agencyFacets';
+import { PreparedSearch, loadAgencySearch, prepareAgencySearch, searchCandidates } from '../utils/agencySearch';
+import { AgencyHours, loadAgencyHours, matchTimeBlocks } from '../utils/agencyHours';
 import { useTranslation } from 'react-i18next';
 
 // Days of the week
@@ -93,6 +97,23 @@ const detectFoodFormat = (agency: Agency, format: string): boolean => {
   }
 };
 
+// agencies.json in the page's language. A locale bundle (backend/locale_bundles.py) keeps the English
+// fields and the order of agencies.json, which the filters and indexes rely on, and adds display labels;
+// English, or a language without a bundle, gets agencies.json itself
+const fetchAgencies = async (language: string): Promise<Response> => {
+  const locale = language.split('-')[0];
+  if (locale !== 'en') {
+    try {
+      const response = await fetch(`/data/locales/${locale}/agencies.json`);
+      // A dev server answers unknown paths with index.html
+      if (response.ok && (response.headers.get('content-type') || '').includes('json')) return response;
+    } catch (error) {
+      console.warn(`No ${locale} agency bundle, using agencies.json:`, error);
+    }
+  }
+  return fetch('/data/agencies.json');
+};
+
 const FindNearbyAgenciesPage: React.FC = () => {
   const [searchParams, setSearchParams] = useSearchParams();
   const [agencies, setAgencies] = useState<Agency[]>([]);
@@ -100,6 +121,10 @@ const FindNearbyAgenciesPage: React.FC = () => {
   const [loading, setLoading] = useState(true);
   const [locationLoading, setLocationLoading] = useState(false);
   const [userLocation, setUserLocation] = useState<string | null>(null);
+  const [agencyCoords, setAgencyCoords] = useState<Record<string, Coordinates>>({});
+  const [facetIndex, setFacetIndex] = useState<{ facets: AgencyFacets, ordinals: Record<string, number> } | null>(null);
+  const [searchIndex, setSearchIndex] = useState<{ search: PreparedSearch, ordinals: Record<string, number> } | null>(null);
+  const [hoursIndex, setHoursIndex] = useState<{ hours: AgencyHours, ordinals: Record<string, number> } | null>(null);
   const [searchTerm, setSearchTerm] = useState('');
   
   // Filter states
@@ -112,7 +137,7 @@ const FindNearbyAgenciesPage: React.FC = () => {
   const [homeDeliveryOnly, setHomeDeliveryOnly] = useState(false);
   const [filtersExpanded, setFiltersExpanded] = useState(false);
 
-  const {t} = useTranslation();
+  const {t, i18n} = useTranslation();
 
   // Update the title
   useEffect(() => {
@@ -125,8 +150,32 @@ const FindNearbyAgenciesPage: React.FC = () => {
       try {
         // Fetch agencies data from the JSON file
         // const response = await fetch('/src/data/agencies.json');
-        const response = await fetch('/data/agencies.json');
+        const [response, locations, facets, search, hours] = await Promise.all([
+          fetchAgencies(i18n.language),
+          loadAgencyLocations(),
+          loadAgencyFacets(),
+          loadAgencySearch(),
+          loadAgencyHours()
+        ]);
         const data = await response.json();
+
+        // Agency coordinates geocoded at build time, so they aren't geocoded per search
+        const coords = locations ? coordinatesByAddress(locations) : {};
+        setAgencyCoords(coords);
+
+        // Facet, search and hours indexes refer to agencies by their position in agencies.json; only
+        // use them if they were built with it, since the list gets re-sorted by distance
+        const ordinals: Record<string, number> = {};
+        data.agencies.forEach((agency: Agency, index: number) => { ordinals[agency.name] = index; });
+        if (facets && facets.count === data.agencies.length) {
+          setFacetIndex({ facets, ordinals });
+        }
+        if (search && search.count === data.agencies.length) {
+          setSearchIndex({ search: prepareAgencySearch(search), ordinals });
+        }
+        if (hours && hours.count === data.agencies.length) {
+          setHoursIndex({ hours, ordinals });
+        }
         
         // Add IDs to agencies if they don't have them
         const agenciesWithIds = data.agencies.map((agency: Agency, index: number) => ({
@@ -142,7 +191,7 @@ const FindNearbyAgenciesPage: React.FC = () => {
         if (zipFromUrl) {
           setUserLocation(zipFromUrl);
           // Calculate distances based on ZIP code from URL
-          handleLocationUpdate(zipFromUrl, agenciesWithIds);
+          handleLocationUpdate(zipFromUrl, agenciesWithIds, coords);
         } else {
           setLoading(false);
         }
@@ -153,17 +202,17 @@ const FindNearbyAgenciesPage: React.FC = () => {
     };
     
     fetchAgencyData();
-  }, [searchParams]);
+  }, [searchParams, i18n.language]);
 
   // Apply all filters when any filter changes
   useEffect(() => {
     if (!agencies.length) return;
     
     applyAllFilters();
-  }, [searchTerm, selectedDays, selectedTimeBlocks, selectedCultures, selectedDistributionModels, selectedFoodFormats, preparedMealsOnly, homeDeliveryOnly, agencies]);
+  }, [searchTerm, selectedDays, selectedTimeBlocks, selectedCultures, selectedDistributionModels, selectedFoodFormats, preparedMealsOnly, homeDeliveryOnly, agencies, facetIndex, searchIndex, hoursIndex]);
 
   // Handle when a user selects a location (ZIP code or coordinates)
-  const handleLocationUpdate = async (location: string, agencyList = agencies) => {
+  const handleLocationUpdate = async (location: string, agencyList = agencies, coords = agencyCoords) => {
     setLocationLoading(true);
     setUserLocation(location);
     
@@ -176,7 +225,7 @@ const FindNearbyAgenciesPage: React.FC = () => {
     try {
       // Sort agencies by distance from the selected location
       // Use false for the third parameter to use the fallback method until the proxy is set up
-      const sortedAgencies = await sortAgenciesByDistance(agencyList, location, false);
+      const sortedAgencies = await sortAgenciesByDistance(agencyList, location, false, coords);
       
       // Update the main agency list
       setAgencies(sortedAgencies);
@@ -356,6 +405,13 @@ const FindNearbyAgenciesPage: React.FC = () => {
     // Apply text search filter
     if (searchTerm) {
       const term = searchTerm.toLowerCase();
+
+      // Only agencies the search index can't rule out need the substring checks
+      const candidates = searchIndex ? searchCandidates(searchIndex.search, term) : null;
+      if (candidates && searchIndex) {
+        filtered = filtered.filter(agency => candidates[searchIndex.ordinals[agency.name]] === 1);
+      }
+
       filtered = filtered.filter(agency => 
         agency.name.toLowerCase().includes(term) ||
         agency.address.toLowerCase().includes(term) ||
@@ -368,53 +424,81 @@ const FindNearbyAgenciesPage: React.FC = () => {
       );
     }
     
-    // Apply day filters
-    if (selectedDays.length > 0) {
-      filtered = filtered.filter(agency => 
-        selectedDays.some(day => isAgencyOpenOnDay(agency, day))
-      );
-    }
-    
-    // Apply time block filters
-    if (selectedTimeBlocks.length > 0) {
-      filtered = filtered.filter(agency => 
-        selectedTimeBlocks.some(timeBlock => isAgencyOpenDuringTimeBlock(agency, timeBlock))
-      );
-    }
-    
-    // Apply culture filters
-    if (selectedCultures.length > 0) {
-      filtered = filtered.filter(agency => 
-        selectedCultures.some(culture => doesAgencyServeCulture(agency, culture))
-      );
-    }
-    
-    // Apply distribution model filters
-    if (selectedDistributionModels.length > 0) {
-      filtered = filtered.filter(agency => 
-        selectedDistributionModels.some(model => 
-          agency.distribution_model ? 
-            agency.distribution_model.toLowerCase().includes(model.toLowerCase()) : 
-            false
-        )
-      );
-    }
-    
-    // Apply food format filters
-    if (selectedFoodFormats.length > 0) {
-      filtered = filtered.filter(agency => 
-        selectedFoodFormats.some(format => detectFoodFormat(agency, format))
-      );
-    }
-    
-    // Apply prepared meals filter
-    if (preparedMealsOnly) {
-      filtered = filtered.filter(agency => doesAgencyOfferPreparedMeals(agency));
+    // Time blocks are matched on the hours index, built from the minute intervals of
+    // every slot, rather than by parsing the hours strings of every agency
+    if (hoursIndex) {
+      const open = matchTimeBlocks(hoursIndex.hours, selectedTimeBlocks);
+      if (open) {
+        filtered = filtered.filter(agency => open[hoursIndex.ordinals[agency.name]] === 1);
+      }
     }
-    
-    // Apply home delivery filter
-    if (homeDeliveryOnly) {
-      filtered = filtered.filter(agency => doesAgencyOfferHomeDelivery(agency));
+
+    // Apply the day, time block, culture, distribution model, food format and
+    // yes/no filters with the facet indexes when they're available
+    const flags: FacetFlag[] = [];
+    if (preparedMealsOnly) flags.push('prepared_meals');
+    if (homeDeliveryOnly) flags.push('home_delivery');
+    const matched = facetIndex ? matchFacets(facetIndex.facets, {
+      day: selectedDays,
+      time_block: hoursIndex ? [] : selectedTimeBlocks,
+      culture: selectedCultures,
+      distribution_model: selectedDistributionModels,
+      food_format: selectedFoodFormats
+    }, flags) : undefined;
+
+    if (matched !== undefined) {
+      if (matched && facetIndex) {
+        filtered = filtered.filter(agency => matched[facetIndex.ordinals[agency.name]] === 1);
+      }
+    } else {
+      // Apply day filters
+      if (selectedDays.length > 0) {
+        filtered = filtered.filter(agency => 
+          selectedDays.some(day => isAgencyOpenOnDay(agency, day))
+        );
+      }
+      
+      // Apply time block filters
+      if (selectedTimeBlocks.length > 0 && !hoursIndex) {
+        filtered = filtered.filter(agency => 
+          selectedTimeBlocks.some(timeBlock => isAgencyOpenDuringTimeBlock(agency, timeBlock))
+        );
+      }
+      
+      // Apply culture filters
+      if (selectedCultures.length > 0) {
+        filtered = filtered.filter(agency => 
+          selectedCultures.some(culture => doesAgencyServeCulture(agency, culture))
+        );
+      }
+      
+      // Apply distribution model filters
+      if (selectedDistributionModels.length > 0) {
+        filtered = filtered.filter(agency => 
+          selectedDistributionModels.some(model => 
+            agency.distribution_model ? 
+              agency.distribution_model.toLowerCase().includes(model.toLowerCase()) : 
+              false
+          )
+        );
+      }
+      
+      // Apply food format filters
+      if (selectedFoodFormats.length > 0) {
+        filtered = filtered.filter(agency => 
+          selectedFoodFormats.some(format => detectFoodFormat(agency, format))
+        );
+      }
+      
+      // Apply prepared meals filter
+      if (preparedMealsOnly) {
+        filtered = filtered.filter(agency => doesAgencyOfferPreparedMeals(agency));
+      }
+      
+      // Apply home delivery filter
+      if (homeDeliveryOnly) {
+        filtered = filtered.filter(agency => doesAgencyOfferHomeDelivery(agency));
+      }
     }
     
     setFilteredAgencies(filtered);
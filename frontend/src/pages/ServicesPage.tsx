@@ -1,18 +1,15 @@
 import React, { useState, useEffect } from 'react';
 import { useParams, Link } from 'react-router-dom';
-import { Service, Agency } from '../types';
+import { Service } from '../types';
 import ServiceCard from '../components/ServiceCard';
 import { ArrowLeft, Search, FilterX, Loader } from 'lucide-react';
 import servicesData from '../data/services.json';
-
-// Define types for the imported JSON data
-interface ServicesData {
-  services: Array<{id: string, name: string}>;
-  agencyData: Record<string, Agency[]>;
-}
+import { ServicesData, expandAgencyData } from '../utils/servicesData';
 
 // Type assertion for the imported data
 const typedServicesData = servicesData as ServicesData;
+// Agencies per service, whichever format services.json was written in
+const expandedAgencyData = expandAgencyData(typedServicesData);
 
 const ServicesPage: React.FC = () => {
   const { serviceId } = useParams<{ serviceId: string }>();
@@ -20,7 +17,7 @@ const ServicesPage: React.FC = () => {
   const [searchTerm, setSearchTerm] = useState('');
   const [loading, setLoading] = useState(true);
   const services = typedServicesData.services;
-  const agencyData = typedServicesData.agencyData;
+  const agencyData = expandedAgencyData;
 
   useEffect(() => {
     setLoading(true);
@@ -43,6 +43,13 @@ export interface Agency {
   cultures_served: string[];
   distance?: number;
   food_format?: string;
+  open_intervals?: number[][];
+  // Display text in the page's language, from a locale bundle (data/locales/<language>/agencies.json)
+  distribution_model_label?: string;
+  food_format_label?: string;
+  requirements_label?: string;
+  appointment_needed_label?: string;
+  cultures_served_labels?: string[];
 }
 
 export interface Service {
@@ -0,0 +1,76 @@
+// agency_facets.json as written by process_agencies.py: for every filter
+// option, the ordinals (positions in agencies.json) of the agencies it matches
+export interface AgencyFacets {
+  count: number;
+  facets: {
+    day: Record<string, number[]>;
+    time_block: Record<string, number[]>;
+    culture: Record<string, number[]>;
+    distribution_model: Record<string, number[]>;
+    food_format: Record<string, number[]>;
+  };
+  flags: {
+    prepared_meals: number[];
+    home_delivery: number[];
+  };
+}
+
+export type FacetSelection = Partial<Record<keyof AgencyFacets['facets'], string[]>>;
+
+export type FacetFlag = keyof AgencyFacets['flags'];
+
+/**
+ * Load the prebuilt facet indexes
+ * @returns The parsed agency_facets.json, or null if it isn't available
+ */
+export async function loadAgencyFacets(): Promise<AgencyFacets | null> {
+  try {
+    const response = await fetch('/data/agency_facets.json');
+    if (!response.ok) return null;
+    return await response.json();
+  } catch (error) {
+    console.warn('Facet indexes not available, filtering by scanning agencies instead:', error);
+    return null;
+  }
+}
+
+/**
+ * Get the agencies matching a filter selection from the facet indexes:
+ * options of one facet are OR-ed, facets and flags are AND-ed
+ * @param facets - The parsed agency_facets.json
+ * @param selection - Selected options per facet
+ * @param flags - Yes/no filters that are switched on
+ * @returns Membership per agency ordinal, or null if nothing is selected;
+ *   undefined when an option isn't in the index and the caller has to scan
+ */
+export function matchFacets(
+  facets: AgencyFacets,
+  selection: FacetSelection,
+  flags: FacetFlag[] = []
+): Uint8Array | null | undefined {
+  // One group of posting lists per active facet or flag; a group matches if any of its lists does
+  const groups: number[][][] = [];
+  for (const [facet, options] of Object.entries(selection)) {
+    if (!options || !options.length) continue;
+    const index = facets.facets[facet as keyof AgencyFacets['facets']];
+    if (!index || options.some(option => !index[option])) return undefined;
+    groups.push(options.map(option => index[option]));
+  }
+  for (const flag of flags) {
+    groups.push([facets.flags[flag]]);
+  }
+  if (!groups.length) return null;
+
+  // Count the groups each agency is in; it matches when it is in all of them
+  const hits = new Uint8Array(facets.count);
+  for (const group of groups) {
+    const matched = new Uint8Array(facets.count);
+    for (const ordinals of group) {
+      for (const ordinal of ordinals) matched[ordinal] = 1;
+    }
+    for (let i = 0; i < hits.length; i++) hits[i] += matched[i];
+  }
+  const result = new Uint8Array(facets.count);
+  for (let i = 0; i < hits.length; i++) result[i] = hits[i] === groups.length ? 1 : 0;
+  return result;
+}
@@ -0,0 +1,79 @@
+// Hours of operation as [start, end) minute intervals counted from Monday 00:00,
+// as written by process_agencies.py (agency_hours.json) and process_services.py
+// (open_intervals of every services.json agency)
+export type OpenIntervals = number[][];
+
+// agency_hours.json: the intervals of every agency, in agencies.json order, and
+// for each span between two sorted interval boundaries the agencies open during it
+export interface AgencyHours {
+  count: number;
+  intervals: OpenIntervals[];
+  index: {
+    boundaries: number[];
+    open: number[][];
+  };
+}
+
+const MINUTES_PER_DAY = 24 * 60;
+
+/**
+ * Load the prebuilt hours index
+ * @returns The parsed agency_hours.json, or null if it isn't available
+ */
+export async function loadAgencyHours(): Promise<AgencyHours | null> {
+  try {
+    const response = await fetch('/data/agency_hours.json');
+    if (!response.ok) return null;
+    return await response.json();
+  } catch (error) {
+    console.warn('Hours index not available:', error);
+    return null;
+  }
+}
+
+// Index of the span (between two sorted boundaries) holding a minute, or -1 before the first
+function spanAt(boundaries: number[], minute: number): number {
+  let low = 0;
+  let high = boundaries.length;
+  while (low < high) {
+    const middle = (low + high) >> 1;
+    if (boundaries[middle] <= minute) low = middle + 1;
+    else high = middle;
+  }
+  return low - 1;
+}
+
+/**
+ * Get the agencies open at some point of a range of the week, with one binary
+ * search over the index and a walk over the spans the range covers
+ * @param hours - The parsed agency_hours.json
+ * @param from - First minute of the range, counted from Monday 00:00
+ * @param to - Minute the range ends at (exclusive)
+ * @param matched - Membership to add the open agencies to, a new one by default
+ * @returns Membership per agency ordinal (position in agencies.json)
+ */
+export function agenciesOpenDuring(hours: AgencyHours, from: number, to: number, matched = new Uint8Array(hours.count)): Uint8Array {
+  const { boundaries, open } = hours.index;
+  for (let span = Math.max(spanAt(boundaries, from), 0); span < boundaries.length && boundaries[span] < to; span++) {
+    for (const ordinal of open[span]) matched[ordinal] = 1;
+  }
+  return matched;
+}
+
+/**
+ * Get the agencies open during any of the selected time blocks on any day
+ * @param hours - The parsed agency_hours.json
+ * @param timeBlocks - Hour ranges such as "6-12" (from 06:00 up to 12:00)
+ * @returns Membership per agency ordinal, or null if no time block is selected
+ */
+export function matchTimeBlocks(hours: AgencyHours, timeBlocks: string[]): Uint8Array | null {
+  if (!timeBlocks.length) return null;
+  const matched = new Uint8Array(hours.count);
+  for (const timeBlock of timeBlocks) {
+    const [startHour, endHour] = timeBlock.split('-').map(Number);
+    for (let day = 0; day < 7; day++) {
+      agenciesOpenDuring(hours, day * MINUTES_PER_DAY + startHour * 60, day * MINUTES_PER_DAY + endHour * 60, matched);
+    }
+  }
+  return matched;
+}
@@ -0,0 +1,53 @@
+export type Coordinates = { lat: number, lng: number };
+
+// One agency of agency_locations.json, in the same order as agencies.json.
+// lat and lng are null when the address could not be geocoded at build time
+export interface AgencyLocation {
+  name: string;
+  address: string;
+  lat: number | null;
+  lng: number | null;
+  source: string | null;
+}
+
+// agency_locations.json as written by `python etl.py locations`. The grid index
+// answers nearest-agency queries in the agency service (agency_service.py); the
+// page only needs the coordinates, since it lists every agency by distance
+export interface AgencyLocations {
+  agencies: AgencyLocation[];
+  index: {
+    type: 'grid';
+    cell_degrees: number;
+    cells: Record<string, number[]>;
+  };
+}
+
+/**
+ * Load the prebuilt agency locations
+ * @returns The parsed agency_locations.json, or null if it isn't available
+ */
+export async function loadAgencyLocations(): Promise<AgencyLocations | null> {
+  try {
+    const response = await fetch('/data/agency_locations.json');
+    if (!response.ok) return null;
+    return await response.json();
+  } catch (error) {
+    console.warn('Agency locations not available, geocoding addresses instead:', error);
+    return null;
+  }
+}
+
+/**
+ * Get the precomputed coordinates of every geocoded agency address
+ * @param locations - The parsed agency_locations.json
+ * @returns Coordinates by agency address
+ */
+export function coordinatesByAddress(locations: AgencyLocations): Record<string, Coordinates> {
+  const coordinates: Record<string, Coordinates> = {};
+  for (const location of locations.agencies) {
+    if (location.lat !== null && location.lng !== null) {
+      coordinates[location.address] = { lat: location.lat, lng: location.lng };
+    }
+  }
+  return coordinates;
+}
@@ -0,0 +1,98 @@
+// agency_search.json as written by process_agencies.py: every lower-cased
+// alphanumeric token of the searched agency fields, with the ordinals
+// (positions in agencies.json) of the agencies using it
+export interface AgencySearchIndex {
+  count: number;
+  terms: string[];
+  postings: number[][];
+}
+
+// A search index ready for queries: every suffix of every term, sorted, with the term it comes from
+export interface PreparedSearch {
+  count: number;
+  postings: number[][];
+  suffixes: string[];
+  suffixTerms: number[];
+}
+
+// Same tokens as process_agencies.py (ASCII letters and digits)
+const TOKEN_PATTERN = /[a-z0-9]+/g;
+
+/**
+ * Load the prebuilt search index
+ * @returns The parsed agency_search.json, or null if it isn't available
+ */
+export async function loadAgencySearch(): Promise<AgencySearchIndex | null> {
+  try {
+    const response = await fetch('/data/agency_search.json');
+    if (!response.ok) return null;
+    return await response.json();
+  } catch (error) {
+    console.warn('Search index not available, searching by scanning agencies instead:', error);
+    return null;
+  }
+}
+
+/**
+ * Sort the suffixes of every term once so terms containing a string can be found by binary search
+ * @param index - The parsed agency_search.json
+ * @returns The index prepared for searchCandidates
+ */
+export function prepareAgencySearch(index: AgencySearchIndex): PreparedSearch {
+  const pairs: [string, number][] = [];
+  index.terms.forEach((term, number) => {
+    for (let start = 0; start < term.length; start++) pairs.push([term.slice(start), number]);
+  });
+  pairs.sort((a, b) => (a[0] < b[0] ? -1 : a[0] > b[0] ? 1 : a[1] - b[1]));
+  return {
+    count: index.count,
+    postings: index.postings,
+    suffixes: pairs.map(pair => pair[0]),
+    suffixTerms: pairs.map(pair => pair[1]),
+  };
+}
+
+function lowerBound(values: string[], target: string, start: number = 0): number {
+  let low = start;
+  let high = values.length;
+  while (low < high) {
+    const middle = (low + high) >> 1;
+    if (values[middle] < target) low = middle + 1;
+    else high = middle;
+  }
+  return low;
+}
+
+/**
+ * Get the agencies that may contain a search term. Every agency whose fields
+ * contain the term is a candidate, so checking the term against the candidates
+ * alone gives the same result as checking it against every agency
+ * @param prepared - The prepared search index
+ * @param term - The search term
+ * @returns Candidate flag per agency ordinal, or null if every agency is a candidate
+ */
+export function searchCandidates(prepared: PreparedSearch, term: string): Uint8Array | null {
+  const runs = Array.from(new Set(term.toLowerCase().match(TOKEN_PATTERN) || []));
+  if (!runs.length) return null;
+
+  // Longest runs first, they match the fewest terms
+  runs.sort((a, b) => b.length - a.length);
+  let candidates: Uint8Array | null = null;
+  for (const run of runs) {
+    const start = lowerBound(prepared.suffixes, run);
+    const end = lowerBound(prepared.suffixes, run + '\x7f', start);
+    const matched = new Uint8Array(prepared.count);
+    const seen = new Set<number>();
+    for (let i = start; i < end; i++) {
+      const number = prepared.suffixTerms[i];
+      if (seen.has(number)) continue;
+      seen.add(number);
+      for (const ordinal of prepared.postings[number]) matched[ordinal] = 1;
+    }
+    if (candidates) {
+      for (let i = 0; i < matched.length; i++) matched[i] &= candidates[i];
+    }
+    candidates = matched;
+  }
+  return candidates;
+}
@@ -6,6 +6,9 @@ const GOOGLE_API_KEY = import.meta.env.VITE_GOOGLE_MAPS_API_KEY;
 // URL for the backend proxy
 const PROXY_URL = import.meta.env.VITE_BACKEND_URL || 'http://localhost:3001';
 
+// URL of backend/agency_service.py, which ranks agencies by road distance with few routing calls
+const AGENCY_SERVICE_URL = import.meta.env.VITE_AGENCY_SERVICE_URL;
+
 // Cache to store distance matrix results to avoid redundant API calls
 const distanceMatrixCache: Record<string, number> = {};
 
@@ -88,12 +91,14 @@ function toRadians(degrees: number): number {
  * @param origin - Origin location (address, ZIP code, or coordinates)
  * @param destinations - Array of destination addresses
  * @param batchSize - Number of destinations per API call (max 25 recommended)
+ * @param knownCoords - Precomputed destination coordinates by address, used by the fallback
  * @returns Object mapping each destination to its distance in miles
  */
 export async function computeDistanceMatrix(
   origin: string,
   destinations: string[],
-  batchSize: number = 25
+  batchSize: number = 25,
+  knownCoords: Record<string, {lat: number, lng: number}> = {}
 ): Promise<Record<string, number>> {
   if (!destinations.length) return {};
   
@@ -158,7 +163,7 @@ export async function computeDistanceMatrix(
   // Process addresses that failed with the API using fallback method
   if (errorAddresses.length > 0) {
     console.log(`Using fallback method for ${errorAddresses.length} addresses`);
-    const fallbackResults = await calculateFallbackDistances(origin, errorAddresses);
+    const fallbackResults = await calculateFallbackDistances(origin, errorAddresses, knownCoords);
     Object.assign(results, fallbackResults);
   }
   
@@ -167,10 +172,12 @@ export async function computeDistanceMatrix(
 
 /**
  * Calculate distances using fallback methods for addresses that failed with the API
+ * Destinations in knownCoords (geocoded at build time) are not geocoded again
  */
 async function calculateFallbackDistances(
   origin: string,
-  addresses: string[]
+  addresses: string[],
+  knownCoords: Record<string, {lat: number, lng: number}> = {}
 ): Promise<Record<string, number>> {
   const results: Record<string, number> = {};
   
@@ -191,7 +198,7 @@ async function calculateFallbackDistances(
     try {
       // Try calculating using coordinates if we have them
       if (originCoords) {
-        const destCoords = await geocodeLocation(address);
+        const destCoords = knownCoords[address] || await geocodeLocation(address);
         if (destCoords) {
           distance = calculateHaversineDistance(
             originCoords.lat, 
@@ -266,17 +273,52 @@ function estimateDistanceByZipCode(zip1: string, zip2: string, address?: string)
   return Math.max(0.1, distance);
 }
 
+/**
+ * Get distances from the agency service: by road for the nearest agencies
+ * (from its persistent route cache or a few routing calls), in a straight line
+ * for the rest
+ * @param origin - Origin location (address, ZIP code, or "lat,lng")
+ * @param k - Number of nearest agencies to get road distances for
+ * @returns Object mapping each geocoded agency address to its distance in miles,
+ *   or null if the service isn't configured or can't place the origin
+ */
+export async function fetchServiceDistances(
+  origin: string,
+  k: number = 10
+): Promise<Record<string, number> | null> {
+  if (!AGENCY_SERVICE_URL) return null;
+
+  try {
+    const response = await fetch(
+      `${AGENCY_SERVICE_URL}/api/distances?origin=${encodeURIComponent(origin)}&k=${k}`
+    );
+    if (!response.ok) return null;
+
+    const data = await response.json();
+    const results: Record<string, number> = {};
+    data.distances.forEach((entry: { address: string, miles: number }) => {
+      results[entry.address] = Math.max(0.1, entry.miles);
+    });
+    return results;
+  } catch (error) {
+    console.warn('Agency service distances not available:', error);
+    return null;
+  }
+}
+
 /**
  * Sort agencies by their distance from a given location
  * @param agencies - Array of agency objects
  * @param userLocation - User's location (ZIP code or coordinates)
  * @param useProxyApi - Whether to use the proxy API (true) or fallback method (false)
+ * @param knownCoords - Precomputed agency coordinates by address (see agencyLocations.ts)
  * @returns Promise with sorted array of agencies with distances
  */
 export async function sortAgenciesByDistance(
   agencies: Agency[],
   userLocation: string,
-  useProxyApi: boolean = true
+  useProxyApi: boolean = true,
+  knownCoords: Record<string, {lat: number, lng: number}> = {}
 ): Promise<Agency[]> {
   if (!agencies.length) return [];
   
@@ -285,10 +327,17 @@ export async function sortAgenciesByDistance(
     .map(agency => agency.address)
     .filter(address => !!address);
   
-  // Calculate distances for all addresses
-  const distanceResults = useProxyApi 
-    ? await computeDistanceMatrix(userLocation, addresses)
-    : await computeDistanceMatrixFallback(userLocation, addresses);
+  // Ask the agency service first; only the addresses it couldn't place are computed here
+  const serviceResults = await fetchServiceDistances(userLocation) || {};
+  const remaining = addresses.filter(address => serviceResults[address] === undefined);
+
+  // Calculate distances for the remaining addresses
+  const distanceResults = { ...serviceResults };
+  if (remaining.length) {
+    Object.assign(distanceResults, useProxyApi
+      ? await computeDistanceMatrix(userLocation, remaining, 25, knownCoords)
+      : await computeDistanceMatrixFallback(userLocation, remaining, knownCoords));
+  }
   
   // Add distance information to agencies
   const agenciesWithDistance = agencies.map(agency => {
@@ -316,10 +365,11 @@ export async function sortAgenciesByDistance(
 // Use this as a temporary solution until the proxy is set up
 export async function computeDistanceMatrixFallback(
   origin: string,
-  destinations: string[]
+  destinations: string[],
+  knownCoords: Record<string, {lat: number, lng: number}> = {}
 ): Promise<Record<string, number>> {
   if (!destinations.length) return {};
   
   console.log('Using fallback calculation for all distances');
-  return calculateFallbackDistances(origin, destinations);
+  return calculateFallbackDistances(origin, destinations, knownCoords);
 } 
\ No newline at end of file
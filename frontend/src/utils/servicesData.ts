@@ -0,0 +1,38 @@
+import { Agency } from '../types';
+
+type ServiceEntry = { id: string, name: string };
+
+// services.json as written by default: every service lists full agency records
+interface NestedServicesData {
+  services: ServiceEntry[];
+  agencyData: Record<string, Agency[]>;
+}
+
+// services.json written with --services-format normalized: each agency record
+// is stored once and services list offsets into that table
+interface NormalizedServicesData {
+  format: 'normalized';
+  services: ServiceEntry[];
+  agencies: Agency[];
+  agencyData: Record<string, number[]>;
+}
+
+export type ServicesData = NestedServicesData | NormalizedServicesData;
+
+/**
+ * Get the agencies of every service from either services.json format
+ * @param data - The parsed services.json
+ * @returns The agencies per service ID, in the nested shape ServicesPage uses
+ */
+export function expandAgencyData(data: ServicesData): Record<string, Agency[]> {
+  if (!('format' in data) || data.format !== 'normalized') {
+    return data.agencyData as Record<string, Agency[]>;
+  }
+
+  // Services share the agency objects instead of each holding a copy
+  const agencyData: Record<string, Agency[]> = {};
+  for (const [serviceId, offsets] of Object.entries(data.agencyData)) {
+    agencyData[serviceId] = offsets.map(offset => data.agencies[offset]);
+  }
+  return agencyData;
+}